@@ -9,12 +9,26 @@ from flask import Flask
 from flask_cors import CORS
 
 from api.routes import rest_api
-from models import db
+from models import db, Rides, RideOffers
+from services import departure_index, offer_index, ride_index, saved_search_index, search_cache
+from utils.gazetteer import gazetteer
+from utils.geocoding import geocode_cache
+from utils.location_utils import location_cache
+from utils.token_cache import token_cache
 
 app = Flask(__name__)
 
 app.config.from_object('api.config.BaseConfig')
 
+search_cache.configure(app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL_SECONDS'],
+                       app.config['SEARCH_CACHE_MAX_CANDIDATES'])
+location_cache.configure(app.config['LOCATION_CACHE_SIZE'])
+token_cache.configure(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL_SECONDS'])
+geocode_cache.configure(app.config['GEOCODE_CACHE_SIZE'], app.config['GEOCODE_CACHE_TTL_SECONDS'],
+                        app.config['GEOCODE_NEGATIVE_TTL_SECONDS'], app.config['GEOCODE_CACHE_PATH'] or None)
+if app.config['GAZETTEER_PATH'] and os.path.exists(app.config['GAZETTEER_PATH']):
+    print(f"> Gazetteer loaded with {gazetteer.load(app.config['GAZETTEER_PATH'])} places")
+
 
 
 db.init_app(app)
@@ -47,6 +61,19 @@ def initialize_database():
         print('> Fallback to SQLite ')
         db.create_all()
 
+    # Bring rides created before the numeric coordinate columns up to date
+    Rides.migrate_coordinate_columns()
+    Rides.backfill_coordinates()
+    Rides.create_spatial_index()
+    RideOffers.migrate_coordinate_columns()
+    RideOffers.backfill_coordinates()
+
+    # Load the in-process spatial index of waiting rides
+    print(f'> Ride index loaded with {ride_index.rebuild()} rides')
+    print(f'> Departure index loaded with {departure_index.rebuild()} rides')
+    print(f'> Ride offer index loaded with {offer_index.rebuild()} open offers')
+    print(f'> Saved search index loaded with {saved_search_index.rebuild()} searches')
+
 
 """
    Custom responses
@@ -25,6 +25,55 @@ class BaseConfig():
 
     GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY', None)
 
+    # Google Maps client: MAPS_BASE_URL points it at another server, e.g. utils/maps_stub_server.py
+    MAPS_BASE_URL = os.getenv('MAPS_BASE_URL', None)
+    MAPS_CONNECT_TIMEOUT_SECONDS = float(os.getenv('MAPS_CONNECT_TIMEOUT_SECONDS', 2))
+    MAPS_READ_TIMEOUT_SECONDS = float(os.getenv('MAPS_READ_TIMEOUT_SECONDS', 5))
+    MAPS_POOL_SIZE = int(os.getenv('MAPS_POOL_SIZE', 10))
+    MAPS_MAX_CONCURRENCY = int(os.getenv('MAPS_MAX_CONCURRENCY', 8))
+    # Calls slower than MAPS_SLOW_CALL_SECONDS count as failures; after MAPS_BREAKER_FAILURES failures in a row
+    # distances are computed with haversine for MAPS_BREAKER_RESET_SECONDS
+    MAPS_SLOW_CALL_SECONDS = float(os.getenv('MAPS_SLOW_CALL_SECONDS', 3))
+    MAPS_BREAKER_FAILURES = int(os.getenv('MAPS_BREAKER_FAILURES', 5))
+    MAPS_BREAKER_RESET_SECONDS = float(os.getenv('MAPS_BREAKER_RESET_SECONDS', 30))
+
+    # Offline road network for driving distances without Google, built with `flask build-road-graph`
+    ROAD_GRAPH_PATH = os.getenv('ROAD_GRAPH_PATH', os.path.join(BASE_DIR, 'road_graph.npz'))
+    ROAD_GRAPH_MAX_SNAP_KM = float(os.getenv('ROAD_GRAPH_MAX_SNAP_KM', 1.0))
+
+    # Cache of Google driving distances, in memory and in a SQLite file; DISTANCE_CACHE_PATH='' keeps it in memory
+    DISTANCE_CACHE_SIZE = int(os.getenv('DISTANCE_CACHE_SIZE', 10000))
+    DISTANCE_CACHE_TTL_SECONDS = int(os.getenv('DISTANCE_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+    DISTANCE_CACHE_PATH = os.getenv('DISTANCE_CACHE_PATH', os.path.join(BASE_DIR, 'distance_cache.sqlite3'))
+
+    # Offline place names, see utils/gazetteer.py; used before remote geocoding when the file exists
+    GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', os.path.join(BASE_DIR, 'gazetteer.tsv'))
+
+    # Geocoded addresses: found ones are kept GEOCODE_CACHE_TTL_SECONDS, unknown ones GEOCODE_NEGATIVE_TTL_SECONDS;
+    # GEOCODE_CACHE_PATH keeps them in a SQLite file as well. GEOCODE_ON_POST geocodes ride addresses when posted
+    GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', 2048))
+    GEOCODE_CACHE_TTL_SECONDS = int(os.getenv('GEOCODE_CACHE_TTL_SECONDS', 90 * 24 * 3600))
+    GEOCODE_NEGATIVE_TTL_SECONDS = int(os.getenv('GEOCODE_NEGATIVE_TTL_SECONDS', 10 * 60))
+    GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', '')
+    GEOCODE_ON_POST = os.getenv('GEOCODE_ON_POST', 'true' if GOOGLE_MAPS_API_KEY else 'false').lower() == 'true'
+
+    # Relative band around a search radius in which haversine is re-checked with the exact geodesic
+    DISTANCE_ERROR_BAND = float(os.getenv('DISTANCE_ERROR_BAND', 0.006))
+
+    # Shared ride search cache, SEARCH_CACHE_SIZE=0 disables it. Each entry holds at most
+    # SEARCH_CACHE_MAX_CANDIDATES rides; later pages are read from SQL
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 512))
+    SEARCH_CACHE_TTL_SECONDS = int(os.getenv('SEARCH_CACHE_TTL_SECONDS', 60))
+    SEARCH_CACHE_MAX_CANDIDATES = int(os.getenv('SEARCH_CACHE_MAX_CANDIDATES', 500))
+
+    # Parsed "lat,lng" location strings kept per worker, LOCATION_CACHE_SIZE=0 disables it
+    LOCATION_CACHE_SIZE = int(os.getenv('LOCATION_CACHE_SIZE', 4096))
+
+    # Checked JWT tokens kept per worker, so protected requests skip the user and blocklist queries;
+    # a logout or user change in another worker is seen within TOKEN_CACHE_TTL_SECONDS. TOKEN_CACHE_SIZE=0 disables it
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 2048))
+    TOKEN_CACHE_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_TTL_SECONDS', 60))
+
     TIMEZONE_STR = os.getenv('TIMEZONE_STR', 'Asia/Jerusalem')
     TIMEZONE = pytz.timezone(TIMEZONE_STR)
 
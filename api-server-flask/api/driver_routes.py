@@ -2,7 +2,7 @@ from flask import request
 from flask_restx import Resource, Namespace, fields
 
 from services.driver_service import DriverService
-from utils.response import Response
+from utils.response import Response, wants_ndjson
 
 from .token_decorators import token_required
 
@@ -84,7 +84,7 @@ class ManageUserRidePosts(Resource):
             return response.to_tuple()
 
         # Fetch the ride posts associated with the specified user ID using DriverService
-        return DriverService.get_ride_posts_by_user_id(user_id)
+        return DriverService.get_ride_posts_by_user_id(user_id, stream=wants_ndjson())
 
 
 @driver_ns.doc(security='JWT Bearer')
@@ -171,6 +171,31 @@ class ManagePassengerRequests(Resource):
             response = Response(success=False, message=str(e), status_code=500)
             return response.to_tuple()
 
+@driver_ns.doc(security='JWT Bearer')
+@driver_ns.route('/<int:user_id>/rides/<int:ride_id>/matches')
+class RideMatches(Resource):
+    """
+    Allows drivers to see the passengers' ride offers matched with their ride.
+    """
+
+    @token_required
+    def get(self, current_user, user_id, ride_id):
+        """
+        Retrieves the ride offers suggested for the selected ride.
+        """
+        try:
+            # Check if the current user is authorized to view the ride posts of the specified user
+            if current_user.id != user_id:
+                response = Response(success=False, message="Unauthorized access to user's ride posts", status_code=403)
+                return response.to_tuple()
+
+            return DriverService.get_ride_matches(current_user, ride_id)
+
+        except Exception as e:
+            response = Response(success=False, message=str(e), status_code=500)
+            return response.to_tuple()
+
+
 @driver_ns.doc(security='JWT Bearer')
 @driver_ns.route('/<int:user_id>/future-rides')
 class ManageUserFutureRides(Resource):
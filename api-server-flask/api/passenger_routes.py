@@ -3,13 +3,17 @@ from flask import request
 from flask_restx import Resource, Namespace, fields
 from services.passenger_service import PassengerService
 from services.driver_service import DriverService
+from services.saved_search_service import SavedSearchService
 from datetime import datetime
 
-from utils.response import Response
+from utils.response import Response, StreamingResponse, wants_ndjson
 from .token_decorators import token_required
 
 DEFAULT_RADIUS = 10
 DEFAULT_AVAILABLE_SEATS = 1
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+MAX_BATCH_QUERIES = 20
 
 # TODO: After adding the passenger service remove from comment
 passenger_service = PassengerService()
@@ -46,7 +50,39 @@ passenger_search_rides = passenger_ns.model('SearchRides', {
     "drop_radius": fields.Float(required=False),
     "departure_datetime": fields.DateTime(required=False),
     "available_seats": fields.Integer(required=False),
-    "delta_hours": fields.Float(required=False, default=5)
+    "delta_hours": fields.Float(required=False, default=5),
+    "limit": fields.Integer(required=False, default=DEFAULT_SEARCH_LIMIT, min=1, max=MAX_SEARCH_LIMIT),
+    "cursor": fields.String(required=False, description="next_cursor of the previous page, not with ranked"),
+    "ranked": fields.Boolean(required=False, default=False,
+                             description="Return the best `limit` rides by detour and departure time gap"),
+    "corridor": fields.Boolean(required=False, default=False,
+                               description="Match the pickup and drop points along the driver's route")
+})
+
+passenger_batch_search_query = passenger_ns.model('BatchSearchQuery', {
+    "id": fields.String(required=True, description="Key of this query's results in the response"),
+    "departure_location": fields.String(required=False),
+    "pickup_radius": fields.Float(required=False),
+    "destination": fields.String(required=False),
+    "drop_radius": fields.Float(required=False),
+    "departure_datetime": fields.DateTime(required=False),
+    "available_seats": fields.Integer(required=False),
+    "delta_hours": fields.Float(required=False, default=5),
+    "limit": fields.Integer(required=False, default=DEFAULT_SEARCH_LIMIT, min=1, max=MAX_SEARCH_LIMIT)
+})
+
+passenger_saved_search = passenger_ns.model('SavedSearch', {
+    "departure_location": fields.String(required=False),
+    "pickup_radius": fields.Float(required=False),
+    "destination": fields.String(required=False),
+    "drop_radius": fields.Float(required=False),
+    "departure_datetime": fields.DateTime(required=True),
+    "delta_hours": fields.Float(required=False, default=5),
+    "available_seats": fields.Integer(required=False)
+})
+
+passenger_batch_search_rides = passenger_ns.model('BatchSearchRides', {
+    "queries": fields.List(fields.Nested(passenger_batch_search_query), required=True)
 })
 
 
@@ -72,8 +108,14 @@ class MakeRideOffer(Resource):
         _pickup_radius = req_data.get("pickup_radius")
         _destination = req_data.get("destination")
         _drop_radius = req_data.get("drop_radius")
-        _departure_datetime = req_data.get("departure_datetime")
         _notes = req_data.get("notes")
+        # Any ISO 8601 value the model accepts; like the other departure times, it is stored as a naive
+        # datetime with the offset dropped
+        try:
+            _departure_datetime = fields.DateTime().parse(req_data.get("departure_datetime")).replace(tzinfo=None)
+        except ValueError as e:
+            response = Response(success=False, message=f"Invalid departure_datetime: {str(e)}", status_code=400)
+            return response.to_tuple()
 
         # Call the service method to post the future ride
         success = passenger_service.makeRideOffer(current_user.id, _departure_location, _pickup_radius, _destination,
@@ -127,6 +169,18 @@ class SearchRides(Resource):
         departure_date_str = req_data.get("departure_datetime", None)
         available_seats = req_data.get("available_seats", DEFAULT_AVAILABLE_SEATS)
         delta_hours = req_data.get("delta_hours", 5)
+        # Streamed results are not held in memory, so they are not paged unless a limit is given
+        stream = wants_ndjson()
+        limit = req_data.get("limit", None if stream else DEFAULT_SEARCH_LIMIT)
+        cursor = req_data.get("cursor", None)
+        ranked = req_data.get("ranked", False)
+        corridor = req_data.get("corridor", False)
+
+        # Ranked results are the top rides of the whole search, they have no next page to point to
+        if ranked and cursor:
+            response = Response(success=False, message="Error searching rides: cursor cannot be used with ranked "
+                                                       "results, which are not paginated", status_code=400)
+            return response.to_tuple()
 
         # Parse departure_date as datetime
         if departure_date_str:
@@ -138,7 +192,50 @@ class SearchRides(Resource):
         # Search rides using PassengerService
         return PassengerService.search_rides(current_user.id, departure_location, pickup_radius, destination,
                                              drop_radius,
-                                             departure_date, available_seats, delta_hours)
+                                             departure_date, available_seats, delta_hours, limit, cursor, ranked,
+                                             stream, corridor)
+
+
+@passenger_ns.doc(security='JWT Bearer')
+@passenger_ns.route('/search-rides/batch')
+class BatchSearchRides(Resource):
+    """
+    Allows passengers to run several ride searches in one request.
+    """
+
+    @passenger_ns.expect(passenger_batch_search_rides, validate=True)
+    @token_required
+    def post(self, current_user):
+        req_data = request.get_json()
+        queries = req_data.get("queries", [])
+
+        if len(queries) > MAX_BATCH_QUERIES:
+            response = Response(success=False, message=f"Error searching rides: at most {MAX_BATCH_QUERIES} queries "
+                                                       f"are allowed per batch", status_code=400)
+            return response.to_tuple()
+        if len({query["id"] for query in queries}) != len(queries):
+            response = Response(success=False, message="Error searching rides: query ids must be unique",
+                                status_code=400)
+            return response.to_tuple()
+
+        search_queries = []
+        for query in queries:
+            departure_date_str = query.get("departure_datetime", None)
+            search_queries.append({
+                "id": query["id"],
+                "departure_location": query.get("departure_location", None),
+                "pickup_radius": query.get("pickup_radius", DEFAULT_RADIUS),
+                "destination": query.get("destination", None),
+                "drop_radius": query.get("drop_radius", DEFAULT_RADIUS),
+                "departure_date": datetime.strptime(departure_date_str, '%Y-%m-%dT%H:%M:%S.%fZ')
+                if departure_date_str else datetime.now(),
+                "available_seats": query.get("available_seats", DEFAULT_AVAILABLE_SEATS),
+                "delta_hours": query.get("delta_hours", 5),
+                "limit": query.get("limit", DEFAULT_SEARCH_LIMIT)
+            })
+
+        # Search rides using PassengerService
+        return PassengerService.search_rides_batch(current_user.id, search_queries)
 
 
 @passenger_ns.doc(security='JWT Bearer')
@@ -152,6 +249,8 @@ class GetMyRideRequests(Resource):
                                 status_code=403)
             return response.to_tuple()
         try:
+            if wants_ndjson():
+                return StreamingResponse(passenger_service.get_my_rides(user_id, stream=True)).to_response()
             resp = passenger_service.get_my_rides(user_id)
         except Exception as e:
             response = Response(success=False,
@@ -165,5 +264,51 @@ class GetMyRideRequests(Resource):
         return response.to_tuple()
 
 
+@passenger_ns.doc(security='JWT Bearer')
+@passenger_ns.route('/saved-searches')
+class SavedSearchesResource(Resource):
+    """
+    Allows passengers to keep standing searches instead of polling search-rides.
+    """
+
+    @passenger_ns.expect(passenger_saved_search, validate=True)
+    @token_required
+    def post(self, current_user):
+        req_data = request.get_json()
+
+        departure_location = req_data.get("departure_location", None)
+        pickup_radius = req_data.get("pickup_radius", DEFAULT_RADIUS)
+        destination = req_data.get("destination", None)
+        drop_radius = req_data.get("drop_radius", DEFAULT_RADIUS)
+        departure_date = datetime.strptime(req_data.get("departure_datetime"), '%Y-%m-%dT%H:%M:%S.%fZ')
+        delta_hours = req_data.get("delta_hours", 5)
+        available_seats = req_data.get("available_seats", DEFAULT_AVAILABLE_SEATS)
+
+        return SavedSearchService.create_saved_search(current_user.id, departure_location, pickup_radius,
+                                                      destination, drop_radius, departure_date, delta_hours,
+                                                      available_seats)
+
+    @token_required
+    def get(self, current_user):
+        return SavedSearchService.get_saved_searches(current_user.id)
 
 
+@passenger_ns.doc(security='JWT Bearer')
+@passenger_ns.route('/saved-searches/<int:saved_search_id>')
+class SavedSearchResource(Resource):
+    @token_required
+    def delete(self, current_user, saved_search_id):
+        return SavedSearchService.delete_saved_search(current_user.id, saved_search_id)
+
+
+@passenger_ns.doc(security='JWT Bearer', params={'after': 'last_hit_id of the previous read'})
+@passenger_ns.route('/saved-searches/hits')
+class SavedSearchHitsResource(Resource):
+    """
+    The inbox of rides that matched the passenger's saved searches.
+    """
+
+    @token_required
+    def get(self, current_user):
+        after = request.args.get("after", None, type=int)
+        return SavedSearchService.get_hits(current_user.id, after)
@@ -9,6 +9,7 @@ from flask import request
 import jwt
 
 from models import db, JWTTokenBlocklist, Users
+from utils.token_cache import UserSnapshot, token_cache
 from .config import BaseConfig
 
 """
@@ -29,19 +30,29 @@ def token_required(f):
             return {"success": False, "msg": "Valid JWT token is missing"}, 400
 
         try:
-            data = jwt.decode(token, BaseConfig.SECRET_KEY, algorithms=["HS256"])
-            current_user = Users.get_by_email(data["email"])
-
-            if not current_user:
-                return {"success": False,
-                        "msg": "Sorry. Wrong auth token. This user does not exist."}, 400
-
-            token_expired = db.session.query(JWTTokenBlocklist.id).filter_by(jwt_token=token).scalar()
-
-            if token_expired is not None:
+            # A token checked recently in this worker is answered from the cache, without queries
+            cached = token_cache.get(token, request.endpoint)
+            if cached is not None:
+                current_user = UserSnapshot(cached.user_id, cached.email)
+                revoked, jwt_auth_active = cached.revoked, cached.jwt_auth_active
+            else:
+                # Read before the queries, so a logout committed meanwhile keeps this check out of the cache
+                generation = token_cache.generation
+                data = jwt.decode(token, BaseConfig.SECRET_KEY, algorithms=["HS256"])
+                current_user = Users.get_by_email(data["email"])
+
+                if not current_user:
+                    return {"success": False,
+                            "msg": "Sorry. Wrong auth token. This user does not exist."}, 400
+
+                token_expired = db.session.query(JWTTokenBlocklist.id).filter_by(jwt_token=token).scalar()
+                revoked, jwt_auth_active = token_expired is not None, current_user.check_jwt_auth_active()
+                token_cache.put(token, data, current_user, revoked, generation)
+
+            if revoked:
                 return {"success": False, "msg": "Token revoked."}, 400
 
-            if not current_user.check_jwt_auth_active():
+            if not jwt_auth_active:
                 return {"success": False, "msg": "Token expired."}, 400
 
         except Exception as e:
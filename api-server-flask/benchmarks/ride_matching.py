@@ -0,0 +1,104 @@
+"""
+Benchmarks the joint origin-destination ride index against the two-pass radius filter.
+
+Usage (from api-server-flask):
+    python -m benchmarks.ride_matching --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from services.ride_index import RideGridIndex
+from utils.batch_distance import within_radius
+
+# Cities the synthetic rides start and end around: (lat, lng)
+CITIES = [
+    (31.2622, 34.8013),  # Beer Sheva
+    (32.0853, 34.7818),  # Tel Aviv
+    (31.7683, 35.2137),  # Jerusalem
+    (32.7940, 34.9896),  # Haifa
+    (31.8044, 34.6553),  # Ashdod
+    (32.3215, 34.8532),  # Netanya
+    (29.5577, 34.9519),  # Eilat
+    (31.5250, 34.5956),  # Sderot
+]
+SPREAD_DEGREES = 0.15
+
+
+def make_rides(count, rng):
+    departure_city = rng.integers(len(CITIES), size=count)
+    destination_city = (departure_city + rng.integers(1, len(CITIES), size=count)) % len(CITIES)
+    centers = np.array(CITIES)
+    departures = centers[departure_city] + rng.normal(0, SPREAD_DEGREES, (count, 2))
+    destinations = centers[destination_city] + rng.normal(0, SPREAD_DEGREES, (count, 2))
+    departure_datetime = datetime.now() + timedelta(days=1)
+    return [SimpleNamespace(id=i, status='waiting', departure_datetime=departure_datetime,
+                            departure_lat=departures[i, 0], departure_lng=departures[i, 1],
+                            destination_lat=destinations[i, 0], destination_lng=destinations[i, 1])
+            for i in range(count)]
+
+
+def make_queries(count, rng):
+    queries = []
+    for _ in range(count):
+        a, b = rng.choice(len(CITIES), size=2, replace=False)
+        departure = tuple(np.array(CITIES[a]) + rng.normal(0, SPREAD_DEGREES / 2, 2))
+        destination = tuple(np.array(CITIES[b]) + rng.normal(0, SPREAD_DEGREES / 2, 2))
+        queries.append((departure, rng.uniform(3, 10), destination, rng.uniform(3, 10)))
+    return queries
+
+
+def two_pass_filter(columns, departure, pickup_radius, destination, drop_radius):
+    """
+    The search_rides in-memory path: filter all rides on departure, then the survivors on destination.
+    """
+    ids, dep_lat, dep_lng, dst_lat, dst_lng = columns
+    mask = within_radius(departure[0], departure[1], dep_lat, dep_lng, pickup_radius)
+    survivors = np.flatnonzero(mask)
+    mask = within_radius(destination[0], destination[1], dst_lat[survivors], dst_lng[survivors], drop_radius)
+    return set(ids[survivors[mask]].tolist())
+
+
+def run(size, query_count, seed):
+    rng = np.random.default_rng(seed)
+    rides = make_rides(size, rng)
+    queries = make_queries(query_count, rng)
+    columns = (np.array([r.id for r in rides]),
+               np.array([r.departure_lat for r in rides]), np.array([r.departure_lng for r in rides]),
+               np.array([r.destination_lat for r in rides]), np.array([r.destination_lng for r in rides]))
+
+    index = RideGridIndex()
+    start = time.perf_counter()
+    index.load(rides)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [two_pass_filter(columns, *query) for query in queries]
+    two_pass_ms = (time.perf_counter() - start) * 1000 / query_count
+
+    start = time.perf_counter()
+    found = [index.search(*query) for query in queries]
+    joint_ms = (time.perf_counter() - start) * 1000 / query_count
+
+    assert found == expected, "joint index and two-pass filter disagree"
+    matches = sum(len(result) for result in found) / query_count
+    print(f"{size:>9} rides | build {build_seconds:7.2f}s | two-pass {two_pass_ms:8.2f} ms/query | "
+          f"joint index {joint_ms:7.2f} ms/query | {matches:6.1f} matches/query | "
+          f"speedup x{two_pass_ms / joint_ms:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, args.seed)
+
+
+if __name__ == '__main__':
+    main()
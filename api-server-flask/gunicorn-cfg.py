@@ -4,8 +4,18 @@ Copyright (c) 2019 - present AppSeed.us
 """
 
 bind = '0.0.0.0:5005'
+# Must stay 1: the ride, departure, offer and saved-search indexes, the search cache and the token
+# cache live in the worker process and are only updated by the requests it serves, so a second
+# worker would answer searches from indexes that miss the rides posted through the first one.
+# Scale with threads, or move these structures to a shared store first.
 workers = 1
 accesslog = '-'
 loglevel = 'debug'
 capture_output = True
 enable_stdio_inheritance = True
+
+
+def on_starting(server):
+    if server.cfg.workers > 1:
+        raise RuntimeError(f"gunicorn-cfg.py: workers must be 1, the in-process indexes and caches are per worker "
+                           f"(got {server.cfg.workers})")
@@ -12,3 +12,5 @@ from .ride_offers import RideOffers
 from .verification_codes import VerificationCodes
 from .verified_users import VerifiedUsers
 from .rating_requests import RatingRequest
+from .ride_matches import RideMatches
+from .saved_searches import SavedSearches, SavedSearchHits
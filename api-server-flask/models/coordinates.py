@@ -0,0 +1,91 @@
+from sqlalchemy import inspect, or_, text
+
+from utils.location_utils import try_parse_location
+from . import db
+
+
+class CoordinatesMixin:
+    """
+    Numeric coordinate columns kept next to the location strings of a model.
+
+    coordinate_columns lists (location, lat, lng) column names, one triple per location; a location
+    string that is "lat,lng" is parsed into its lat and lng columns, which stay NULL otherwise.
+    migrated_columns names further columns that migrate_coordinate_columns adds to old tables.
+    """
+    coordinate_columns = (('departure_location', 'departure_lat', 'departure_lng'),
+                          ('destination', 'destination_lat', 'destination_lng'))
+    migrated_columns = ()
+
+    def set_coordinates(self, geocode=None):
+        """
+        Fills the numeric coordinate columns from the location strings.
+
+        Parameters:
+        - geocode: callable (optional), resolves the strings that are not "lat,lng" in one call,
+          see utils.geocoding.geocode_many; without it they are left without coordinates
+
+        Returns:
+        - bool: whether the coordinates changed
+        """
+        return self._fill_coordinates(self.coordinate_columns, geocode)
+
+    def _fill_coordinates(self, columns, geocode=None):
+        before = [(getattr(self, lat), getattr(self, lng)) for _, lat, lng in columns]
+        for location, lat, lng in columns:
+            parsed = try_parse_location(getattr(self, location))
+            setattr(self, lat, parsed[0])
+            setattr(self, lng, parsed[1])
+        if geocode is not None:
+            unresolved = [(location, lat, lng) for location, lat, lng in columns
+                          if getattr(self, location) and getattr(self, lat) is None]
+            if unresolved:
+                resolved = geocode([getattr(self, location) for location, _, _ in unresolved])
+                for location, lat, lng in unresolved:
+                    coordinates = resolved.get(getattr(self, location))
+                    if coordinates:
+                        setattr(self, lat, coordinates[0])
+                        setattr(self, lng, coordinates[1])
+        changed = before != [(getattr(self, lat), getattr(self, lng)) for _, lat, lng in columns]
+        if changed:
+            self.coordinates_changed()
+        return changed
+
+    def coordinates_changed(self):
+        """
+        Called when set_coordinates or backfill_coordinates changed the coordinates, e.g. to drop
+        data derived from them.
+        """
+
+    @classmethod
+    def migrate_coordinate_columns(cls):
+        """
+        Adds the numeric coordinate columns, the migrated_columns and the indexes to a table created
+        before they existed.
+        """
+        existing_columns = {column['name'] for column in inspect(db.engine).get_columns(cls.__tablename__)}
+        names = [name for _, lat, lng in cls.coordinate_columns for name in (lat, lng)] + list(cls.migrated_columns)
+        for name in names:
+            if name not in existing_columns:
+                column_type = cls.__table__.c[name].type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {cls.__tablename__} ADD COLUMN {name} {column_type}'))
+        db.session.commit()
+        for index in cls.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+    @classmethod
+    def backfill_coordinates(cls):
+        """
+        Fills the numeric coordinate columns of the existing rows that do not have them yet. Only
+        the missing locations are parsed, the others may hold geocoded coordinates.
+
+        Returns:
+        - int: the number of rows that were updated
+        """
+        rows = cls.query.filter(or_(*[getattr(cls, lat).is_(None) for _, lat, _ in cls.coordinate_columns])).all()
+        updated = 0
+        for row in rows:
+            missing = [columns for columns in cls.coordinate_columns if getattr(row, columns[1]) is None]
+            if row._fill_coordinates(missing):
+                updated += 1
+        db.session.commit()
+        return updated
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from sqlalchemy import UniqueConstraint
+
+from . import db
+
+
+class RideMatches(db.Model):
+    """
+    A ride offer of a passenger that is compatible with a driver's ride, suggested to the driver.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    ride_id = db.Column(db.Integer, db.ForeignKey('rides.id'), nullable=False, index=True)
+    offer_id = db.Column(db.Integer, db.ForeignKey('ride_offers.id'), nullable=False)
+    passenger_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    pickup_distance = db.Column(db.Float, nullable=False)
+    drop_distance = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    __table_args__ = (
+        UniqueConstraint('ride_id', 'offer_id', name='uq_ride_offer'),
+    )
+
+    def __repr__(self):
+        return f"<RideMatches ride_id={self.ride_id} offer_id={self.offer_id}>"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "ride_id": self.ride_id,
+            "offer_id": self.offer_id,
+            "passenger_id": self.passenger_id,
+            "pickup_distance": self.pickup_distance,
+            "drop_distance": self.drop_distance,
+            "created_at": self.created_at.isoformat()
+        }
+
+    @staticmethod
+    def delete_for_ride(ride_id):
+        """
+        Deletes the suggested matches of a ride. The caller commits.
+        """
+        RideMatches.query.filter_by(ride_id=ride_id).delete(synchronize_session=False)
+
+    @staticmethod
+    def delete_stale():
+        """
+        Deletes suggested matches whose ride or offer no longer exists or has already departed.
+        """
+        from api import app
+        from . import Rides, RideOffers
+        now = datetime.now()
+        with app.app_context():
+            live_rides = db.session.query(Rides.id).filter(Rides.departure_datetime >= now)
+            live_offers = db.session.query(RideOffers.id).filter(RideOffers.departure_datetime >= now)
+            RideMatches.query.filter(
+                ~RideMatches.ride_id.in_(live_rides) | ~RideMatches.offer_id.in_(live_offers)
+            ).delete(synchronize_session=False)
+            db.session.commit()
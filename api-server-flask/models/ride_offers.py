@@ -1,8 +1,9 @@
 import datetime
 from . import db
+from .coordinates import CoordinatesMixin
 
 
-class RideOffers(db.Model):
+class RideOffers(CoordinatesMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     passenger_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     departure_location = db.Column(db.String(100), nullable=False)
@@ -12,6 +13,14 @@ class RideOffers(db.Model):
     departure_datetime = db.Column(db.DateTime, nullable=False)
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.now())
+    # Numeric copies of departure_location and destination, NULL when the location is not "lat,lng"
+    departure_lat = db.Column(db.Float, nullable=True)
+    departure_lng = db.Column(db.Float, nullable=True)
+    destination_lat = db.Column(db.Float, nullable=True)
+    destination_lng = db.Column(db.Float, nullable=True)
+    __table_args__ = (
+        db.Index('ix_ride_offers_departure_datetime', 'departure_datetime'),
+    )
 
     def __repr__(self):
         return f"RideOffer {self.id}"
@@ -26,7 +35,8 @@ class RideOffers(db.Model):
 
     def to_dict(self):
         ride_dict = {
-            '_passenger_id': self.driver_id,
+            'offer_id': self.id,
+            '_passenger_id': self.passenger_id,
             '_departure_location': self.departure_location,
             '_pickup_radius': self.pickup_radius,
             '_destination': self.destination,
@@ -1,11 +1,61 @@
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 # from join_ride_requests import JoinRideRequests
+from sqlalchemy import text, table, column, literal_column
+from utils.route_sampling import encode_route, route_of
 from utils.response import Response
 from . import db
+from .coordinates import CoordinatesMixin
 
+# SQLite R*Tree side tables holding the departure and destination point of every ride with coordinates.
+# They live outside db.metadata because create_all cannot create virtual tables.
+SPATIAL_INDEX_COLUMNS = ('id', 'min_lat', 'max_lat', 'min_lng', 'max_lng')
+departure_rtree = table('rides_departure_rtree', *(column(name) for name in SPATIAL_INDEX_COLUMNS))
+destination_rtree = table('rides_destination_rtree', *(column(name) for name in SPATIAL_INDEX_COLUMNS))
 
+# PostGIS geography(Point) columns of rides. They are only created on PostGIS-capable databases,
+# so they are not part of the model.
+departure_geography = literal_column('rides.departure_geog')
+destination_geography = literal_column('rides.destination_geog')
 
-class Rides(db.Model):
+SPATIAL_MODE_RTREE = 'rtree'
+SPATIAL_MODE_POSTGIS = 'postgis'
+_spatial_index = {"mode": None}
+
+
+def postgis_statements():
+    """
+    The DDL that adds the geography columns of rides, their GiST indexes and the trigger that keeps
+    them in sync with the numeric coordinates, and fills them for the existing rows. Every statement
+    can be run again on a table that already has them.
+
+    Returns:
+    - list: the SQL statements, in order
+    """
+    point = "CASE WHEN {row}.{end}_lat IS NULL THEN NULL " \
+            "ELSE geography(ST_SetSRID(ST_MakePoint({row}.{end}_lng, {row}.{end}_lat), 4326)) END"
+    statements = []
+    for end in ('departure', 'destination'):
+        statements += [
+            f'ALTER TABLE rides ADD COLUMN IF NOT EXISTS {end}_geog geography(Point, 4326)',
+            f'CREATE INDEX IF NOT EXISTS ix_rides_{end}_geog ON rides USING GIST ({end}_geog)',
+            f'UPDATE rides SET {end}_geog = {point.format(row="rides", end=end)} '
+            f'WHERE {end}_lat IS NOT NULL AND {end}_geog IS NULL',
+        ]
+    statements += [
+        'CREATE OR REPLACE FUNCTION rides_set_geography() RETURNS trigger AS $$ BEGIN '
+        f'NEW.departure_geog := {point.format(row="NEW", end="departure")}; '
+        f'NEW.destination_geog := {point.format(row="NEW", end="destination")}; '
+        'RETURN NEW; END $$ LANGUAGE plpgsql',
+        'DROP TRIGGER IF EXISTS rides_set_geography ON rides',
+        'CREATE TRIGGER rides_set_geography BEFORE INSERT OR UPDATE OF '
+        'departure_lat, departure_lng, destination_lat, destination_lng ON rides '
+        'FOR EACH ROW EXECUTE PROCEDURE rides_set_geography()',
+    ]
+    return statements
+
+
+class Rides(CoordinatesMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     driver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     status = db.Column(db.String(20), nullable=False, default='waiting')
@@ -18,6 +68,19 @@ class Rides(db.Model):
     confirmed_passengers = db.Column(db.Integer, nullable=False, default=0)
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now())
+    # Numeric copies of departure_location and destination, NULL when the location is not "lat,lng"
+    departure_lat = db.Column(db.Float, nullable=True)
+    departure_lng = db.Column(db.Float, nullable=True)
+    destination_lat = db.Column(db.Float, nullable=True)
+    destination_lng = db.Column(db.Float, nullable=True)
+    # Sampled route from departure to destination as an encoded polyline, NULL without coordinates
+    route_polyline = db.Column(db.Text, nullable=True)
+    __table_args__ = (
+        db.Index('ix_rides_departure_coordinates', 'departure_lat', 'departure_lng'),
+        db.Index('ix_rides_destination_coordinates', 'destination_lat', 'destination_lng'),
+        db.Index('ix_rides_departure_datetime', 'departure_datetime'),
+    )
+    migrated_columns = ('route_polyline',)
 
     def __repr__(self):
         return f"Ride {self.id}"
@@ -26,12 +89,31 @@ class Rides(db.Model):
         db.session.add(self)
         db.session.commit()
 
-    def update_details(self, new_details):
+    def coordinates_changed(self):
+        # The stored route was sampled between the old coordinates
+        self.route_polyline = None
+
+    def set_route(self, lats, lngs):
+        """
+        Stores the sampled route points as an encoded polyline.
+        """
+        self.route_polyline = encode_route(lats, lngs) if len(lats) else None
+
+    def route_points(self):
+        """
+        Returns the sampled route as (lats, lngs) numpy arrays: the stored polyline, or the
+        great-circle route when none is stored yet, or None for rides without coordinates.
+        """
+        return route_of(self.route_polyline, self.departure_lat, self.departure_lng,
+                        self.destination_lat, self.destination_lng)
+
+    def update_details(self, new_details, geocode=None):
         """
         Updates the ride details with new information.
 
         Parameters:
         - new_details: dict, a dictionary containing the updated details for the ride
+        - geocode: callable (optional), resolves address locations, see set_coordinates
 
         Returns:
         - success: bool, indicates whether the ride details update was successful
@@ -41,6 +123,7 @@ class Rides(db.Model):
                 if key == "departure_datetime":
                     value = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
                 setattr(self, key, value)
+            self.set_coordinates(geocode)
             self.save()
             return True
         except Exception as e:
@@ -166,9 +249,98 @@ class Rides(db.Model):
         with app.app_context():
             # Delete expired verification codes directly from the database
             x = Rides.query.filter(Rides.departure_datetime < cutoff_time, Rides.status == 'waiting')
+            # Their join requests reference them, so they go first on databases enforcing foreign keys
+            from . import JoinRideRequests
+            JoinRideRequests.query.filter(JoinRideRequests.ride_id.in_(x.with_entities(Rides.id))) \
+                .delete(synchronize_session=False)
             x.delete(synchronize_session=False)
 
             # Commit the changes to the database
             db.session.commit()
         response = Response(success=True, message="OK", status_code=200)
         return response.to_tuple()
+
+    @staticmethod
+    def popular_routes(limit, days=90, precision=3):
+        """
+        Finds the most frequent origin-destination pairs of the rides of the last days, with the
+        coordinates rounded to precision decimals.
+
+        Returns:
+        - list: ((lat, lng), (lat, lng)) pairs, most frequent first
+        """
+        rows = Rides.query.with_entities(Rides.departure_lat, Rides.departure_lng,
+                                         Rides.destination_lat, Rides.destination_lng) \
+            .filter(Rides.departure_datetime >= datetime.now() - timedelta(days=days),
+                    Rides.departure_lat.isnot(None), Rides.destination_lat.isnot(None)).all()
+        counts = Counter(((round(row[0], precision), round(row[1], precision)),
+                          (round(row[2], precision), round(row[3], precision))) for row in rows)
+        return [pair for pair, _ in counts.most_common(limit)]
+
+    @staticmethod
+    def create_spatial_index():
+        """
+        Sets up the database-side spatial index of ride locations for the current engine:
+        R*Tree side tables on SQLite, geography columns with GiST indexes on PostGIS.
+        Other engines are left without one.
+
+        Returns:
+        - str: the spatial index mode, or None when the engine has no spatial index
+        """
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            Rides._create_sqlite_rtree()
+            _spatial_index["mode"] = SPATIAL_MODE_RTREE
+        elif dialect == 'postgresql' and Rides._enable_postgis():
+            Rides._create_postgis_columns()
+            _spatial_index["mode"] = SPATIAL_MODE_POSTGIS
+        else:
+            _spatial_index["mode"] = None
+        return _spatial_index["mode"]
+
+    @staticmethod
+    def _create_sqlite_rtree():
+        for rtree, end in ((departure_rtree, 'departure'), (destination_rtree, 'destination')):
+            point = f'new.{end}_lat, new.{end}_lat, new.{end}_lng, new.{end}_lng'
+            statements = [
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree.name} USING rtree({", ".join(SPATIAL_INDEX_COLUMNS)})',
+                f'CREATE TRIGGER IF NOT EXISTS {rtree.name}_insert AFTER INSERT ON rides '
+                f'WHEN new.{end}_lat IS NOT NULL '
+                f'BEGIN INSERT INTO {rtree.name} VALUES (new.id, {point}); END',
+                f'CREATE TRIGGER IF NOT EXISTS {rtree.name}_update AFTER UPDATE OF {end}_lat, {end}_lng ON rides '
+                f'BEGIN DELETE FROM {rtree.name} WHERE id = old.id; '
+                f'INSERT INTO {rtree.name} SELECT new.id, {point} WHERE new.{end}_lat IS NOT NULL; END',
+                f'CREATE TRIGGER IF NOT EXISTS {rtree.name}_delete AFTER DELETE ON rides '
+                f'BEGIN DELETE FROM {rtree.name} WHERE id = old.id; END',
+                f'DELETE FROM {rtree.name}',
+                f'INSERT INTO {rtree.name} SELECT id, {end}_lat, {end}_lat, {end}_lng, {end}_lng '
+                f'FROM rides WHERE {end}_lat IS NOT NULL',
+            ]
+            for statement in statements:
+                db.session.execute(text(statement))
+        db.session.commit()
+
+    @staticmethod
+    def _enable_postgis():
+        try:
+            db.session.execute(text('CREATE EXTENSION IF NOT EXISTS postgis'))
+            db.session.commit()
+            return True
+        except Exception as e:
+            print(f"> PostGIS is not available, using in-memory location filtering: {str(e)}")
+            db.session.rollback()
+            return False
+
+    @staticmethod
+    def _create_postgis_columns():
+        for statement in postgis_statements():
+            db.session.execute(text(statement))
+        db.session.commit()
+
+    @staticmethod
+    def spatial_index_mode():
+        return _spatial_index["mode"]
+
+    @staticmethod
+    def has_spatial_index():
+        return _spatial_index["mode"] is not None
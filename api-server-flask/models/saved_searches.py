@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import UniqueConstraint
+
+from . import db
+from .coordinates import CoordinatesMixin
+
+
+class SavedSearches(CoordinatesMixin, db.Model):
+    """
+    A standing ride search of a passenger, evaluated whenever a ride is posted or updated.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    departure_location = db.Column(db.String(100), nullable=True)
+    pickup_radius = db.Column(db.Float, nullable=True)
+    destination = db.Column(db.String(100), nullable=True)
+    drop_radius = db.Column(db.Float, nullable=True)
+    departure_datetime = db.Column(db.DateTime, nullable=False)
+    delta_hours = db.Column(db.Float, nullable=False, default=5)
+    available_seats = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    # Numeric copies of departure_location and destination, NULL when the location is not given
+    departure_lat = db.Column(db.Float, nullable=True)
+    departure_lng = db.Column(db.Float, nullable=True)
+    destination_lat = db.Column(db.Float, nullable=True)
+    destination_lng = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f"<SavedSearches id={self.id} user_id={self.user_id}>"
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
+
+    @property
+    def window_start(self):
+        return self.departure_datetime - timedelta(minutes=int(self.delta_hours * 60))
+
+    @property
+    def window_end(self):
+        return self.departure_datetime + timedelta(minutes=int(self.delta_hours * 60))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "departure_location": self.departure_location,
+            "pickup_radius": self.pickup_radius,
+            "destination": self.destination,
+            "drop_radius": self.drop_radius,
+            "departure_datetime": self.departure_datetime.isoformat(),
+            "delta_hours": self.delta_hours,
+            "available_seats": self.available_seats,
+            "created_at": self.created_at.isoformat()
+        }
+
+    @staticmethod
+    def delete_expired():
+        """
+        Deletes saved searches whose time window has passed, together with their hits, and the
+        hits on rides that no longer exist or have departed.
+        """
+        from api import app
+        now = datetime.now()
+        with app.app_context():
+            expired = [search.id for search in SavedSearches.query.filter(SavedSearches.departure_datetime < now)
+                       if search.window_end < now]
+            if expired:
+                SavedSearchHits.query.filter(SavedSearchHits.saved_search_id.in_(expired)) \
+                    .delete(synchronize_session=False)
+                SavedSearches.query.filter(SavedSearches.id.in_(expired)).delete(synchronize_session=False)
+            # Hits on rides that were deleted or have departed
+            from . import Rides
+            live_rides = db.session.query(Rides.id).filter(Rides.departure_datetime >= now)
+            SavedSearchHits.query.filter(~SavedSearchHits.ride_id.in_(live_rides)).delete(synchronize_session=False)
+            db.session.commit()
+            return expired
+
+
+class SavedSearchHits(db.Model):
+    """
+    A ride that matched a saved search when it was posted or updated.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    saved_search_id = db.Column(db.Integer, db.ForeignKey('saved_searches.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    ride_id = db.Column(db.Integer, db.ForeignKey('rides.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    __table_args__ = (
+        UniqueConstraint('saved_search_id', 'ride_id', name='uq_saved_search_ride'),
+    )
+
+    def __repr__(self):
+        return f"<SavedSearchHits saved_search_id={self.saved_search_id} ride_id={self.ride_id}>"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "saved_search_id": self.saved_search_id,
+            "ride_id": self.ride_id,
+            "created_at": self.created_at.isoformat()
+        }
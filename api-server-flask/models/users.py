@@ -1,9 +1,12 @@
 from datetime import datetime
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from werkzeug.security import generate_password_hash, check_password_hash
 from . import db
 
 from utils.auth_exceptions import *
+from utils.token_cache import token_cache
 
 
 class Users(db.Model):
@@ -39,6 +42,8 @@ class Users(db.Model):
         )
         new_user.set_password(_password)
         new_user.save()
+        # Tokens cached for a former account with this email belong to another user row
+        token_cache.invalidate_email(new_user.email)
 
         return new_user
 
@@ -66,7 +71,12 @@ class Users(db.Model):
         return self.jwt_auth_active
 
     def set_jwt_auth_active(self, set_status):
+        """
+        Sets the flag; the cached tokens of the user are dropped when the caller commits, so a
+        request running in between cannot cache the old flag again.
+        """
         self.jwt_auth_active = set_status
+        db.session.info.setdefault('token_cache_users', set()).add(self.id)
 
     @classmethod
     def get_by_id(cls, id):
@@ -116,7 +126,19 @@ class Users(db.Model):
                 else:
                     setattr(self, key, value)
             self.save()
+            token_cache.invalidate_user(self.id)
         except Exception as e:
             print(f"Error updating user details: {str(e)}")
             db.session.rollback()
             raise Exception("Failed to update user details") from e
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('token_cache_users', ()):
+        token_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_users(session):
+    session.info.pop('token_cache_users', None)
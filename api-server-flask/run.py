@@ -2,9 +2,20 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
+import csv
+
+import click
+
 from api import app, db
 from apscheduler.schedulers.background import BackgroundScheduler
+from models import Rides
+from services import departure_index, offer_index, ride_index, saved_search_index
 from services.auth_service import AuthService
+from services.ride_routes import DEFAULT_ROUTE_BACKFILL_BATCH, backfill_routes, backfill_routes_job
+from utils.gazetteer import build_gazetteer, gazetteer
+from utils.maps import report_distance_cache, warm_distance_cache
+from utils.road_graph import RoadGraph
+from utils.token_cache import report_token_cache
 import atexit
 
 
@@ -15,9 +26,82 @@ def make_shell_context():
             }
 
 
+@app.cli.command('warm-distance-cache')
+@click.option('--limit', default=200, help='Number of the most frequent ride routes to warm.')
+@click.option('--pairs-file', type=click.File(), default=None,
+              help='Extra pairs, one "origin_lat,origin_lng,destination_lat,destination_lng" line each.')
+def warm_distance_cache_command(limit, pairs_file):
+    """
+    Fetches the driving distances of popular origin-destination pairs into the distance cache.
+    """
+    pairs = Rides.popular_routes(limit)
+    if pairs_file:
+        for line in pairs_file:
+            if line.strip():
+                lat1, lng1, lat2, lng2 = map(float, line.split(','))
+                pairs.append(((lat1, lng1), (lat2, lng2)))
+    result = warm_distance_cache(pairs)
+    if result["stats"] is None:
+        print("> No Google Maps API key configured, distances are computed locally and not cached")
+    else:
+        print(f"> Warmed {result['pairs']} pairs, cache hit rate {result['stats']['hit_rate']:.1%}")
+
+
+@app.cli.command('build-gazetteer')
+@click.argument('places_file', type=click.File(encoding='utf-8'))
+def build_gazetteer_command(places_file):
+    """
+    Builds the offline place file from a CSV with name, lat and lng columns.
+    """
+    places = [(row['name'], row['lat'], row['lng']) for row in csv.DictReader(places_file)]
+    count = build_gazetteer(places, app.config['GAZETTEER_PATH'])
+    gazetteer.load(app.config['GAZETTEER_PATH'])
+    print(f"> Gazetteer written to {app.config['GAZETTEER_PATH']} with {count} places")
+
+
+@app.cli.command('build-road-graph')
+@click.argument('edges_file', type=click.File())
+def build_road_graph_command(edges_file):
+    """
+    Builds the offline road network from a CSV of road segments with from_lat, from_lng, to_lat
+    and to_lng columns, and optional length_m and oneway (1 or 0) columns. Restart the workers to load it.
+    """
+    edges = ((row['from_lat'], row['from_lng'], row['to_lat'], row['to_lng'],
+              float(row['length_m']) / 1000 if row.get('length_m') else None, row.get('oneway') == '1')
+             for row in csv.DictReader(edges_file))
+    graph = RoadGraph.from_edges(edges)
+    graph.save(app.config['ROAD_GRAPH_PATH'])
+    print(f"> Road graph written to {app.config['ROAD_GRAPH_PATH']} with {len(graph)} nodes "
+          f"and {graph.edge_count} edges")
+
+
+@app.cli.command('backfill-routes')
+@click.option('--batch-size', default=DEFAULT_ROUTE_BACKFILL_BATCH, help='Rides routed per commit.')
+def backfill_routes_command(batch_size):
+    """
+    Stores the routes of all waiting future rides that have none yet, one batch at a time, e.g.
+    before starting the server after an upgrade. Running workers only see these routes once they
+    rebuild their ride index; the scheduled backfill updates the index of its own worker.
+    """
+    total = 0
+    while True:
+        updated = len(backfill_routes(batch_size))
+        total += updated
+        if updated < batch_size:
+            break
+    print(f"> Routes stored for {total} rides")
+
+
 if __name__ == '__main__':
     scheduler = BackgroundScheduler()
     scheduler.add_job(AuthService.send_clean_database, 'cron', hour=0, minute=10)
+    scheduler.add_job(ride_index.verify, 'interval', minutes=30)
+    scheduler.add_job(backfill_routes_job, 'interval', minutes=5)
+    scheduler.add_job(offer_index.refresh, 'interval', minutes=30)
+    scheduler.add_job(saved_search_index.refresh, 'interval', minutes=30)
+    scheduler.add_job(departure_index.refresh, 'interval', minutes=30)
+    scheduler.add_job(report_distance_cache, 'interval', minutes=30)
+    scheduler.add_job(report_token_cache, 'interval', minutes=30)
     scheduler.start()
     app.scheduler = scheduler
     # Shut down the scheduler when exiting the app
@@ -1,3 +1,13 @@
+from services.departure_index import DepartureTimeIndex
 from services.login_attempt_tracker import LoginAttemptTracker
+from services.offer_index import RideOfferIndex
+from services.ride_index import RideGridIndex
+from services.saved_search_index import SavedSearchIndex
+from services.search_cache import SearchResultCache
 
-login_attempt_tracker = LoginAttemptTracker()
\ No newline at end of file
+login_attempt_tracker = LoginAttemptTracker()
+ride_index = RideGridIndex()
+search_cache = SearchResultCache()
+offer_index = RideOfferIndex()
+saved_search_index = SavedSearchIndex()
+departure_index = DepartureTimeIndex()
@@ -1,9 +1,10 @@
 import random
 
 from api.config import BaseConfig
-from services import login_attempt_tracker
+from services import departure_index, login_attempt_tracker, offer_index, ride_index, saved_search_index, search_cache
 from services.user_validation import *
 from utils.response import Response
+from utils.token_cache import token_cache
 
 from utils.auth_exceptions import *
 import smtplib
@@ -13,7 +14,7 @@ from datetime import datetime, timedelta, timezone
 from models.join_ride_requests import JoinRideRequests
 import jwt
 
-from models import Users, JWTTokenBlocklist, db, Rides, VerifiedUsers
+from models import Users, JWTTokenBlocklist, db, Rides, VerifiedUsers, RideMatches, SavedSearches
 from models.verification_codes import VerificationCodes, time_left
 import os
 
@@ -183,6 +184,7 @@ class AuthService:
     def logout(_jwt_token, current_user):
         jwt_block = JWTTokenBlocklist(jwt_token=_jwt_token, created_at=datetime.now())
         jwt_block.save()
+        token_cache.invalidate_token(_jwt_token)
 
         current_user.set_jwt_auth_active(False)
         current_user.save()
@@ -283,8 +285,16 @@ class AuthService:
             return response.to_tuple()
         try:
             VerificationCodes.delete_expired_verification_codes()
-            Rides.delete_not_started_rides()
+            # The rows referencing rides are deleted before the rides, for databases enforcing foreign keys
+            RideMatches.delete_stale()
             JoinRideRequests.delete_not_accepted_passengers()
+            SavedSearches.delete_expired()
+            Rides.delete_not_started_rides()
+            ride_index.remove_departed()
+            departure_index.prune()
+            search_cache.clear()
+            offer_index.remove_departed()
+            saved_search_index.remove_expired()
         except Exception as e:
             response = Response(success=False, message="cannot preform the cleaning", status_code=400)
             return response.to_tuple()
@@ -0,0 +1,173 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from models import Rides
+
+DEFAULT_RETENTION_HOURS = 5
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(moment):
+    """
+    Seconds since 1970-01-01 of a naive local datetime; the timezone of an aware one is ignored,
+    like the naive departure_datetime column.
+    """
+    return (moment.replace(tzinfo=None) - _EPOCH).total_seconds()
+
+
+class _SortedDepartures:
+    """
+    Ride IDs sorted by departure, as two parallel compact arrays.
+    """
+
+    def __init__(self):
+        self.epochs = array('d')
+        self.ids = array('q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def insert(self, epoch, ride_id):
+        position = bisect_right(self.epochs, epoch)
+        self.epochs.insert(position, epoch)
+        self.ids.insert(position, ride_id)
+
+    def remove(self, epoch, ride_id):
+        position = bisect_left(self.epochs, epoch)
+        while position < len(self.epochs) and self.epochs[position] == epoch:
+            if self.ids[position] == ride_id:
+                del self.epochs[position]
+                del self.ids[position]
+                return
+            position += 1
+
+    def between(self, lower, upper, upper_inclusive=True):
+        """
+        Returns the (epoch, ride_id) pairs with lower <= epoch <= upper (or < upper).
+        """
+        start = bisect_left(self.epochs, lower)
+        end = bisect_right(self.epochs, upper) if upper_inclusive else bisect_left(self.epochs, upper)
+        return list(zip(self.epochs[start:end], self.ids[start:end]))
+
+
+class DepartureTimeIndex:
+    """
+    In-process index of rides sorted by departure time, for departure-window queries.
+
+    All rides departing from retention_hours ago onwards are kept, whatever their status, in one
+    sorted pair of arrays, so a time window is a binary search and a slice. Search windows read
+    the waiting rides.
+    """
+
+    def __init__(self, retention_hours=DEFAULT_RETENTION_HOURS):
+        self.retention = timedelta(hours=retention_hours)
+        self.is_warm = False
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._all = _SortedDepartures()
+        # ride_id -> (epoch, status)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, ride_id):
+        return ride_id in self._entries
+
+    def add(self, ride):
+        """
+        Inserts or re-indexes a ride, e.g. after it was posted, updated, started or ended.
+        """
+        with self._lock:
+            self.remove(ride.id)
+            if ride.departure_datetime < datetime.now() - self.retention:
+                return
+            epoch = epoch_seconds(ride.departure_datetime)
+            self._entries[ride.id] = (epoch, ride.status)
+            self._all.insert(epoch, ride.id)
+
+    def remove(self, ride_id):
+        with self._lock:
+            entry = self._entries.pop(ride_id, None)
+            if entry is None:
+                return
+            self._all.remove(entry[0], ride_id)
+
+    def prune(self, now=None):
+        """
+        Drops the rides that departed more than retention_hours ago, and the waiting rides that
+        already departed, which Rides.delete_not_started_rides deletes.
+
+        Returns:
+        - int: the number of removed rides
+        """
+        now = now or datetime.now()
+        cutoff = epoch_seconds(now - self.retention)
+        with self._lock:
+            expired = [ride_id for epoch, ride_id in self._all.between(float('-inf'), epoch_seconds(now),
+                                                                       upper_inclusive=False)
+                       if epoch < cutoff or self._entries[ride_id][1] == 'waiting']
+            for ride_id in expired:
+                self.remove(ride_id)
+            return len(expired)
+
+    def waiting_between(self, lower, upper):
+        """
+        Finds the waiting rides departing inside a time window.
+
+        Parameters:
+        - lower: datetime, the start of the window
+        - upper: datetime, the end of the window, inclusive
+
+        Returns:
+        - list: the ride IDs ordered by departure time
+        """
+        with self._lock:
+            return [ride_id for _, ride_id in self._all.between(epoch_seconds(lower), epoch_seconds(upper))
+                    if self._entries[ride_id][1] == 'waiting']
+
+    def load(self, rides):
+        """
+        Replaces the content of the index with the given rides.
+
+        Returns:
+        - int: the number of indexed rides
+        """
+        cutoff = datetime.now() - self.retention
+        rides = sorted((ride for ride in rides if ride.departure_datetime >= cutoff),
+                       key=lambda ride: ride.departure_datetime)
+        with self._lock:
+            self._clear()
+            for ride in rides:
+                epoch = epoch_seconds(ride.departure_datetime)
+                self._entries[ride.id] = (epoch, ride.status)
+                self._all.epochs.append(epoch)
+                self._all.ids.append(ride.id)
+            return len(self._entries)
+
+    def rebuild(self):
+        """
+        Reloads the index from the Rides table. Must run inside an application context.
+
+        Returns:
+        - int: the number of indexed rides
+        """
+        rides = Rides.query.with_entities(Rides.id, Rides.status, Rides.departure_datetime) \
+            .filter(Rides.departure_datetime >= datetime.now() - self.retention).all()
+        with self._lock:
+            count = self.load(rides)
+            self.is_warm = True
+            return count
+
+    def refresh(self):
+        """
+        Scheduled reload, so rides posted through other workers are seen as well.
+        """
+        from api import app
+        with app.app_context():
+            return self.rebuild()
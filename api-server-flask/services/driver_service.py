@@ -1,8 +1,14 @@
-from models import Rides, JoinRideRequests, db
+from models import Rides, JoinRideRequests, RideMatches, RideOffers, SavedSearchHits, db
 from datetime import datetime, timedelta
 
+from services import departure_index, ride_index, search_cache
 from services.future_ride_post import FutureRidePost
-from utils.response import Response
+from services.ride_matching import match_ride_offers
+from services.ride_routes import assign_route
+from services.saved_search_service import SavedSearchService
+from services.search_cache import candidate_of
+from utils.geocoding import post_geocoder
+from utils.response import Response, StreamingResponse, STREAM_BATCH_SIZE
 
 from sqlalchemy.exc import SQLAlchemyError
 from models.rating_requests import RatingRequest
@@ -40,6 +46,17 @@ class DriverService:
             )
             future_ride_post.validate()
             ride = future_ride_post.save()
+            ride_index.add(ride)
+            departure_index.add(ride)
+            search_cache.invalidate_ride(ride)
+
+            # Suggest waiting passengers to the driver; a matching failure does not fail the post
+            try:
+                match_ride_offers(ride)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error matching ride offers: {str(e)}")
+            DriverService._record_saved_search_hits(ride)
 
             response = Response(success=True, message="Ride posted successfully", status_code=200,
                                 data=ride.to_dict())
@@ -54,17 +71,32 @@ class DriverService:
             return response.to_tuple()
 
     @staticmethod
-    def get_ride_posts_by_user_id(user_id):
+    def _record_saved_search_hits(ride):
+        # Passengers' saved searches are notified through their inbox; a failure does not fail the change
+        try:
+            SavedSearchService.record_hits(ride)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error recording saved search hits: {str(e)}")
+
+    @staticmethod
+    def get_ride_posts_by_user_id(user_id, stream=False):
         """
         Fetches ride posts associated with a specific user ID.
 
         Parameters:
         - user_id: int, the ID of the user whose ride posts to fetch
+        - stream: bool (optional), stream the ride posts as newline-delimited JSON
 
         Returns:
-        - response: tuple, a response object containing success status, message, and ride post data
+        - response: tuple, a response object containing success status, message, and ride post data,
+          or a streaming response of ride post dicts
         """
         try:
+            if stream:
+                ride_posts = Rides.query.filter_by(driver_id=user_id).order_by(Rides.id).yield_per(STREAM_BATCH_SIZE)
+                return StreamingResponse(ride.to_dict() for ride in ride_posts).to_response()
+
             ride_posts = Rides.query.filter_by(driver_id=user_id).all()
             ride_post_dicts = [ride.to_dict() for ride in ride_posts]
             response = Response(success=True, message="Ride posts fetched successfully", status_code=200,
@@ -138,8 +170,16 @@ class DriverService:
             future_ride_post.validate()
 
             # Update the ride details with the new information
-            if not ride.update_details(new_details):
+            previous = candidate_of(ride)
+            if not ride.update_details(new_details, geocode=post_geocoder()):
                 raise Exception("Error updating ride details")
+            if ride.route_polyline is None and assign_route(ride):
+                ride.save()
+            ride_index.add(ride)
+            departure_index.add(ride)
+            search_cache.invalidate_ride(previous)
+            search_cache.invalidate_ride(ride)
+            DriverService._record_saved_search_hits(ride)
 
             response = Response(success=True, message="Ride details updated successfully", status_code=200)
             return response.to_tuple()
@@ -217,6 +257,9 @@ class DriverService:
                 ride.save()
                 ride_request.save()
 
+            if status_update == 'accept':
+                search_cache.invalidate_ride(ride)
+
             response = Response(success=True, message="Ride request managed successfully", status_code=200)
             return response.to_tuple()
 
@@ -255,6 +298,45 @@ class DriverService:
             response = Response(success=False, message="Error retrieving pending requests", status_code=500)
             return response.to_tuple()
 
+    @staticmethod
+    def get_ride_matches(current_user, ride_id):
+        """
+        Retrieves the ride offers suggested for a ride by the matching engine, closest first.
+
+        Parameters:
+        - current_user: User, the user requesting the matches
+        - ride_id: int, the ID of the ride
+
+        Returns:
+        - response: tuple, a response object containing success status, message, and the list of matches
+        """
+        try:
+            ride = Rides.get_by_id(ride_id)
+            if ride.driver_id != current_user.id:
+                raise ValueError("Unauthorized: only the driver can view the ride's matches")
+
+            results = db.session.query(RideMatches, RideOffers).join(
+                RideOffers, RideMatches.offer_id == RideOffers.id
+            ).filter(
+                RideMatches.ride_id == ride_id, RideOffers.departure_datetime > datetime.now()
+            ).order_by(RideMatches.pickup_distance + RideMatches.drop_distance).all()
+
+            matches = []
+            for match, offer in results:
+                match_dict = match.to_dict()
+                match_dict.update({"offer": offer.to_dict()})
+                matches.append(match_dict)
+            response = Response(success=True, message="Ride matches retrieved successfully", status_code=200,
+                                data={"matches": matches})
+            return response.to_tuple()
+        except ValueError as ve:
+            response = Response(success=False, message=str(ve), status_code=400)
+            return response.to_tuple()
+        except Exception as e:
+            print(f"Error retrieving ride matches: {str(e)}")
+            response = Response(success=False, message="Error retrieving ride matches", status_code=500)
+            return response.to_tuple()
+
     @staticmethod
     def start_ride(current_user, ride_id):
         """
@@ -286,6 +368,9 @@ class DriverService:
             # Update the ride status to 'InProgress'
             if not ride.start_ride():
                 raise ValueError("Error starting ride")
+            ride_index.remove(ride.id)
+            departure_index.add(ride)
+            search_cache.invalidate_ride(ride)
 
 
                 # TODO: Send notification to all passengers subscribed to the ride
@@ -334,6 +419,7 @@ class DriverService:
             # Update the ride status to 'Completed'
             if not ride.end_ride():
                 raise ValueError("Error ending ride")
+            departure_index.add(ride)
 
             # TODO: Send notification to all passengers subscribed to the ride
             # for passenger in ride.passengers:
@@ -374,8 +460,14 @@ class DriverService:
                 raise ValueError("Unauthorized: only the driver can delete the ride")
 
             # Delete the ride
+            deleted = candidate_of(ride)
+            RideMatches.delete_for_ride(ride_id)
+            SavedSearchHits.query.filter_by(ride_id=ride_id).delete(synchronize_session=False)
             db.session.delete(ride)
             db.session.commit()
+            ride_index.remove(ride_id)
+            departure_index.remove(ride_id)
+            search_cache.invalidate_ride(deleted)
 
             response = Response(success=True, message="Ride deleted successfully", status_code=200)
             return response.to_tuple()
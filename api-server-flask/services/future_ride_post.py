@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta
 
 from models import Rides
+from services.ride_routes import assign_route
+from utils.geocoding import post_geocoder
 
 
 class FutureRidePost:
@@ -35,23 +37,20 @@ class FutureRidePost:
         five_hours_before = self.departure_datetime - timedelta(hours=5)
         five_hours_after = self.departure_datetime + timedelta(hours=5)
 
-        # Check if the driver has rides within the next five hours
-        existing_rides = Rides.query.filter(
+        # One query for both checks. The in-process departure index is not used here: it cannot
+        # prove there is no conflict with a ride posted through another process
+        rides = Rides.query.with_entities(Rides.departure_datetime, Rides.status).filter(
             Rides.driver_id == self.driver_id,
-            Rides.departure_datetime.between(max(five_hours_before, now), five_hours_after)
-        ).all()
+            Rides.departure_datetime.between(five_hours_before, five_hours_after)
+        ).order_by(Rides.departure_datetime).all()
 
-        if len(existing_rides) > 0:
+        # Check if the driver has rides within the next five hours
+        if any(ride.departure_datetime >= max(five_hours_before, now) for ride in rides):
             return True
 
         # Check if the driver's last ride within the five hours before self.departure_datetime is completed
-        last_ride = Rides.query.filter(
-            Rides.driver_id == self.driver_id,
-            Rides.departure_datetime < self.departure_datetime,
-            Rides.departure_datetime >= five_hours_before
-        ).order_by(Rides.departure_datetime.desc()).first()
-
-        if last_ride and last_ride.status != 'Completed':
+        earlier_rides = [ride for ride in rides if ride.departure_datetime < self.departure_datetime]
+        if earlier_rides and earlier_rides[-1].status != 'Completed':
             return True
 
         return False
@@ -67,6 +66,9 @@ class FutureRidePost:
             available_seats=self.available_seats,
             notes=self.notes
         )
+        # Address strings are geocoded once here, so searches read the stored coordinates
+        new_ride.set_coordinates(geocode=post_geocoder())
+        assign_route(new_ride)
         new_ride.save()
         return new_ride
 
@@ -0,0 +1,164 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from models import RideOffers
+from utils.batch_distance import haversine_km, within_radius
+
+DEFAULT_MATCH_WINDOW_HOURS = 5
+
+_FIELDS = ('departure_lat', 'departure_lng', 'destination_lat', 'destination_lng', 'pickup_radius', 'drop_radius')
+
+
+class RideOfferIndex:
+    """
+    In-process index of open ride offers (future departures with coordinates), for matching new rides.
+
+    Offers are kept in parallel NumPy arrays sorted by departure time, so the offers inside a ride's
+    time window are one contiguous slice found by binary search, and the distance checks on both
+    ends run on the whole slice at once.
+    """
+
+    def __init__(self, match_window_hours=DEFAULT_MATCH_WINDOW_HOURS):
+        self.match_window = timedelta(hours=match_window_hours)
+        self.is_warm = False
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._ids = np.empty(0, dtype=np.int64)
+        self._passenger_ids = np.empty(0, dtype=np.int64)
+        self._departures = np.empty(0, dtype='datetime64[us]')
+        self._columns = {name: np.empty(0) for name in _FIELDS}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, offer_id):
+        return bool(np.any(self._ids == offer_id))
+
+    @staticmethod
+    def is_indexable(offer):
+        return offer.departure_lat is not None and offer.destination_lat is not None and \
+            offer.departure_datetime > datetime.now()
+
+    def add(self, offer):
+        """
+        Inserts or re-indexes an offer. Offers without coordinates or with a past departure are removed.
+        """
+        with self._lock:
+            self.remove(offer.id)
+            if not self.is_indexable(offer):
+                return
+            departure = np.datetime64(offer.departure_datetime, 'us')
+            position = int(np.searchsorted(self._departures, departure, side='right'))
+            self._ids = np.insert(self._ids, position, offer.id)
+            self._passenger_ids = np.insert(self._passenger_ids, position, offer.passenger_id)
+            self._departures = np.insert(self._departures, position, departure)
+            for name in _FIELDS:
+                self._columns[name] = np.insert(self._columns[name], position, getattr(offer, name))
+
+    def remove(self, offer_id):
+        with self._lock:
+            self._keep(self._ids != offer_id)
+
+    def remove_departed(self, now=None):
+        """
+        Drops offers whose departure time has passed.
+
+        Returns:
+        - int: the number of removed offers
+        """
+        now = np.datetime64(now or datetime.now(), 'us')
+        with self._lock:
+            departed = int(np.searchsorted(self._departures, now, side='right'))
+            self._keep(slice(departed, None))
+            return departed
+
+    def _keep(self, selection):
+        self._ids = self._ids[selection]
+        self._passenger_ids = self._passenger_ids[selection]
+        self._departures = self._departures[selection]
+        for name in _FIELDS:
+            self._columns[name] = self._columns[name][selection]
+
+    def load(self, offers):
+        """
+        Replaces the content of the index with the given offers.
+
+        Returns:
+        - int: the number of indexed offers
+        """
+        offers = sorted((offer for offer in offers if self.is_indexable(offer)), key=lambda o: o.departure_datetime)
+        with self._lock:
+            self._ids = np.array([offer.id for offer in offers], dtype=np.int64)
+            self._passenger_ids = np.array([offer.passenger_id for offer in offers], dtype=np.int64)
+            self._departures = np.array([offer.departure_datetime for offer in offers], dtype='datetime64[us]')
+            self._columns = {name: np.array([getattr(offer, name) for offer in offers], dtype=float)
+                             for name in _FIELDS}
+            return len(self._ids)
+
+    def rebuild(self):
+        """
+        Reloads the index from the RideOffers table. Must run inside an application context.
+
+        Returns:
+        - int: the number of indexed offers
+        """
+        offers = RideOffers.query.filter(RideOffers.departure_datetime > datetime.now(),
+                                         RideOffers.departure_lat.isnot(None),
+                                         RideOffers.destination_lat.isnot(None)).all()
+        with self._lock:
+            count = self.load(offers)
+            self.is_warm = True
+            return count
+
+    def refresh(self):
+        """
+        Scheduled reload, so offers posted through other workers are matched as well.
+        """
+        from api import app
+        with app.app_context():
+            return self.rebuild()
+
+    def match(self, ride):
+        """
+        Finds the open offers compatible with a ride: another user's offer departing within
+        match_window of the ride, whose pickup and drop circles overlap the ride's pickup and drop
+        circles, i.e. there is a meeting point within both radii on each end.
+
+        Parameters:
+        - ride: Rides, the ride to match, with numeric coordinates
+
+        Returns:
+        - list: (offer_id, passenger_id, pickup_distance_km, drop_distance_km) tuples
+        """
+        if ride.departure_lat is None or ride.destination_lat is None:
+            return []
+        departure = np.datetime64(ride.departure_datetime, 'us')
+        with self._lock:
+            start = int(np.searchsorted(self._departures, departure - np.timedelta64(self.match_window), side='left'))
+            end = int(np.searchsorted(self._departures, departure + np.timedelta64(self.match_window), side='right'))
+            ids = self._ids[start:end]
+            passenger_ids = self._passenger_ids[start:end]
+            columns = {name: values[start:end] for name, values in self._columns.items()}
+
+        mask = passenger_ids != ride.driver_id
+        if mask.any():
+            mask &= within_radius(ride.departure_lat, ride.departure_lng,
+                                  columns['departure_lat'], columns['departure_lng'],
+                                  columns['pickup_radius'] + ride.pickup_radius)
+        if mask.any():
+            mask &= within_radius(ride.destination_lat, ride.destination_lng,
+                                  columns['destination_lat'], columns['destination_lng'],
+                                  columns['drop_radius'] + ride.drop_radius)
+        if not mask.any():
+            return []
+
+        pickup_distances = haversine_km(ride.departure_lat, ride.departure_lng,
+                                        columns['departure_lat'][mask], columns['departure_lng'][mask])
+        drop_distances = haversine_km(ride.destination_lat, ride.destination_lng,
+                                      columns['destination_lat'][mask], columns['destination_lng'][mask])
+        return list(zip(ids[mask].tolist(), passenger_ids[mask].tolist(),
+                        pickup_distances.tolist(), drop_distances.tolist()))
@@ -1,11 +1,25 @@
+from itertools import chain, islice
+
+import numpy as np
+
 from models import RideOffers, JoinRideRequests, db, Users
 
+from services import departure_index, offer_index, ride_index, search_cache
+from services.ride_ranking import top_k_rides
+from services.search_cache import CachedCandidates, RideCandidate
 from services.specifications import *
-from utils.response import Response
+from utils.response import Response, StreamingResponse, STREAM_BATCH_SIZE
 from models.rating_requests import RatingRequest
 
-from geopy.distance import geodesic
 from sqlalchemy.exc import IntegrityError
+from utils.batch_distance import within_radius
+from utils.route_sampling import corridor_match, route_of
+from utils.pagination import encode_cursor, decode_cursor
+
+# Largest departure window, in rides, that is passed to SQL as an ID list
+MAX_INDEXED_WINDOW_IDS = 500
+# Largest LIMIT of the batches a search reads from SQL
+MAX_FETCH_BATCH_ROWS = 1000
 
 
 def serializeResult(x):
@@ -47,7 +61,9 @@ class PassengerService:
                                   notes=_notes
                                   )
             # Save the new ride to the database
+            new_ride.set_coordinates()
             new_ride.save()
+            offer_index.add(new_ride)
 
             # Return success indicating the ride was posted successfully
             return True
@@ -116,7 +132,8 @@ class PassengerService:
 
     @staticmethod
     def search_rides(user_id, departure_location=None, pickup_radius=None, destination=None, drop_radius=None,
-                     departure_date=None, available_seats=None, delta_hours=5):
+                     departure_date=None, available_seats=None, delta_hours=5, limit=None, cursor=None, ranked=False,
+                     stream=False, corridor=False):
         """
         Searches for rides based on location, date, and other criteria.
 
@@ -129,58 +146,427 @@ class PassengerService:
         - departure_date: datetime, the datetime of departure
         - available_seats: int, the number of available seats
         - delta_hours: int, the number of hours for the time window (default is 5)
+        - limit: int (optional), the page size; without it all matching rides are returned
+        - cursor: str (optional), the next_cursor of the previous page
+        - ranked: bool (optional), return only the best `limit` rides by detour and departure time gap;
+          ranked results are not paginated, so the endpoint rejects a cursor with them
+        - stream: bool (optional), stream the rides as newline-delimited JSON, with the cursor of the
+          next page in the X-Next-Cursor header; without a limit or ranking, the rides are read from
+          SQL batch by batch while they are sent
+        - corridor: bool (optional), match the pickup and drop points anywhere along the driver's
+          route, pickup first, instead of around the ride's departure and destination
+
+        Returns:
+        - response: Response, contains the list of matching rides and the cursor of the next page
+        """
+        try:
+            departure_point = parse_location(departure_location) if departure_location and pickup_radius else None
+            destination_point = parse_location(destination) if destination and drop_radius else None
+
+            window_spec = DepartureDateSpecification(departure_date, delta_hours) if departure_date else None
+            after = decode_cursor(cursor) if cursor else None
+            # One ride more than the page tells whether there is a next page; ranked searches need every match
+            needed = limit + 1 if limit and not ranked else None
+
+            filtered_rides, position, exhausted = [], after, False
+            if search_cache.enabled:
+                # Shared part of the search, served from the search cache when another user ran it recently
+                key = search_cache.key_for(departure_point, pickup_radius, destination_point, drop_radius,
+                                           departure_date, delta_hours, available_seats, corridor)
+                cached = search_cache.get(key)
+                if cached is None:
+                    generation = search_cache.generation
+                    cached = CachedCandidates(*PassengerService._load_search_candidates(key))
+                    search_cache.put(key, cached.candidates, generation, cached.frontier)
+
+                # Per-request filters on the cached candidates, including the exact distance checks
+                memory_specifications = [NotMyRideSpecification(user_id)]
+                if window_spec:
+                    memory_specifications.append(window_spec)
+                if departure_point and not corridor:
+                    memory_specifications.append(DepartureLocationSpecification(
+                        f"{departure_point[0]},{departure_point[1]}", pickup_radius))
+                if destination_point and not corridor:
+                    memory_specifications.append(DestinationLocationSpecification(
+                        f"{destination_point[0]},{destination_point[1]}", drop_radius))
+                if after:
+                    memory_specifications.append(KeysetPageSpecification(limit or 0, after))
+                filtered_rides = AndSpecification(*memory_specifications).filter_many(cached.candidates)
+
+                if corridor:
+                    # Exact check of the pickup and drop points along the routes
+                    filtered_rides = PassengerService._filter_corridor(filtered_rides, departure_point,
+                                                                       pickup_radius, destination_point, drop_radius)
+                exhausted = cached.frontier is None
+                if not exhausted and (after is None or cached.frontier > after):
+                    position = cached.frontier
+
+            # Past the cached candidates, or without the cache, the rides are read from SQL with
+            # ORDER BY and LIMIT
+            streamed_rides = ()
+            if not exhausted and (needed is None or len(filtered_rides) < needed):
+                specifications = PassengerService._search_specifications(
+                    (*departure_point, pickup_radius) if departure_point else None,
+                    (*destination_point, drop_radius) if destination_point else None,
+                    window_spec, available_seats, corridor)
+                specifications.append(NotMyRideSpecification(user_id))
+                corridor_areas = (departure_point, pickup_radius, destination_point, drop_radius) if corridor else None
+                if stream and needed is None and not ranked:
+                    # An unbounded stream reads the remaining rides one batch at a time, while it is sent
+                    streamed_rides = (ride for batch in PassengerService._iter_candidate_batches(
+                        specifications, corridor_areas, position) for ride in batch)
+                else:
+                    more_rides, _ = PassengerService._fetch_candidates(
+                        specifications, corridor_areas, position, needed - len(filtered_rides) if needed else None)
+                    filtered_rides.extend(more_rides)
+
+            next_cursor = None
+            scores = None
+            if ranked:
+                ranking = top_k_rides(filtered_rides, limit or len(filtered_rides),
+                                      departure_point, destination_point, departure_date)
+                page = [ride for ride, _, _ in ranking]
+                scores = {ride.id: (score, detour) for ride, score, detour in ranking}
+            else:
+                # Keyset pagination: the rides are ordered by (departure_datetime, id) and start after the cursor
+                if limit and len(filtered_rides) > limit:
+                    filtered_rides = filtered_rides[:limit]
+                    next_cursor = encode_cursor(filtered_rides[-1].departure_datetime, filtered_rides[-1].id)
+                page = filtered_rides
+
+            # Only the rides of the page are loaded from the database
+            ride_dicts = PassengerService._iter_ride_dicts((ride.id for ride in chain(page, streamed_rides)), scores)
+            if stream:
+                headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+                return StreamingResponse(ride_dicts, headers=headers).to_response()
+
+            response = Response(success=True, message="Rides retrieved successfully", status_code=200,
+                                data={"ride_posts": list(ride_dicts), "next_cursor": next_cursor})
+            return response.to_tuple()
+        except Exception as e:
+            response = Response(success=False, message=f"Error searching rides: {str(e)}", status_code=400)
+            return response.to_tuple()
+
+    @staticmethod
+    def search_rides_batch(user_id, queries):
+        """
+        Answers several ride searches with one candidate scan: the rides of the union of the
+        queries' time windows are loaded once, and every query is evaluated against them with
+        vectorized time, seat and distance checks.
+
+        Parameters:
+        - user_id: int, the ID of the current user
+        - queries: list, dicts with an "id" and the parameters of search_rides (departure_location,
+          pickup_radius, destination, drop_radius, departure_date, available_seats, delta_hours, limit)
 
         Returns:
-        - response: Response, contains the list of matching rides
+        - response: Response, contains the matching rides of every query keyed by query id
         """
         try:
-            specifications = list()
-
-            if available_seats:
-                specifications.append(AvailableSeatsSpecification(available_seats))
-            if departure_date:
-                specifications.append(DepartureDateSpecification(departure_date, delta_hours))
-
-            # Add RideStatusSpecification to ensure rides are in "waiting" status
-            specifications.append(RideStatusSpecification('waiting'))
-            # Add NotMyRideSpecification to ensure rides are not owned by the current user
-            specifications.append(NotMyRideSpecification(user_id))
-
-            composite_spec = AndSpecification(*specifications)
-            query = Rides.query
-            filtered_rides_query = composite_spec.apply(query)
-            filtered_rides = filtered_rides_query.all()
-
-            # In-memory filtering for departure and destination locations
-            if departure_location and pickup_radius:
-                dep_lat, dep_lng = map(float, departure_location.split(','))
-                filtered_rides = [
-                    ride for ride in filtered_rides
-                    if geodesic((dep_lat, dep_lng), parse_location(ride.departure_location)).km <= pickup_radius
-                ]
-
-            if destination and drop_radius:
-                dest_lat, dest_lng = map(float, destination.split(','))
-                filtered_rides = [
-                    ride for ride in filtered_rides
-                    if geodesic((dest_lat, dest_lng), parse_location(ride.destination)).km <= drop_radius
-                ]
-
-            rides_list = [ride.to_dict() for ride in filtered_rides]
+            parsed = []
+            for query in queries:
+                departure_location, pickup_radius = query.get("departure_location"), query.get("pickup_radius")
+                destination, drop_radius = query.get("destination"), query.get("drop_radius")
+                departure_date = query.get("departure_date")
+                parsed.append({
+                    "id": query["id"],
+                    "departure_point": parse_location(departure_location) if departure_location and pickup_radius
+                    else None,
+                    "pickup_radius": pickup_radius,
+                    "destination_point": parse_location(destination) if destination and drop_radius else None,
+                    "drop_radius": drop_radius,
+                    "window": DepartureDateSpecification(departure_date, query.get("delta_hours", 5)).bounds()
+                    if departure_date else None,
+                    "available_seats": query.get("available_seats") or 0,
+                    "limit": query.get("limit")
+                })
+
+            # One SQL scan for the union of the time windows
+            specifications = [RideStatusSpecification('waiting'), NotMyRideSpecification(user_id)]
+            if parsed and all(query["window"] for query in parsed):
+                specifications.append(DepartureWindowsSpecification([query["window"] for query in parsed]))
+            min_seats = min((query["available_seats"] for query in parsed), default=0)
+            if min_seats:
+                specifications.append(AvailableSeatsSpecification(min_seats))
+            columns = RideCandidate._fields + ('available_seats',)
+            rows = AndSpecification(*specifications).apply(Rides.query) \
+                .with_entities(*[getattr(Rides, column) for column in columns]) \
+                .order_by(Rides.departure_datetime, Rides.id).all() if parsed else []
+
+            ride_ids = np.array([row.id for row in rows], dtype=np.int64)
+            departures = np.array([row.departure_datetime for row in rows], dtype='datetime64[us]')
+            seats = np.array([row.available_seats for row in rows], dtype=float)
+            dep_lat = np.array([row.departure_lat for row in rows], dtype=float)
+            dep_lng = np.array([row.departure_lng for row in rows], dtype=float)
+            dst_lat = np.array([row.destination_lat for row in rows], dtype=float)
+            dst_lng = np.array([row.destination_lng for row in rows], dtype=float)
+
+            matches = {}
+            for query in parsed:
+                mask = seats >= query["available_seats"]
+                if query["window"]:
+                    lower_bound, upper_bound = query["window"]
+                    mask &= (departures >= np.datetime64(lower_bound.replace(tzinfo=None), 'us')) & \
+                            (departures <= np.datetime64(upper_bound.replace(tzinfo=None), 'us'))
+                if query["departure_point"] and mask.any():
+                    mask &= within_radius(query["departure_point"][0], query["departure_point"][1],
+                                          dep_lat, dep_lng, query["pickup_radius"])
+                if query["destination_point"] and mask.any():
+                    mask &= within_radius(query["destination_point"][0], query["destination_point"][1],
+                                          dst_lat, dst_lng, query["drop_radius"])
+                matches[query["id"]] = ride_ids[mask][:query["limit"]].tolist()
+
+            # Every matching ride is loaded and serialized once, however many queries it matches
+            matched_ids = sorted({ride_id for ids in matches.values() for ride_id in ids})
+            ride_dicts = {ride_dict["ride_id"]: ride_dict for ride_dict in PassengerService._iter_ride_dicts(matched_ids)}
+            results = {query_id: [ride_dicts[ride_id] for ride_id in ids if ride_id in ride_dicts]
+                       for query_id, ids in matches.items()}
 
             response = Response(success=True, message="Rides retrieved successfully", status_code=200,
-                                data={"ride_posts": rides_list})
+                                data={"results": results})
             return response.to_tuple()
         except Exception as e:
             response = Response(success=False, message=f"Error searching rides: {str(e)}", status_code=400)
             return response.to_tuple()
 
     @staticmethod
-    def get_my_rides(user_id):
+    def _iter_ride_dicts(ride_ids, scores=None):
+        """
+        Loads rides by ID in batches and yields their dicts in the order of ride_ids. Rides that are
+        no longer waiting are skipped, since cached candidates may have been started or deleted by
+        another worker.
+
+        Parameters:
+        - ride_ids: iterable, the IDs of the rides to serialize; a generator is consumed one batch at a time
+        - scores: dict (optional), ride ID -> (score, detour_km) of ranked searches
+
+        Returns:
+        - generator: the ride dicts
+        """
+        ride_ids = iter(ride_ids)
+        while True:
+            batch = list(islice(ride_ids, STREAM_BATCH_SIZE))
+            if not batch:
+                return
+            rides_by_id = {ride.id: ride for ride in
+                           Rides.query.filter(Rides.id.in_(batch), Rides.status == 'waiting')}
+            for ride_id in batch:
+                ride = rides_by_id.get(ride_id)
+                if ride is None:
+                    continue
+                ride_dict = ride.to_dict()
+                if scores is not None:
+                    score, detour = scores[ride_id]
+                    ride_dict.update({'_score': score, '_detour_km': detour})
+                yield ride_dict
+
+    @staticmethod
+    def _filter_corridor(rides, pickup, pickup_radius, drop, drop_radius):
+        """
+        Keeps the rides whose route passes within pickup_radius of pickup and later within
+        drop_radius of drop. The routes are looked up in the ride index when it is warm and
+        read from the database otherwise.
+
+        Parameters:
+        - rides: list, RideCandidate tuples
+        - pickup: tuple (optional), (lat, lng) of the pickup point
+        - pickup_radius: float (optional), the pickup radius in kilometers
+        - drop: tuple (optional), (lat, lng) of the drop point
+        - drop_radius: float (optional), the drop radius in kilometers
+
+        Returns:
+        - list: the matching rides, in their original order
+        """
+        if not rides or not ((pickup and pickup_radius) or (drop and drop_radius)):
+            return rides
+        if ride_index.is_warm:
+            matching = ride_index.search_corridor(pickup, pickup_radius, drop, drop_radius)
+            return [ride for ride in rides if ride.id in matching]
+
+        matching = set()
+        ride_ids = [ride.id for ride in rides]
+        for start in range(0, len(ride_ids), STREAM_BATCH_SIZE):
+            rows = Rides.query.with_entities(Rides.id, Rides.route_polyline, Rides.departure_lat, Rides.departure_lng,
+                                             Rides.destination_lat, Rides.destination_lng) \
+                .filter(Rides.id.in_(ride_ids[start:start + STREAM_BATCH_SIZE])).all()
+            for ride_id, *route_columns in rows:
+                route = route_of(*route_columns)
+                if route is not None and corridor_match(*route, pickup, pickup_radius, drop, drop_radius):
+                    matching.add(ride_id)
+        return [ride for ride in rides if ride.id in matching]
+
+    @staticmethod
+    def _in_window(window_spec, ride_ids):
+        """
+        Narrows ride_ids to the waiting rides of the departure window, read from the in-process
+        departure index. The SQL window filter is kept either way and does the work when the index
+        is cold, or when the window alone holds too many rides for an IN list.
+
+        Parameters:
+        - window_spec: DepartureDateSpecification (optional), the departure window
+        - ride_ids: set (optional), the candidate ride IDs found so far, None for no restriction
+
+        Returns:
+        - set: the candidate ride IDs, or None for no restriction
+        """
+        if window_spec is None or not departure_index.is_warm:
+            return ride_ids
+        in_window = departure_index.waiting_between(*window_spec.bounds())
+        if ride_ids is None:
+            return set(in_window) if len(in_window) <= MAX_INDEXED_WINDOW_IDS else None
+        return ride_ids.intersection(in_window)
+
+    @staticmethod
+    def _search_specifications(departure_area, destination_area, window_spec, available_seats, corridor):
+        """
+        Builds the SQL specifications of a search of waiting rides. Outside corridor mode, the ride
+        index narrows the rides down by location and the location specifications prefilter them in SQL.
+
+        Parameters:
+        - departure_area: tuple (optional), (lat, lng, radius_km) around the pickup point
+        - destination_area: tuple (optional), (lat, lng, radius_km) around the drop point
+        - window_spec: DepartureDateSpecification (optional), the departure window
+        - available_seats: int (optional), the requested seats
+        - corridor: bool, whether the areas are matched along the routes instead
+
+        Returns:
+        - list: the specifications
+        """
+        specifications = [RideStatusSpecification('waiting')]
+        if available_seats:
+            specifications.append(AvailableSeatsSpecification(available_seats))
+        if window_spec:
+            specifications.append(window_spec)
+
+        if corridor:
+            # The endpoints of the rides say nothing about their routes, so only time, seats and
+            # status are filtered in SQL and the areas are matched along the routes
+            ride_ids = PassengerService._in_window(window_spec, None)
+            if ride_ids is not None:
+                specifications.append(RideIdsSpecification(ride_ids))
+            return specifications
+
+        # PostGIS answers the radius queries exactly with its GiST indexes
+        in_memory_location_filter = Rides.spatial_index_mode() != SPATIAL_MODE_POSTGIS
+
+        # Location lookup in the in-process ride index, so SQL only loads rides near both ends
+        ride_ids = None
+        if in_memory_location_filter and ride_index.is_warm:
+            ride_ids = ride_index.search(departure_area[:2] if departure_area else None,
+                                         departure_area[2] if departure_area else None,
+                                         destination_area[:2] if destination_area else None,
+                                         destination_area[2] if destination_area else None)
+        ride_ids = PassengerService._in_window(window_spec, ride_ids)
+        if ride_ids is not None:
+            specifications.append(RideIdsSpecification(ride_ids))
+
+        # Bounding-box prefilters in SQL, so only nearby rides are loaded
+        if departure_area:
+            specifications.append(DepartureLocationSpecification(f"{departure_area[0]},{departure_area[1]}",
+                                                                 departure_area[2]))
+        if destination_area:
+            specifications.append(DestinationLocationSpecification(f"{destination_area[0]},{destination_area[1]}",
+                                                                   destination_area[2]))
+        return specifications
+
+    @staticmethod
+    def _fetch_candidates(specifications, corridor_areas=None, after=None, needed=None):
+        """
+        Loads the rides matching a search in (departure_datetime, id) order, in batches with ORDER BY
+        and LIMIT in SQL, see _iter_candidate_batches. Fewer than `needed` rides come back only when
+        the matching rides run out.
+
+        Parameters:
+        - specifications: list, the SQL specifications of the search
+        - corridor_areas: tuple (optional), (pickup, pickup_radius, drop, drop_radius) matched along the routes
+        - after: tuple (optional), the (departure_datetime, id) position to start after
+        - needed: int (optional), the number of rides wanted, None for all of them
+
+        Returns:
+        - tuple: (list of RideCandidate tuples, position), where position is the (departure_datetime, id)
+          up to which every ride was checked, or None when the scan reached the last ride
+        """
+        rides = []
+        batch_size = MAX_FETCH_BATCH_ROWS if needed is None else min(max(needed, 1), MAX_FETCH_BATCH_ROWS)
+        for matching in PassengerService._iter_candidate_batches(specifications, corridor_areas, after, batch_size):
+            rides.extend(matching)
+            if needed is not None and len(rides) >= needed:
+                rides = rides[:needed]
+                return rides, (rides[-1].departure_datetime, rides[-1].id)
+        return rides, None
+
+    @staticmethod
+    def _iter_candidate_batches(specifications, corridor_areas=None, after=None, batch_size=None):
+        """
+        Reads the rides matching a search in (departure_datetime, id) order, one batch with ORDER BY and
+        LIMIT at a time, growing up to MAX_FETCH_BATCH_ROWS rows. The checks SQL cannot answer exactly,
+        the radius outside PostGIS and the corridor, run on every batch before it is yielded, and the
+        next batch is only fetched when the caller asks for it.
+
+        Parameters:
+        - specifications: list, the SQL specifications of the search
+        - corridor_areas: tuple (optional), (pickup, pickup_radius, drop, drop_radius) matched along the routes
+        - after: tuple (optional), the (departure_datetime, id) position to start after
+        - batch_size: int (optional), the rows of the first batch, MAX_FETCH_BATCH_ROWS by default
+
+        Returns:
+        - generator: the list of matching RideCandidate tuples of every batch
+        """
+        columns = [getattr(Rides, column) for column in RideCandidate._fields]
+        batch_size = batch_size or MAX_FETCH_BATCH_ROWS
+        while True:
+            # KeysetPageSpecification fetches one row more than its limit
+            composite_spec = AndSpecification(*specifications, KeysetPageSpecification(batch_size - 1, after))
+            rows = [RideCandidate(*row) for row in composite_spec.apply(Rides.query.with_entities(*columns))]
+            matching = composite_spec.residual(rows)
+            if corridor_areas:
+                matching = PassengerService._filter_corridor(matching, *corridor_areas)
+            yield matching
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1].departure_datetime, rows[-1].id)
+            batch_size = min(batch_size * 2, MAX_FETCH_BATCH_ROWS)
+
+    @staticmethod
+    def _load_search_candidates(key):
+        """
+        Loads the waiting rides matching a canonical search key: the key's cells widened to cover
+        every pickup and drop point inside them, and its time bucket widened the same way.
+
+        Parameters:
+        - key: SearchKey, the canonical search key
+
+        Returns:
+        - tuple: (RideCandidate tuples ordered by (departure_datetime, id), frontier), at most
+          search_cache.max_candidates of them; frontier is the (departure_datetime, id) up to which
+          they are complete, None when they are all the candidates of the key
+        """
+        window = search_cache.window(key)
+        window_spec = DepartureDateSpecification(*window) if window else None
+        departure_area = search_cache.area(key.departure_cell, key.pickup_radius)
+        destination_area = search_cache.area(key.destination_cell, key.drop_radius)
+
+        specifications = PassengerService._search_specifications(departure_area, destination_area, window_spec,
+                                                                 key.available_seats, key.corridor)
+        corridor_areas = None
+        if key.corridor:
+            corridor_areas = (departure_area[:2] if departure_area else None,
+                              departure_area[2] if departure_area else None,
+                              destination_area[:2] if destination_area else None,
+                              destination_area[2] if destination_area else None)
+        return PassengerService._fetch_candidates(specifications, corridor_areas,
+                                                  needed=max(search_cache.max_candidates, 1))
+
+    @staticmethod
+    def get_my_rides(user_id, stream=False):
         try:
-            results = db.session.query(Rides, JoinRideRequests.status).join(JoinRideRequests,
-                                                                            Rides.id == JoinRideRequests.ride_id).filter(
-                JoinRideRequests.passenger_id == user_id).all()
+            query = db.session.query(Rides, JoinRideRequests.status).join(JoinRideRequests,
+                                                                          Rides.id == JoinRideRequests.ride_id).filter(
+                JoinRideRequests.passenger_id == user_id)
+            if stream:
+                # Lazy generator over a server-side cursor, consumed while the response is sent
+                return (serializeResult(x) for x in query.order_by(Rides.id).yield_per(STREAM_BATCH_SIZE))
+            results = query.all()
             return [serializeResult(x) for x in results]
         except Exception as e:
             raise Exception("cannot get the rides", 404)
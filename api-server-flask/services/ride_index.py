@@ -0,0 +1,283 @@
+import threading
+from collections import defaultdict
+from datetime import datetime
+from math import floor
+
+import numpy as np
+
+from models import Rides
+from utils.batch_distance import within_radius
+from utils.kd_tree import DynamicKDTree
+from utils.location_utils import bounding_box
+from utils.route_sampling import ROUTE_SAMPLE_SPACING_KM, corridor_match, decode_route
+
+DEFAULT_CELL_DEGREES = 0.05
+
+
+class RideGridIndex:
+    """
+    In-process grid index of waiting rides with future departures.
+
+    Every ride is stored in one cell for its departure point and one cell for its destination.
+    A radius search only looks at the cells overlapping the radius' bounding box, and then
+    checks the exact distance on the coordinates kept in the index.
+
+    Searches on both ends at once use a joint (dep_lat, dep_lng, dst_lat, dst_lng) k-d tree
+    instead, so rides that match only one end are never looked at.
+
+    Rides with a stored route are also registered in every cell their sampled route points fall
+    in, for corridor searches that match passengers along the way.
+
+    The index only sees the rides posted, updated or deleted through this process, so a search
+    that finds no ride in it is only right with a single worker, see gunicorn-cfg.py.
+    """
+
+    def __init__(self, cell_degrees=DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.is_warm = False
+        self._entries = {}
+        self._departure_cells = defaultdict(set)
+        self._destination_cells = defaultdict(set)
+        self._joint = DynamicKDTree(4)
+        self._routes = {}
+        self._route_cells = {}
+        self._corridor_cells = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def cell_of(self, lat, lng):
+        return floor(lat / self.cell_degrees), floor(lng / self.cell_degrees)
+
+    def cells_within(self, lat, lng, radius_km):
+        """
+        Returns the cells that overlap the bounding box of a radius around (lat, lng).
+        """
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+        min_row, min_col = self.cell_of(min_lat, min_lng)
+        max_row, max_col = self.cell_of(max_lat, max_lng)
+        return [(row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+
+    @staticmethod
+    def is_indexable(ride):
+        return ride.status == 'waiting' and ride.departure_datetime > datetime.now()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, ride_id):
+        return ride_id in self._entries
+
+    def add(self, ride):
+        """
+        Inserts or re-indexes a ride. Rides that are no longer waiting or already departed are removed.
+        """
+        with self._lock:
+            self.remove(ride.id)
+            entry = self._index_cells(ride)
+            if entry is not None and entry[0] is not None and entry[2] is not None:
+                self._joint.insert(ride.id, entry[:4])
+
+    def _index_cells(self, ride):
+        if not self.is_indexable(ride):
+            return None
+        entry = (ride.departure_lat, ride.departure_lng, ride.destination_lat, ride.destination_lng,
+                 ride.departure_datetime)
+        self._entries[ride.id] = entry
+        if ride.departure_lat is not None:
+            self._departure_cells[self.cell_of(ride.departure_lat, ride.departure_lng)].add(ride.id)
+        if ride.destination_lat is not None:
+            self._destination_cells[self.cell_of(ride.destination_lat, ride.destination_lng)].add(ride.id)
+        polyline = getattr(ride, 'route_polyline', None)
+        if polyline:
+            lats, lngs = decode_route(polyline)
+            cells = set(zip(np.floor(lats / self.cell_degrees).astype(int).tolist(),
+                            np.floor(lngs / self.cell_degrees).astype(int).tolist()))
+            self._routes[ride.id] = (lats, lngs)
+            self._route_cells[ride.id] = cells
+            for cell in cells:
+                self._corridor_cells[cell].add(ride.id)
+        return entry
+
+    def remove(self, ride_id):
+        with self._lock:
+            entry = self._entries.pop(ride_id, None)
+            if entry is None:
+                return
+            dep_lat, dep_lng, dst_lat, dst_lng, _ = entry
+            if dep_lat is not None:
+                self._discard(self._departure_cells, self.cell_of(dep_lat, dep_lng), ride_id)
+            if dst_lat is not None:
+                self._discard(self._destination_cells, self.cell_of(dst_lat, dst_lng), ride_id)
+            for cell in self._route_cells.pop(ride_id, ()):
+                self._discard(self._corridor_cells, cell, ride_id)
+            self._routes.pop(ride_id, None)
+            self._joint.delete(ride_id)
+
+    @staticmethod
+    def _discard(cells, cell, ride_id):
+        members = cells.get(cell)
+        if members is not None:
+            members.discard(ride_id)
+            if not members:
+                del cells[cell]
+
+    def remove_departed(self, now=None):
+        """
+        Drops rides whose departure time has passed.
+
+        Returns:
+        - int: the number of removed rides
+        """
+        now = now or datetime.now()
+        with self._lock:
+            departed = [ride_id for ride_id, entry in self._entries.items() if entry[4] <= now]
+            for ride_id in departed:
+                self.remove(ride_id)
+        return len(departed)
+
+    def _search_end(self, cells, lat, lng, radius_km, coordinate_offset):
+        candidate_ids = [ride_id for cell in self.cells_within(lat, lng, radius_km) for ride_id in cells.get(cell, ())]
+        if not candidate_ids:
+            return set()
+        mask = within_radius(lat, lng,
+                             [self._entries[ride_id][coordinate_offset] for ride_id in candidate_ids],
+                             [self._entries[ride_id][coordinate_offset + 1] for ride_id in candidate_ids],
+                             radius_km)
+        return {ride_id for ride_id, keep in zip(candidate_ids, mask) if keep}
+
+    def _search_joint(self, departure, pickup_radius, destination, drop_radius):
+        dep_box = bounding_box(departure[0], departure[1], pickup_radius)
+        dst_box = bounding_box(destination[0], destination[1], drop_radius)
+        mins = (dep_box[0], dep_box[2], dst_box[0], dst_box[2])
+        maxs = (dep_box[1], dep_box[3], dst_box[1], dst_box[3])
+        candidate_ids = self._joint.range_query(mins, maxs)
+        if not candidate_ids:
+            return set()
+        entries = [self._entries[ride_id] for ride_id in candidate_ids]
+        mask = within_radius(departure[0], departure[1], [e[0] for e in entries], [e[1] for e in entries],
+                             pickup_radius)
+        mask &= within_radius(destination[0], destination[1], [e[2] for e in entries], [e[3] for e in entries],
+                              drop_radius)
+        return {ride_id for ride_id, keep in zip(candidate_ids, mask) if keep}
+
+    def search(self, departure=None, pickup_radius=None, destination=None, drop_radius=None):
+        """
+        Finds the rides whose departure is within pickup_radius of departure and whose
+        destination is within drop_radius of destination.
+
+        Parameters:
+        - departure: tuple (optional), (lat, lng) of the pickup point
+        - pickup_radius: float (optional), the pickup radius in kilometers
+        - destination: tuple (optional), (lat, lng) of the drop point
+        - drop_radius: float (optional), the drop radius in kilometers
+
+        Returns:
+        - set: the matching ride IDs, or None when no location constraint was given
+        """
+        with self._lock:
+            if departure and pickup_radius and destination and drop_radius:
+                return self._search_joint(departure, pickup_radius, destination, drop_radius)
+            result = None
+            if departure and pickup_radius:
+                result = self._search_end(self._departure_cells, departure[0], departure[1], pickup_radius, 0)
+            if destination and drop_radius and result != set():
+                matches = self._search_end(self._destination_cells, destination[0], destination[1], drop_radius, 2)
+                result = matches if result is None else result & matches
+            return result
+
+    def search_corridor(self, pickup=None, pickup_radius=None, drop=None, drop_radius=None):
+        """
+        Finds the rides whose route passes within pickup_radius of pickup and, later on the
+        route, within drop_radius of drop.
+
+        Parameters:
+        - pickup: tuple (optional), (lat, lng) of the pickup point
+        - pickup_radius: float (optional), the pickup radius in kilometers
+        - drop: tuple (optional), (lat, lng) of the drop point
+        - drop_radius: float (optional), the drop radius in kilometers
+
+        Returns:
+        - set: the matching ride IDs, or None when no location constraint was given
+        """
+        with self._lock:
+            candidates = None
+            for point, radius in ((pickup, pickup_radius), (drop, drop_radius)):
+                if point and radius:
+                    # Routes are registered by their samples, and a segment within the radius has
+                    # its samples at most one sample spacing further away
+                    cells = self.cells_within(point[0], point[1], radius + ROUTE_SAMPLE_SPACING_KM)
+                    near = {ride_id for cell in cells for ride_id in self._corridor_cells.get(cell, ())}
+                    candidates = near if candidates is None else candidates & near
+            if candidates is None:
+                return None
+            return {ride_id for ride_id in candidates
+                    if corridor_match(*self._routes[ride_id], pickup, pickup_radius, drop, drop_radius)}
+
+    def load(self, rides):
+        """
+        Replaces the content of the index with the given rides, bulk-loading the joint tree.
+
+        Returns:
+        - int: the number of indexed rides
+        """
+        with self._lock:
+            self._entries.clear()
+            self._departure_cells.clear()
+            self._destination_cells.clear()
+            self._routes.clear()
+            self._route_cells.clear()
+            self._corridor_cells.clear()
+            for ride in rides:
+                self._index_cells(ride)
+            joint_entries = {ride_id: entry[:4] for ride_id, entry in self._entries.items()
+                             if entry[0] is not None and entry[2] is not None}
+            self._joint.bulk_load(list(joint_entries), list(joint_entries.values()))
+            return len(self._entries)
+
+    def rebuild(self):
+        """
+        Reloads the index from the Rides table. Must run inside an application context.
+
+        Returns:
+        - int: the number of indexed rides
+        """
+        rides = Rides.query.filter(Rides.status == 'waiting', Rides.departure_datetime > datetime.now()).all()
+        with self._lock:
+            count = self.load(rides)
+            self.is_warm = True
+            return count
+
+    def check_consistency(self):
+        """
+        Compares the index with the Rides table. Must run inside an application context.
+
+        Returns:
+        - dict: "missing" holds ride IDs that should be indexed but are not, "stale" holds indexed
+          ride IDs that are no longer waiting future rides or whose coordinates have changed
+        """
+        now = datetime.now()
+        rows = Rides.query.with_entities(
+            Rides.id, Rides.departure_lat, Rides.departure_lng, Rides.destination_lat, Rides.destination_lng
+        ).filter(Rides.status == 'waiting', Rides.departure_datetime > now).all()
+        expected = {row[0]: tuple(row[1:]) for row in rows}
+        with self._lock:
+            indexed = {ride_id: entry[:4] for ride_id, entry in self._entries.items() if entry[4] > now}
+        return {
+            "missing": sorted(set(expected) - set(indexed)),
+            "stale": sorted(ride_id for ride_id, coordinates in indexed.items()
+                            if expected.get(ride_id) != coordinates)
+        }
+
+    def verify(self):
+        """
+        Scheduled consistency check: rebuilds the index when it has drifted from the Rides table.
+
+        Returns:
+        - dict: the consistency report from before the rebuild
+        """
+        from api import app
+        with app.app_context():
+            report = self.check_consistency()
+            if report["missing"] or report["stale"]:
+                print(f"> Ride index out of sync (missing={report['missing']}, stale={report['stale']}), rebuilding")
+                self.rebuild()
+        return report
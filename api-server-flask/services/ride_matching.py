@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from models import RideOffers, RideMatches, db
+from services import offer_index
+
+
+def match_ride_offers(ride):
+    """
+    Finds the open ride offers compatible with a newly posted ride in the offer index and stores
+    them as suggested matches for the driver.
+
+    Parameters:
+    - ride: Rides, the committed ride
+
+    Returns:
+    - int: the number of stored matches
+    """
+    candidates = offer_index.match(ride)
+    if not candidates:
+        return 0
+
+    # The index may lag behind offers deleted through other workers, so the candidates are checked in one query
+    open_offer_ids = {row[0] for row in db.session.query(RideOffers.id).filter(
+        RideOffers.id.in_([candidate[0] for candidate in candidates]),
+        RideOffers.departure_datetime > datetime.now())}
+    matches = [{"ride_id": ride.id, "offer_id": offer_id, "passenger_id": passenger_id,
+                "pickup_distance": pickup_distance, "drop_distance": drop_distance, "created_at": datetime.now()}
+               for offer_id, passenger_id, pickup_distance, drop_distance in candidates
+               if offer_id in open_offer_ids]
+
+    RideMatches.delete_for_ride(ride.id)
+    db.session.bulk_insert_mappings(RideMatches, matches)
+    db.session.commit()
+    return len(matches)
@@ -0,0 +1,65 @@
+import heapq
+from datetime import datetime
+
+import numpy as np
+
+from utils.batch_distance import haversine_km
+
+# One hour between the requested and the actual departure costs as much as this many kilometers of detour
+DETOUR_KM_PER_HOUR = 30
+
+
+def detour_km(rides, pickup=None, drop=None):
+    """
+    Estimates the driver's detour for every ride with the haversine triangle
+    driver origin -> pickup -> drop -> driver destination, compared with the direct route.
+
+    Parameters:
+    - rides: list, rides with numeric coordinate columns
+    - pickup: tuple (optional), (lat, lng) of the passenger's pickup point
+    - drop: tuple (optional), (lat, lng) of the passenger's drop point
+
+    Returns:
+    - numpy.ndarray: detours in kilometers, NaN for rides without coordinates
+    """
+    dep_lat = np.array([ride.departure_lat for ride in rides], dtype=float)
+    dep_lng = np.array([ride.departure_lng for ride in rides], dtype=float)
+    dst_lat = np.array([ride.destination_lat for ride in rides], dtype=float)
+    dst_lng = np.array([ride.destination_lng for ride in rides], dtype=float)
+
+    stops = [point for point in (pickup, drop) if point]
+    if not stops:
+        return np.zeros(len(rides))
+
+    route = haversine_km(stops[0][0], stops[0][1], dep_lat, dep_lng)
+    if len(stops) == 2:
+        route = route + haversine_km(stops[0][0], stops[0][1], stops[1][0], stops[1][1])
+    route = route + haversine_km(stops[-1][0], stops[-1][1], dst_lat, dst_lng)
+    direct = haversine_km(dep_lat, dep_lng, dst_lat, dst_lng)
+    return route - direct
+
+
+def top_k_rides(rides, k, pickup=None, drop=None, departure_datetime=None):
+    """
+    Scores rides by detour and by the gap from the requested departure time, and keeps the best k.
+
+    Parameters:
+    - rides: list, candidate rides
+    - k: int, the number of rides to return
+    - pickup: tuple (optional), (lat, lng) of the passenger's pickup point
+    - drop: tuple (optional), (lat, lng) of the passenger's drop point
+    - departure_datetime: datetime (optional), the requested departure time, defaults to now
+
+    Returns:
+    - list: (ride, score, detour_km) tuples for the best k rides, best first. Score and detour
+      are None for rides whose detour cannot be estimated; they rank last.
+    """
+    if not rides:
+        return []
+    departure_datetime = departure_datetime or datetime.now()
+    detours = detour_km(rides, pickup, drop)
+    gap_hours = np.array([abs((ride.departure_datetime - departure_datetime).total_seconds()) for ride in rides]) / 3600
+    scores = np.nan_to_num(detours + gap_hours * DETOUR_KM_PER_HOUR, nan=np.inf)
+    best = heapq.nsmallest(k, range(len(rides)), key=scores.__getitem__)
+    return [(rides[i], float(scores[i]), float(detours[i])) if np.isfinite(scores[i]) else (rides[i], None, None)
+            for i in best]
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from models import Rides, db
+
+DEFAULT_ROUTE_BACKFILL_BATCH = 50
+
+
+def assign_route(ride):
+    """
+    Samples and stores the route of a ride with coordinates. The caller commits.
+
+    Returns:
+    - bool: True when a route was stored
+    """
+    # utils.maps loads the app config, which imports the services
+    from utils.maps import calculate_route
+
+    if ride.departure_lat is None or ride.destination_lat is None:
+        ride.route_polyline = None
+        return False
+    ride.set_route(*calculate_route((ride.departure_lat, ride.departure_lng),
+                                    (ride.destination_lat, ride.destination_lng)))
+    return True
+
+
+def backfill_routes(batch_size=DEFAULT_ROUTE_BACKFILL_BATCH):
+    """
+    Stores the routes of waiting future rides that have coordinates but no route yet, soonest
+    departure first. Each ride costs one directions request, so at most batch_size rides are
+    done per call.
+
+    Returns:
+    - list: the rides that were updated
+    """
+    rides = Rides.query.filter(Rides.status == 'waiting', Rides.departure_datetime > datetime.now(),
+                               Rides.route_polyline.is_(None), Rides.departure_lat.isnot(None),
+                               Rides.destination_lat.isnot(None)) \
+        .order_by(Rides.departure_datetime, Rides.id).limit(batch_size).all()
+    for ride in rides:
+        assign_route(ride)
+    db.session.commit()
+    return rides
+
+
+def backfill_routes_job(batch_size=DEFAULT_ROUTE_BACKFILL_BATCH):
+    """
+    Scheduled backfill of one batch of routes. The rides are re-indexed, so corridor searches
+    find them right away.
+
+    Returns:
+    - int: the number of rides that were updated
+    """
+    from api import app
+    from services import ride_index, search_cache
+    with app.app_context():
+        rides = backfill_routes(batch_size)
+        for ride in rides:
+            ride_index.add(ride)
+            search_cache.invalidate_ride(ride)
+        return len(rides)
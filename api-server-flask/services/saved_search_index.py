@@ -0,0 +1,222 @@
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from math import floor
+
+import numpy as np
+
+from models import SavedSearches
+from utils.batch_distance import within_radius
+from utils.location_utils import bounding_box
+
+DEFAULT_CELL_DEGREES = 0.05
+DEFAULT_TIME_BUCKET_MINUTES = 60
+# Searches whose window spans more buckets are kept in a single set checked for every ride
+MAX_TIME_BUCKETS = 2 * 7 * 24
+
+_Entry = namedtuple('_Entry', ['id', 'user_id', 'departure_lat', 'departure_lng', 'pickup_radius',
+                               'destination_lat', 'destination_lng', 'drop_radius', 'window_start', 'window_end',
+                               'available_seats', 'departure_cells', 'destination_cells', 'time_buckets'])
+
+
+class SavedSearchIndex:
+    """
+    In-process index of saved searches by origin cell, destination cell and time bucket.
+
+    A saved search is registered in every cell its pickup and drop radii overlap and in every
+    time bucket its window overlaps; searches without a location constraint, or whose window spans
+    more than MAX_TIME_BUCKETS buckets, go to separate sets.
+    A ride only has to be checked against the searches registered in its own departure cell,
+    destination cell and departure time bucket.
+    """
+
+    def __init__(self, cell_degrees=DEFAULT_CELL_DEGREES, time_bucket_minutes=DEFAULT_TIME_BUCKET_MINUTES):
+        self.cell_degrees = cell_degrees
+        self.time_bucket = timedelta(minutes=time_bucket_minutes)
+        self.is_warm = False
+        self._entries = {}
+        self._departure_cells = defaultdict(set)
+        self._destination_cells = defaultdict(set)
+        self._time_buckets = defaultdict(set)
+        self._any_departure = set()
+        self._any_destination = set()
+        self._any_time = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, search_id):
+        return search_id in self._entries
+
+    def cell_of(self, lat, lng):
+        return floor(lat / self.cell_degrees), floor(lng / self.cell_degrees)
+
+    def _cells_within(self, lat, lng, radius_km):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+        min_row, min_col = self.cell_of(min_lat, min_lng)
+        max_row, max_col = self.cell_of(max_lat, max_lng)
+        return [(row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+
+    def bucket_of(self, moment):
+        return floor((moment - datetime.min) / self.time_bucket)
+
+    def add(self, search):
+        """
+        Inserts or re-indexes a saved search.
+        """
+        departure_cells = self._cells_within(search.departure_lat, search.departure_lng, search.pickup_radius) \
+            if search.departure_lat is not None and search.pickup_radius else None
+        destination_cells = self._cells_within(search.destination_lat, search.destination_lng, search.drop_radius) \
+            if search.destination_lat is not None and search.drop_radius else None
+        time_buckets = range(self.bucket_of(search.window_start), self.bucket_of(search.window_end) + 1)
+        if len(time_buckets) > MAX_TIME_BUCKETS:
+            time_buckets = None
+        entry = _Entry(search.id, search.user_id,
+                       search.departure_lat, search.departure_lng, search.pickup_radius,
+                       search.destination_lat, search.destination_lng, search.drop_radius,
+                       search.window_start, search.window_end, search.available_seats or 0,
+                       departure_cells, destination_cells, time_buckets)
+        with self._lock:
+            self.remove(search.id)
+            self._entries[search.id] = entry
+            self._register(search.id, departure_cells, self._departure_cells, self._any_departure)
+            self._register(search.id, destination_cells, self._destination_cells, self._any_destination)
+            self._register(search.id, time_buckets, self._time_buckets, self._any_time)
+
+    @staticmethod
+    def _register(search_id, cells, by_cell, unbounded):
+        if cells is None:
+            unbounded.add(search_id)
+        else:
+            for cell in cells:
+                by_cell[cell].add(search_id)
+
+    @staticmethod
+    def _unregister(search_id, keys, by_key, unbounded):
+        if keys is None:
+            unbounded.discard(search_id)
+            return
+        for key in keys:
+            members = by_key.get(key)
+            if members is not None:
+                members.discard(search_id)
+                if not members:
+                    del by_key[key]
+
+    def remove(self, search_id):
+        with self._lock:
+            entry = self._entries.pop(search_id, None)
+            if entry is None:
+                return
+            self._unregister(search_id, entry.departure_cells, self._departure_cells, self._any_departure)
+            self._unregister(search_id, entry.destination_cells, self._destination_cells, self._any_destination)
+            self._unregister(search_id, entry.time_buckets, self._time_buckets, self._any_time)
+
+    def remove_expired(self, now=None):
+        """
+        Drops saved searches whose time window has passed.
+
+        Returns:
+        - int: the number of removed searches
+        """
+        now = now or datetime.now()
+        with self._lock:
+            expired = [search_id for search_id, entry in self._entries.items() if entry.window_end < now]
+            for search_id in expired:
+                self.remove(search_id)
+        return len(expired)
+
+    def _candidates(self, ride):
+        candidates = self._time_buckets.get(self.bucket_of(ride.departure_datetime), set()) | self._any_time
+        if not candidates:
+            return candidates
+        departure = set(self._any_departure)
+        if ride.departure_lat is not None:
+            departure |= self._departure_cells.get(self.cell_of(ride.departure_lat, ride.departure_lng), set())
+        candidates &= departure
+        destination = set(self._any_destination)
+        if ride.destination_lat is not None:
+            destination |= self._destination_cells.get(self.cell_of(ride.destination_lat, ride.destination_lng),
+                                                       set())
+        return candidates & destination
+
+    def match(self, ride):
+        """
+        Finds the saved searches a ride satisfies: another user's search whose time window contains
+        the ride's departure, whose seats the ride offers and whose pickup and drop points are within
+        their radii of the ride's departure and destination.
+
+        Parameters:
+        - ride: Rides, the posted or updated ride
+
+        Returns:
+        - list: (search_id, user_id) tuples
+        """
+        with self._lock:
+            entries = [self._entries[search_id] for search_id in self._candidates(ride)]
+        entries = [entry for entry in entries
+                   if entry.user_id != ride.driver_id and entry.available_seats <= ride.available_seats
+                   and entry.window_start <= ride.departure_datetime <= entry.window_end]
+        if not entries:
+            return []
+
+        mask = np.ones(len(entries), dtype=bool)
+        for lat_field, lng_field, radius_field, lat, lng in (
+                ('departure_lat', 'departure_lng', 'pickup_radius', ride.departure_lat, ride.departure_lng),
+                ('destination_lat', 'destination_lng', 'drop_radius', ride.destination_lat, ride.destination_lng)):
+            bounded = np.array([getattr(entry, radius_field) is not None and getattr(entry, lat_field) is not None
+                                for entry in entries])
+            if not bounded.any():
+                continue
+            if lat is None:
+                mask &= ~bounded
+                continue
+            # One vectorized pass: distance from the ride's point to every search's point, each with its own radius
+            inside = within_radius(lat, lng,
+                                   [getattr(entry, lat_field) if flag else np.nan for entry, flag in zip(entries, bounded)],
+                                   [getattr(entry, lng_field) if flag else np.nan for entry, flag in zip(entries, bounded)],
+                                   [getattr(entry, radius_field) if flag else 0 for entry, flag in zip(entries, bounded)])
+            mask &= inside | ~bounded
+        return [(entry.id, entry.user_id) for entry, keep in zip(entries, mask) if keep]
+
+    def load(self, searches):
+        """
+        Replaces the content of the index with the given saved searches.
+
+        Returns:
+        - int: the number of indexed searches
+        """
+        with self._lock:
+            self._entries.clear()
+            self._departure_cells.clear()
+            self._destination_cells.clear()
+            self._time_buckets.clear()
+            self._any_departure.clear()
+            self._any_destination.clear()
+            self._any_time.clear()
+            for search in searches:
+                self.add(search)
+            return len(self._entries)
+
+    def rebuild(self):
+        """
+        Reloads the index from the SavedSearches table. Must run inside an application context.
+
+        Returns:
+        - int: the number of indexed searches
+        """
+        now = datetime.now()
+        searches = [search for search in SavedSearches.query.all() if search.window_end >= now]
+        with self._lock:
+            count = self.load(searches)
+            self.is_warm = True
+            return count
+
+    def refresh(self):
+        """
+        Scheduled reload, so saved searches created through other workers are evaluated as well.
+        """
+        from api import app
+        with app.app_context():
+            return self.rebuild()
@@ -0,0 +1,188 @@
+from datetime import datetime
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Rides, SavedSearches, SavedSearchHits, db
+from services import saved_search_index
+from utils.location_utils import parse_location
+from utils.response import Response
+
+DEFAULT_INBOX_LIMIT = 100
+# Longest half-width of a saved search window
+MAX_DELTA_HOURS = 7 * 24
+
+
+class SavedSearchService:
+
+    @staticmethod
+    def create_saved_search(user_id, departure_location=None, pickup_radius=None, destination=None,
+                            drop_radius=None, departure_date=None, delta_hours=5, available_seats=None):
+        """
+        Stores a standing search. Rides posted or updated from now on that match it are recorded in
+        the user's inbox; rides that already exist are found with a regular search.
+
+        Parameters:
+        - user_id: int, the ID of the current user
+        - departure_location: str (optional), "lat,lng" of the pickup point
+        - pickup_radius: float (optional), the radius from the departure location
+        - destination: str (optional), "lat,lng" of the drop point
+        - drop_radius: float (optional), the radius from the destination
+        - departure_date: datetime, the datetime of departure
+        - delta_hours: float, the number of hours for the time window (default is 5, at most MAX_DELTA_HOURS)
+        - available_seats: int (optional), the number of required seats
+
+        Returns:
+        - response: Response, contains the stored saved search
+        """
+        try:
+            if departure_location and pickup_radius:
+                parse_location(departure_location)
+            if destination and drop_radius:
+                parse_location(destination)
+            if departure_date is None:
+                raise ValueError("Departure date is required")
+            if not 0 < delta_hours <= MAX_DELTA_HOURS:
+                raise ValueError(f"delta_hours must be more than 0 and at most {MAX_DELTA_HOURS}")
+
+            saved_search = SavedSearches(user_id=user_id,
+                                         departure_location=departure_location if pickup_radius else None,
+                                         pickup_radius=pickup_radius if departure_location else None,
+                                         destination=destination if drop_radius else None,
+                                         drop_radius=drop_radius if destination else None,
+                                         departure_datetime=departure_date,
+                                         delta_hours=delta_hours,
+                                         available_seats=available_seats)
+            saved_search.set_coordinates()
+            if saved_search.window_end <= datetime.now():
+                raise ValueError("The search window has already passed")
+            saved_search.save()
+            saved_search_index.add(saved_search)
+
+            response = Response(success=True, message="Saved search created successfully", status_code=200,
+                                data={"saved_search": saved_search.to_dict()})
+            return response.to_tuple()
+        except ValueError as ve:
+            response = Response(success=False, message=f"Validation error: {str(ve)}", status_code=400)
+            return response.to_tuple()
+        except Exception as e:
+            print(f"Error creating saved search: {str(e)}")
+            response = Response(success=False, message="Error creating saved search", status_code=500)
+            return response.to_tuple()
+
+    @staticmethod
+    def get_saved_searches(user_id):
+        """
+        Retrieves the saved searches of a user.
+
+        Parameters:
+        - user_id: int, the ID of the user
+
+        Returns:
+        - response: Response, contains the list of saved searches
+        """
+        try:
+            saved_searches = SavedSearches.query.filter_by(user_id=user_id).order_by(SavedSearches.id).all()
+            response = Response(success=True, message="Saved searches retrieved successfully", status_code=200,
+                                data={"saved_searches": [search.to_dict() for search in saved_searches]})
+            return response.to_tuple()
+        except Exception as e:
+            print(f"Error retrieving saved searches: {str(e)}")
+            response = Response(success=False, message="Error retrieving saved searches", status_code=500)
+            return response.to_tuple()
+
+    @staticmethod
+    def delete_saved_search(user_id, saved_search_id):
+        """
+        Deletes a saved search of the user together with its hits.
+
+        Parameters:
+        - user_id: int, the ID of the current user
+        - saved_search_id: int, the ID of the saved search
+
+        Returns:
+        - response: Response, contains success status and message
+        """
+        try:
+            saved_search = SavedSearches.query.get_or_404(saved_search_id)
+            if saved_search.user_id != user_id:
+                raise ValueError("Unauthorized: only the owner can delete the saved search")
+
+            SavedSearchHits.query.filter_by(saved_search_id=saved_search_id).delete(synchronize_session=False)
+            db.session.delete(saved_search)
+            db.session.commit()
+            saved_search_index.remove(saved_search_id)
+
+            response = Response(success=True, message="Saved search deleted successfully", status_code=200)
+            return response.to_tuple()
+        except ValueError as ve:
+            response = Response(success=False, message=str(ve), status_code=400)
+            return response.to_tuple()
+        except SQLAlchemyError as e:
+            print(f"Error deleting saved search: {str(e)}")
+            db.session.rollback()
+            response = Response(success=False, message="Error deleting saved search", status_code=500)
+            return response.to_tuple()
+
+    @staticmethod
+    def get_hits(user_id, after=None, limit=DEFAULT_INBOX_LIMIT):
+        """
+        Reads the user's inbox of saved search hits on rides that are still waiting.
+
+        Parameters:
+        - user_id: int, the ID of the user
+        - after: int (optional), the last_hit_id of the previous read; only newer hits are returned
+        - limit: int (optional), the maximal number of hits to return
+
+        Returns:
+        - response: Response, contains the hits with their rides and the last_hit_id to pass next time
+        """
+        try:
+            query = db.session.query(SavedSearchHits, Rides).join(Rides, SavedSearchHits.ride_id == Rides.id) \
+                .filter(SavedSearchHits.user_id == user_id, Rides.status == 'waiting',
+                        Rides.departure_datetime > datetime.now())
+            if after is not None:
+                query = query.filter(SavedSearchHits.id > after)
+            results = query.order_by(SavedSearchHits.id).limit(limit).all()
+
+            hits = []
+            for hit, ride in results:
+                hit_dict = hit.to_dict()
+                hit_dict.update({"ride": ride.to_dict()})
+                hits.append(hit_dict)
+            response = Response(success=True, message="Saved search hits retrieved successfully", status_code=200,
+                                data={"hits": hits, "last_hit_id": hits[-1]["id"] if hits else after})
+            return response.to_tuple()
+        except Exception as e:
+            print(f"Error retrieving saved search hits: {str(e)}")
+            response = Response(success=False, message="Error retrieving saved search hits", status_code=500)
+            return response.to_tuple()
+
+    @staticmethod
+    def record_hits(ride):
+        """
+        Evaluates the saved searches registered in the cells and time bucket of a posted or updated
+        ride, and records a hit for each one it newly matches. Hits of searches the ride no longer
+        matches are removed.
+
+        Parameters:
+        - ride: Rides, the committed ride
+
+        Returns:
+        - int: the number of new hits
+        """
+        matches = saved_search_index.match(ride) if ride.status == 'waiting' else []
+        matched_ids = [search_id for search_id, _ in matches]
+
+        stale = SavedSearchHits.query.filter(SavedSearchHits.ride_id == ride.id)
+        if matched_ids:
+            stale = stale.filter(SavedSearchHits.saved_search_id.notin_(matched_ids))
+        stale.delete(synchronize_session=False)
+
+        existing = {row[0] for row in db.session.query(SavedSearchHits.saved_search_id)
+                    .filter(SavedSearchHits.ride_id == ride.id)}
+        new_hits = [{"saved_search_id": search_id, "user_id": user_id, "ride_id": ride.id,
+                     "created_at": datetime.now()}
+                    for search_id, user_id in matches if search_id not in existing]
+        db.session.bulk_insert_mappings(SavedSearchHits, new_hits)
+        db.session.commit()
+        return len(new_hits)
@@ -0,0 +1,286 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime, timedelta
+from math import floor, pi, sqrt
+
+from utils.location_utils import bounding_box, EARTH_RADIUS_KM
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 60
+DEFAULT_KEY_CELL_DEGREES = 0.01
+DEFAULT_FOOTPRINT_CELL_DEGREES = 0.05
+DEFAULT_TIME_BUCKET_MINUTES = 15
+DEFAULT_MAX_CANDIDATES = 500
+
+KM_PER_DEGREE = EARTH_RADIUS_KM * pi / 180
+
+SearchKey = namedtuple('SearchKey', ['departure_cell', 'pickup_radius', 'destination_cell', 'drop_radius',
+                                     'time_bucket', 'delta_hours', 'available_seats', 'corridor'])
+
+# The columns of a ride that the per-request filters, pagination and ranking need
+RideCandidate = namedtuple('RideCandidate', ['id', 'driver_id', 'departure_datetime', 'departure_lat',
+                                             'departure_lng', 'destination_lat', 'destination_lng'])
+
+
+def candidate_of(ride):
+    """
+    Returns a RideCandidate snapshot of a ride, e.g. to invalidate with its state from before a change.
+    """
+    return RideCandidate(*(getattr(ride, column) for column in RideCandidate._fields))
+
+
+# The first candidates of a key in (departure_datetime, id) order: every candidate up to frontier,
+# or all of them when frontier is None
+CachedCandidates = namedtuple('CachedCandidates', ['candidates', 'frontier'])
+
+_Entry = namedtuple('_Entry', ['candidates', 'frontier', 'expires_at', 'departure_cells', 'destination_cells',
+                               'window'])
+
+
+class SearchResultCache:
+    """
+    LRU + TTL cache of ride search candidates, shared by all users.
+
+    A search is reduced to a canonical key: the grid cells of its pickup and drop points, the
+    radii, a departure time bucket and the seats. The cached candidates are the rides matching
+    the whole key, i.e. within radius + half the cell diagonal of the cell center and inside the
+    time window widened by the bucket, so every search with the same key finds its exact result
+    in them. User-specific filters, the exact radius and time checks and pagination run on the
+    cached candidates per request.
+
+    At most max_candidates candidates are cached per key, the first ones in (departure_datetime, id)
+    order, so a miss loads a bounded number of rows; pages past them are read from SQL.
+
+    Entries are dropped when a ride whose departure or destination falls in the cells they cover
+    is posted, updated, joined or deleted.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 cell_degrees=DEFAULT_KEY_CELL_DEGREES, footprint_cell_degrees=DEFAULT_FOOTPRINT_CELL_DEGREES,
+                 time_bucket_minutes=DEFAULT_TIME_BUCKET_MINUTES, max_candidates=DEFAULT_MAX_CANDIDATES):
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self.ttl_seconds = ttl_seconds
+        self.cell_degrees = cell_degrees
+        self.footprint_cell_degrees = footprint_cell_degrees
+        self.time_bucket = timedelta(minutes=time_bucket_minutes)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._by_departure_cell = defaultdict(set)
+        self._by_destination_cell = defaultdict(set)
+        self._any_departure = set()
+        self._any_destination = set()
+        self._lock = threading.RLock()
+
+    def configure(self, max_entries, ttl_seconds, max_candidates=DEFAULT_MAX_CANDIDATES):
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl_seconds = ttl_seconds
+            self.max_candidates = max_candidates
+            while len(self._entries) > max(self.max_entries, 0):
+                self._drop(next(iter(self._entries)))
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key_for(self, departure_point=None, pickup_radius=None, destination_point=None, drop_radius=None,
+                departure_date=None, delta_hours=5, available_seats=None, corridor=False):
+        """
+        Builds the canonical cache key of a search.
+
+        Parameters:
+        - departure_point: tuple (optional), (lat, lng) of the pickup point
+        - pickup_radius: float (optional), the pickup radius in kilometers
+        - destination_point: tuple (optional), (lat, lng) of the drop point
+        - drop_radius: float (optional), the drop radius in kilometers
+        - departure_date: datetime (optional), the requested departure time
+        - delta_hours: float, the half-width of the time window
+        - available_seats: int (optional), the requested seats
+        - corridor: bool (optional), whether the points are matched along the ride routes
+
+        Returns:
+        - SearchKey: the canonical key
+        """
+        departure_cell = self._cell_of(*departure_point) if departure_point and pickup_radius else None
+        destination_cell = self._cell_of(*destination_point) if destination_point and drop_radius else None
+        time_bucket = None
+        if departure_date:
+            time_bucket = (departure_date.tzinfo, floor((departure_date.replace(tzinfo=None) - datetime.min)
+                                                        / self.time_bucket))
+        return SearchKey(departure_cell, float(pickup_radius) if departure_cell else None,
+                         destination_cell, float(drop_radius) if destination_cell else None,
+                         time_bucket, float(delta_hours) if time_bucket else None, available_seats or None,
+                         bool(corridor))
+
+    def _cell_of(self, lat, lng):
+        return floor(lat / self.cell_degrees), floor(lng / self.cell_degrees)
+
+    def area(self, cell, radius_km):
+        """
+        Returns (lat, lng, radius_km) of a circle that contains the radius around every point of the cell.
+        """
+        if cell is None:
+            return None
+        center_lat = (cell[0] + 0.5) * self.cell_degrees
+        center_lng = (cell[1] + 0.5) * self.cell_degrees
+        half_diagonal_km = self.cell_degrees * KM_PER_DEGREE * sqrt(2) / 2
+        return center_lat, center_lng, radius_km + half_diagonal_km
+
+    def window(self, key):
+        """
+        Returns (center, delta_hours) of a time window that contains the window of every search of the key.
+        """
+        if key.time_bucket is None:
+            return None
+        tzinfo, bucket = key.time_bucket
+        center = (datetime.min + bucket * self.time_bucket + self.time_bucket / 2).replace(tzinfo=tzinfo)
+        # A whole bucket of slack, since DepartureDateSpecification rounds the window down to minutes
+        return center, key.delta_hours + self.time_bucket.total_seconds() / 3600
+
+    def _footprint(self, area):
+        if area is None:
+            return None
+        min_lat, max_lat, min_lng, max_lng = bounding_box(*area)
+        size = self.footprint_cell_degrees
+        return {(row, col)
+                for row in range(floor(min_lat / size), floor(max_lat / size) + 1)
+                for col in range(floor(min_lng / size), floor(max_lng / size) + 1)}
+
+    def get(self, key):
+        """
+        Returns the CachedCandidates of a key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return CachedCandidates(entry.candidates, entry.frontier)
+
+    def put(self, key, candidates, generation, frontier=None):
+        """
+        Stores the candidates of a key.
+
+        Parameters:
+        - key: SearchKey, the canonical key
+        - candidates: list, RideCandidate tuples ordered by (departure_datetime, id)
+        - generation: int, the value of self.generation before the candidates were loaded; the
+          entry is not stored when an invalidation happened in between, since it may be stale
+        - frontier: tuple (optional), the (departure_datetime, id) up to which the candidates are
+          complete, None when they are all the candidates of the key
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._drop(key)
+            window = self.window(key)
+            if window is not None:
+                center, delta_hours = window
+                window = (center - timedelta(hours=delta_hours), center + timedelta(hours=delta_hours))
+            # A route can pass through the corridor from anywhere, so corridor entries are
+            # dropped by every ride change inside their time window
+            entry = _Entry(tuple(candidates), frontier, time.monotonic() + self.ttl_seconds,
+                           None if key.corridor else self._footprint(self.area(key.departure_cell, key.pickup_radius)),
+                           None if key.corridor else self._footprint(self.area(key.destination_cell, key.drop_radius)),
+                           window)
+            self._entries[key] = entry
+            self._register(key, entry.departure_cells, self._by_departure_cell, self._any_departure)
+            self._register(key, entry.destination_cells, self._by_destination_cell, self._any_destination)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    @staticmethod
+    def _register(key, cells, by_cell, unbounded):
+        if cells is None:
+            unbounded.add(key)
+        else:
+            for cell in cells:
+                by_cell[cell].add(key)
+
+    @staticmethod
+    def _unregister(key, cells, by_cell, unbounded):
+        if cells is None:
+            unbounded.discard(key)
+            return
+        for cell in cells:
+            members = by_cell.get(cell)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del by_cell[cell]
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unregister(key, entry.departure_cells, self._by_departure_cell, self._any_departure)
+            self._unregister(key, entry.destination_cells, self._by_destination_cell, self._any_destination)
+
+    def _footprint_cell(self, lat, lng):
+        return floor(lat / self.footprint_cell_degrees), floor(lng / self.footprint_cell_degrees)
+
+    def invalidate_ride(self, ride):
+        """
+        Drops the entries that may contain the ride, given its current coordinates and departure time.
+        Call it with the old state of a ride before a change as well as with the new one after it.
+
+        Returns:
+        - int: the number of dropped entries
+        """
+        with self._lock:
+            self.generation += 1
+            keys = set(self._any_departure)
+            if ride.departure_lat is not None:
+                keys |= self._by_departure_cell.get(self._footprint_cell(ride.departure_lat, ride.departure_lng),
+                                                    set())
+            destination_keys = set(self._any_destination)
+            if ride.destination_lat is not None:
+                destination_keys |= self._by_destination_cell.get(
+                    self._footprint_cell(ride.destination_lat, ride.destination_lng), set())
+            keys &= destination_keys
+
+            departure_datetime = ride.departure_datetime
+            dropped = 0
+            for key in keys:
+                window = self._entries[key].window
+                if window is not None and departure_datetime is not None and \
+                        not window[0] <= departure_datetime.replace(tzinfo=window[0].tzinfo) <= window[1]:
+                    continue
+                self._drop(key)
+                dropped += 1
+            self.invalidations += dropped
+            return dropped
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_departure_cell.clear()
+            self._by_destination_cell.clear()
+            self._any_departure.clear()
+            self._any_destination.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: entry count, hits, misses, hit rate and the number of invalidated entries
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0, "invalidations": self.invalidations}
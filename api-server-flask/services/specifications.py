@@ -1,47 +1,271 @@
+from collections import namedtuple
+from math import pi
+
+import numpy as np
 from sqlalchemy.orm import Query
-from sqlalchemy import func, cast, types
+from sqlalchemy import func, and_, or_
 from models import Rides
+from models.rides import departure_rtree, destination_rtree, departure_geography, destination_geography, \
+    SPATIAL_MODE_POSTGIS
 from datetime import datetime, timedelta
 
-from utils.location_utils import parse_location
-from utils.maps import calculate_distance
-import geocoder
+from utils.batch_distance import within_radius
+from utils.geocoding import geocode
+from utils.location_utils import parse_location, try_parse_location, bounding_box
+
+# Rough size of the population the selectivity estimates are relative to
+ESTIMATED_RIDE_ROWS = 10000
+ESTIMATED_SERVICE_AREA_KM2 = 22000
+ESTIMATED_BOOKING_HORIZON_HOURS = 7 * 24
+ESTIMATED_MAX_SEATS = 7
+
+# Relative in-memory cost per candidate of a per-item check and of a vectorized one
+PER_ITEM_COST = 1.0
+VECTORIZED_COST = 0.05
+
+QueryPlan = namedtuple('QueryPlan', ['sql', 'memory'])
 
 
 class Specification:
+    """
+    A filter on rides that can run as SQL on a query, in memory on loaded items, or both.
+
+    Planner metadata:
+    - sql: whether apply() can compile the specification to SQL
+    - exact_sql: whether the SQL filter is exact; when it is only a prefilter the specification
+      also has to run in memory on the loaded rows
+    - vectorized: whether mask() and filter_many() evaluate a whole candidate list in one NumPy pass
+    - terminal: whether the specification depends on the final row order and must run last
+    - selectivity(): the estimated fraction of rides it keeps
+    """
+    sql = True
+    exact_sql = True
+    vectorized = False
+    terminal = False
+
     def is_satisfied_by(self, item) -> bool:
         raise NotImplementedError
 
     def apply(self, query: Query):
         raise NotImplementedError
 
+    def mask(self, items):
+        """
+        Evaluates the specification on a list of items.
+
+        Returns:
+        - numpy.ndarray: boolean mask of the items that satisfy it
+        """
+        return np.fromiter((self.is_satisfied_by(item) for item in items), dtype=bool, count=len(items))
+
+    def filter_many(self, items):
+        """
+        Evaluates the specification on a whole candidate list at once.
+
+        Parameters:
+        - items: iterable, the candidates
+
+        Returns:
+        - list: the candidates that satisfy the specification, in their original order
+        """
+        items = list(items)
+        if not items:
+            return items
+        return [item for item, keep in zip(items, self.mask(items)) if keep]
+
+    def selectivity(self) -> float:
+        return 0.5
+
+    def cost(self) -> float:
+        """
+        Relative in-memory cost per candidate.
+        """
+        return VECTORIZED_COST if self.vectorized else PER_ITEM_COST
+
+    def rank(self) -> float:
+        """
+        In-memory ordering key: cheap specifications that drop many candidates run first.
+        """
+        return self.cost() / max(1 - self.selectivity(), 1e-6)
+
+    def describe(self) -> str:
+        return type(self).__name__
+
 
 class AndSpecification(Specification):
+    """
+    Conjunction of specifications, evaluated by a small planner: every specification that
+    compiles to SQL is pushed into the query, most selective first, and the rest (and the
+    SQL prefilters that are not exact) run in memory, cheapest per dropped candidate first.
+    """
     def __init__(self, *specifications):
         self.specifications = specifications
+        self._plans = {}
+
+    @property
+    def exact_sql(self):
+        return all(spec.sql and spec.exact_sql for spec in self.specifications)
+
+    @property
+    def vectorized(self):
+        return all(spec.vectorized for spec in self.specifications)
+
+    def selectivity(self) -> float:
+        return float(np.prod([spec.selectivity() for spec in self.specifications]))
+
+    def plan(self, sql=True):
+        """
+        Orders the specifications for execution.
+
+        Parameters:
+        - sql: bool (optional), False when the items are already in memory and nothing runs in SQL
+
+        Returns:
+        - QueryPlan: (sql, memory) lists of specifications in execution order
+        """
+        plan = self._plans.get(sql)
+        if plan is None:
+            sql_specs = [spec for spec in self.specifications if sql and spec.sql]
+            memory_specs = [spec for spec in self.specifications if not (sql and spec.sql and spec.exact_sql)]
+            plan = self._plans[sql] = QueryPlan(
+                sorted(sql_specs, key=lambda spec: (spec.terminal, spec.selectivity())),
+                sorted(memory_specs, key=lambda spec: (spec.terminal, spec.rank())))
+        return plan
+
+    def explain(self, sql=True) -> str:
+        """
+        Describes the execution plan, one specification per line with its estimated selectivity.
+        """
+        plan = self.plan(sql)
+        lines = []
+        for stage, specs in (('SQL', plan.sql), ('memory', plan.memory)):
+            lines.append(f"{stage}:" if specs else f"{stage}: -")
+            for position, spec in enumerate(specs, start=1):
+                details = f"selectivity={spec.selectivity():.3g}"
+                if stage == 'memory':
+                    details += f", {'vectorized' if spec.vectorized else 'per item'}, rank={spec.rank():.3g}"
+                elif not spec.exact_sql:
+                    details += ", prefilter"
+                lines.append(f"  {position}. {spec.describe()} ({details})")
+        return "\n".join(lines)
 
     def is_satisfied_by(self, item) -> bool:
-        return all(spec.is_satisfied_by(item) for spec in self.specifications)
+        return all(spec.is_satisfied_by(item) for spec in self.plan(sql=False).memory)
 
     def apply(self, query: Query) -> Query:
-        for spec in self.specifications:
+        for spec in self.plan().sql:
             query = spec.apply(query)
         return query
 
+    def mask(self, items):
+        selected = np.ones(len(items), dtype=bool)
+        remaining = np.arange(len(items))
+        for spec in self.plan(sql=False).memory:
+            if not len(remaining):
+                break
+            keep = spec.mask([items[i] for i in remaining])
+            selected[remaining[~keep]] = False
+            remaining = remaining[keep]
+        return selected
+
+    def filter_many(self, items):
+        """
+        Evaluates every specification in memory, in planned order, each one only on the
+        candidates the previous ones kept.
+        """
+        return self._run(self.plan(sql=False).memory, items)
+
+    def residual(self, items):
+        """
+        Evaluates, on the rows loaded with apply(), the specifications SQL could not answer exactly.
+        """
+        return self._run(self.plan().memory, items)
+
+    @staticmethod
+    def _run(specs, items):
+        items = list(items)
+        for spec in specs:
+            if not items:
+                break
+            items = spec.filter_many(items)
+        return items
+
 
 class AvailableSeatsSpecification(Specification):
+    vectorized = True
+
     def __init__(self, available_seats: int):
         self.available_seats = available_seats
 
     def is_satisfied_by(self, item) -> bool:
         return item.available_seats >= self.available_seats
 
+    def mask(self, items):
+        return np.array([item.available_seats for item in items], dtype=float) >= self.available_seats
+
+    def selectivity(self) -> float:
+        return min(max((ESTIMATED_MAX_SEATS - self.available_seats + 1) / ESTIMATED_MAX_SEATS, 0.01), 1.0)
+
+    def describe(self) -> str:
+        return f"AvailableSeatsSpecification(>= {self.available_seats})"
+
     def apply(self, query: Query):
         return query.filter(Rides.available_seats >= self.available_seats)
 
 
-# TODO: Try to do this in query
+def radius_selectivity(radius_km: float) -> float:
+    """
+    Estimated fraction of rides with an endpoint inside a radius.
+    """
+    return min(pi * radius_km ** 2 / ESTIMATED_SERVICE_AREA_KM2, 1.0)
+
+
+def parsed_coordinates(location_str):
+    """
+    Returns (lat, lng) of a "lat,lng" string, or None when it is not one.
+    """
+    lat, lng = try_parse_location(location_str)
+    return None if lat is None else (lat, lng)
+
+
+def coordinates_of(items, lat_field, lng_field, location_field=None, resolve=None):
+    """
+    Collects one coordinate pair per item as float arrays, NaN where the item has no coordinates.
+
+    Parameters:
+    - items: list, the candidates
+    - lat_field, lng_field: str, the names of the numeric coordinate attributes
+    - location_field: str (optional), the name of the location string attribute, used for the
+      items without numeric coordinates
+    - resolve: callable (optional), turns a location string into (lat, lng) or None; it runs
+      once per distinct string
+
+    Returns:
+    - tuple: (lats, lngs) numpy arrays
+    """
+    lats = np.array([getattr(item, lat_field, None) for item in items], dtype=float)
+    lngs = np.array([getattr(item, lng_field, None) for item in items], dtype=float)
+    if location_field is not None:
+        resolved = {}
+        for i in np.flatnonzero(np.isnan(lats) | np.isnan(lngs)):
+            location = getattr(items[i], location_field, None)
+            if not location:
+                continue
+            if location not in resolved:
+                resolved[location] = resolve(location)
+            if resolved[location] is not None:
+                lats[i], lngs[i] = resolved[location]
+    return lats, lngs
+
+
 class DepartureLocationSpecification(Specification):
+    """
+    Departure within pickup_radius. The SQL filter is exact on PostGIS only; elsewhere it is a
+    bounding-box prefilter and the exact distance runs in memory, in one pass over all candidates,
+    on their numeric coordinates or on their geocoded departure_location.
+    """
+    vectorized = True
+
     def __init__(self, departure_location: str, pickup_radius: float):
         self.departure_location = departure_location
         self.pickup_radius = pickup_radius
@@ -50,82 +274,300 @@ class DepartureLocationSpecification(Specification):
     def geocode_location(self, location_str):
         """
         Use a geocoding service to convert a location string to latitude and longitude.
+        Strings that are already "lat,lng" coordinates are parsed without geocoding, and
+        addresses go through the geocode cache, so each one is geocoded once.
         """
-        g = geocoder.google(location_str)
-        if g.ok:
-            return g.latlng
+        location = geocode(location_str)
+        if location is not None:
+            return list(location)
         else:
             raise ValueError(f"Unable to geocode location: {location_str}")
 
+    def try_geocode_location(self, location_str):
+        try:
+            return tuple(self.geocode_location(location_str))
+        except Exception as e:
+            print(f"Error geocoding location {location_str}: {str(e)}")
+            return None
+
     def is_satisfied_by(self, item) -> bool:
-        item_location = self.geocode_location(item.departure_location)
-        distance = calculate_distance(self.location, item_location)
-        return distance <= self.pickup_radius
+        return bool(self.mask([item])[0])
+
+    @property
+    def exact_sql(self):
+        return Rides.spatial_index_mode() == SPATIAL_MODE_POSTGIS
+
+    def mask(self, items):
+        return within_radius(self.location[0], self.location[1],
+                             *coordinates_of(items, 'departure_lat', 'departure_lng', 'departure_location',
+                                             self.try_geocode_location),
+                             self.pickup_radius)
+
+    def selectivity(self) -> float:
+        return radius_selectivity(self.pickup_radius)
+
+    def describe(self) -> str:
+        return f"DepartureLocationSpecification({self.location[0]:.4f},{self.location[1]:.4f} " \
+               f"within {self.pickup_radius:g} km)"
 
     def apply(self, query: Query) -> Query:
-        point = func.ST_GeomFromText(f'POINT({self.location[1]} {self.location[0]})', 4326)
-        departure_location_point = func.ST_GeomFromText(
-            func.concat(
-                'POINT(',
-                cast(Rides.latitude, types.String),
-                ' ',
-                cast(Rides.longitude, types.String),
-                ')'
-            ),
-            4326
-        )
-        return query.filter(
-            func.ST_Distance(departure_location_point, point) <= self.pickup_radius * 1000
-        )
+        """
+        Restricts the query to rides whose departure is within the pickup radius on PostGIS, or inside
+        its bounding box otherwise. Only the PostGIS filter is exact; in the other modes the exact
+        distance check still has to run afterwards.
+        """
+        mode = Rides.spatial_index_mode()
+        if mode == SPATIAL_MODE_POSTGIS:
+            return apply_postgis_within(query, departure_geography,
+                                        self.location[0], self.location[1], self.pickup_radius)
+        if mode is None:
+            return DepartureAreaSpecification(self.location[0], self.location[1], self.pickup_radius).apply(query)
+        return apply_rtree_box(query, departure_rtree, self.location[0], self.location[1], self.pickup_radius)
 
 
-# TODO: Try to do this in query
 class DestinationLocationSpecification(Specification):
+    """
+    Destination within drop_radius, exact in SQL on PostGIS only, like DepartureLocationSpecification.
+    """
+    vectorized = True
+
     def __init__(self, destination: str, drop_radius: float):
         self.destination = destination
         self.drop_radius = drop_radius
         self.lat, self.lng = parse_location(destination)
 
     def is_satisfied_by(self, item) -> bool:
-        item_lat, item_lng = parse_location(item.destination)
-        distance = calculate_distance((self.lat, self.lng), (item_lat, item_lng))
-        return distance <= self.drop_radius
+        return bool(self.mask([item])[0])
+
+    @property
+    def exact_sql(self):
+        return Rides.spatial_index_mode() == SPATIAL_MODE_POSTGIS
+
+    def mask(self, items):
+        return within_radius(self.lat, self.lng,
+                             *coordinates_of(items, 'destination_lat', 'destination_lng', 'destination',
+                                             parsed_coordinates),
+                             self.drop_radius)
+
+    def selectivity(self) -> float:
+        return radius_selectivity(self.drop_radius)
+
+    def describe(self) -> str:
+        return f"DestinationLocationSpecification({self.lat:.4f},{self.lng:.4f} within {self.drop_radius:g} km)"
+
+    def apply(self, query: Query) -> Query:
+        """
+        Restricts the query to rides whose destination is within the drop radius on PostGIS, or inside
+        its bounding box otherwise. Only the PostGIS filter is exact; in the other modes the exact
+        distance check still has to run afterwards.
+        """
+        mode = Rides.spatial_index_mode()
+        if mode == SPATIAL_MODE_POSTGIS:
+            return apply_postgis_within(query, destination_geography, self.lat, self.lng,
+                                        self.drop_radius)
+        if mode is None:
+            return DestinationAreaSpecification(self.lat, self.lng, self.drop_radius).apply(query)
+        return apply_rtree_box(query, destination_rtree, self.lat, self.lng, self.drop_radius)
+
+
+def apply_postgis_within(query: Query, geography_column, lat: float, lng: float, radius: float) -> Query:
+    """
+    Keeps the rides whose geography point is within radius kilometers, using the column's GiST index.
+    """
+    point = func.geography(func.ST_SetSRID(func.ST_MakePoint(lng, lat), 4326))
+    return query.filter(func.ST_DWithin(geography_column, point, radius * 1000))
+
+
+def apply_rtree_box(query: Query, rtree, lat: float, lng: float, radius: float) -> Query:
+    """
+    Joins an R*Tree side table and keeps the rides whose point lies in the bounding box of the radius.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius)
+    return query.join(rtree, rtree.c.id == Rides.id).filter(
+        rtree.c.min_lat >= min_lat,
+        rtree.c.max_lat <= max_lat,
+        rtree.c.min_lng >= min_lng,
+        rtree.c.max_lng <= max_lng
+    )
+
+
+class DepartureAreaSpecification(Specification):
+    """
+    Bounding-box prefilter on the numeric departure coordinates. It is a superset of the
+    rides within pickup_radius, so the exact distance check still has to run afterwards.
+    """
+    vectorized = True
+
+    def __init__(self, lat: float, lng: float, pickup_radius: float):
+        self.min_lat, self.max_lat, self.min_lng, self.max_lng = bounding_box(lat, lng, pickup_radius)
+        self.pickup_radius = pickup_radius
+
+    def is_satisfied_by(self, item) -> bool:
+        return item.departure_lat is not None and \
+            self.min_lat <= item.departure_lat <= self.max_lat and \
+            self.min_lng <= item.departure_lng <= self.max_lng
+
+    def mask(self, items):
+        lats, lngs = coordinates_of(items, 'departure_lat', 'departure_lng')
+        return (lats >= self.min_lat) & (lats <= self.max_lat) & (lngs >= self.min_lng) & (lngs <= self.max_lng)
+
+    def selectivity(self) -> float:
+        # The box is 4/pi times the area of the circle
+        return min(radius_selectivity(self.pickup_radius) * 4 / pi, 1.0)
+
+    def apply(self, query: Query) -> Query:
+        return query.filter(
+            Rides.departure_lat.between(self.min_lat, self.max_lat),
+            Rides.departure_lng.between(self.min_lng, self.max_lng)
+        )
+
+
+class DestinationAreaSpecification(Specification):
+    """
+    Bounding-box prefilter on the numeric destination coordinates. It is a superset of the
+    rides within drop_radius, so the exact distance check still has to run afterwards.
+    """
+    vectorized = True
+
+    def __init__(self, lat: float, lng: float, drop_radius: float):
+        self.min_lat, self.max_lat, self.min_lng, self.max_lng = bounding_box(lat, lng, drop_radius)
+        self.drop_radius = drop_radius
+
+    def is_satisfied_by(self, item) -> bool:
+        return item.destination_lat is not None and \
+            self.min_lat <= item.destination_lat <= self.max_lat and \
+            self.min_lng <= item.destination_lng <= self.max_lng
+
+    def mask(self, items):
+        lats, lngs = coordinates_of(items, 'destination_lat', 'destination_lng')
+        return (lats >= self.min_lat) & (lats <= self.max_lat) & (lngs >= self.min_lng) & (lngs <= self.max_lng)
+
+    def selectivity(self) -> float:
+        # The box is 4/pi times the area of the circle
+        return min(radius_selectivity(self.drop_radius) * 4 / pi, 1.0)
 
     def apply(self, query: Query) -> Query:
-        point = func.ST_SetSRID(func.ST_MakePoint(self.lng, self.lat), 4326)
         return query.filter(
-            func.ST_DWithin(
-                func.ST_SetSRID(func.ST_MakePoint(
-                    func.split_part(Rides.destination, ',', 2).cast(func.Float),
-                    func.split_part(Rides.destination, ',', 1).cast(func.Float)
-                ), 4326),
-                point,
-                self.drop_radius * 1000
-            )
+            Rides.destination_lat.between(self.min_lat, self.max_lat),
+            Rides.destination_lng.between(self.min_lng, self.max_lng)
         )
 
 
+class RideIdsSpecification(Specification):
+    vectorized = True
+
+    def __init__(self, ride_ids):
+        self.ride_ids = set(ride_ids)
+        self._id_array = np.fromiter(self.ride_ids, dtype=np.int64, count=len(self.ride_ids))
+
+    def is_satisfied_by(self, item) -> bool:
+        return item.id in self.ride_ids
+
+    def apply(self, query: Query) -> Query:
+        return query.filter(Rides.id.in_(self.ride_ids))
+
+    def mask(self, items):
+        return np.isin(np.array([item.id for item in items], dtype=np.int64), self._id_array)
+
+    def selectivity(self) -> float:
+        return min(len(self.ride_ids) / ESTIMATED_RIDE_ROWS, 1.0)
+
+    def describe(self) -> str:
+        return f"RideIdsSpecification({len(self.ride_ids)} ids)"
+
+
+def window_selectivity(lower_bound: datetime, upper_bound: datetime) -> float:
+    """
+    Estimated fraction of rides departing inside a time window.
+    """
+    hours = max((upper_bound - lower_bound).total_seconds() / 3600, 0)
+    return min(max(hours / ESTIMATED_BOOKING_HORIZON_HOURS, 0.001), 1.0)
+
+
+def departure_mask(items, lower_bound: datetime, upper_bound: datetime):
+    """
+    Vectorized departure window check on naive datetimes; timezone-aware bounds are compared per item.
+    """
+    if lower_bound.tzinfo is not None or upper_bound.tzinfo is not None:
+        return np.fromiter((lower_bound <= item.departure_datetime <= upper_bound for item in items),
+                           dtype=bool, count=len(items))
+    departures = np.array([item.departure_datetime for item in items], dtype='datetime64[us]')
+    return (departures >= np.datetime64(lower_bound, 'us')) & (departures <= np.datetime64(upper_bound, 'us'))
+
+
 class DepartureDateSpecification(Specification):
+    vectorized = True
+
     def __init__(self, departure_datetime: datetime, delta_hours: int = 5):
         self.departure_datetime = departure_datetime
         self.delta_hours = delta_hours
 
-    def is_satisfied_by(self, item) -> bool:
+    def bounds(self):
         current_time = datetime.now(self.departure_datetime.tzinfo)  # Ensure current_time has the same timezone
         lower_bound = max(self.departure_datetime - timedelta(minutes=int(self.delta_hours*60)), current_time)
         upper_bound = self.departure_datetime + timedelta(minutes=int(self.delta_hours*60))
+        return lower_bound, upper_bound
+
+    def is_satisfied_by(self, item) -> bool:
+        lower_bound, upper_bound = self.bounds()
         return lower_bound <= item.departure_datetime <= upper_bound
 
+    def mask(self, items):
+        return departure_mask(items, *self.bounds())
+
+    def selectivity(self) -> float:
+        lower_bound, upper_bound = self.bounds()
+        return window_selectivity(lower_bound, upper_bound)
+
+    def describe(self) -> str:
+        lower_bound, upper_bound = self.bounds()
+        return f"DepartureDateSpecification({lower_bound:%Y-%m-%d %H:%M} .. {upper_bound:%Y-%m-%d %H:%M})"
+
     def apply(self, query: Query) -> Query:
-        current_time = datetime.now(self.departure_datetime.tzinfo)  # Ensure current_time has the same timezone
-        lower_bound = max(self.departure_datetime - timedelta(minutes=int(self.delta_hours*60)), current_time)
-        upper_bound = self.departure_datetime + timedelta(minutes=int(self.delta_hours*60))
+        lower_bound, upper_bound = self.bounds()
         return query.filter(
             Rides.departure_datetime.between(lower_bound, upper_bound)
         )
 
 
+class DepartureWindowsSpecification(Specification):
+    """
+    Departure inside any of several time windows, e.g. the windows of a batch of searches.
+    Overlapping windows are merged, so the rides between two distant windows are not loaded.
+    """
+    vectorized = True
+
+    def __init__(self, windows):
+        self.windows = []
+        for lower_bound, upper_bound in sorted(windows):
+            if self.windows and lower_bound <= self.windows[-1][1]:
+                self.windows[-1] = (self.windows[-1][0], max(self.windows[-1][1], upper_bound))
+            else:
+                self.windows.append((lower_bound, upper_bound))
+
+    def is_satisfied_by(self, item) -> bool:
+        return any(lower_bound <= item.departure_datetime <= upper_bound for lower_bound, upper_bound in self.windows)
+
+    def mask(self, items):
+        selected = np.zeros(len(items), dtype=bool)
+        for lower_bound, upper_bound in self.windows:
+            selected |= departure_mask(items, lower_bound, upper_bound)
+        return selected
+
+    def selectivity(self) -> float:
+        return min(sum(window_selectivity(*window) for window in self.windows), 1.0)
+
+    def describe(self) -> str:
+        return f"DepartureWindowsSpecification({len(self.windows)} windows)"
+
+    def apply(self, query: Query) -> Query:
+        return query.filter(or_(*[Rides.departure_datetime.between(lower_bound, upper_bound)
+                                  for lower_bound, upper_bound in self.windows]))
+
+
 class RideStatusSpecification(Specification):
+    vectorized = True
+
     def __init__(self, status: str = 'waiting'):
         self.status = status
 
@@ -135,8 +577,20 @@ class RideStatusSpecification(Specification):
     def apply(self, query: Query):
         return query.filter(Rides.status == self.status)
 
+    def mask(self, items):
+        return np.array([item.status for item in items], dtype=object) == self.status
+
+    def selectivity(self) -> float:
+        # Rides leave the 'waiting' status when they start, so few of the other statuses are in range
+        return 0.8 if self.status == 'waiting' else 0.2
+
+    def describe(self) -> str:
+        return f"RideStatusSpecification({self.status!r})"
+
 
 class NotMyRideSpecification(Specification):
+    vectorized = True
+
     def __init__(self, user_id: int):
         self.user_id = user_id
 
@@ -145,3 +599,49 @@ class NotMyRideSpecification(Specification):
 
     def apply(self, query: Query):
         return query.filter(Rides.driver_id != self.user_id)
+
+    def mask(self, items):
+        return np.array([item.driver_id for item in items]) != self.user_id
+
+    def selectivity(self) -> float:
+        return 0.99
+
+
+class KeysetPageSpecification(Specification):
+    """
+    One page of rides ordered by (departure_datetime, id), starting after the cursor position.
+    It adds ORDER BY and LIMIT, so it must be the last specification applied to a query.
+    One extra row is fetched to tell whether there is a next page.
+    """
+    terminal = True
+    vectorized = True
+
+    def __init__(self, limit: int, after=None):
+        self.limit = limit
+        self.after = after
+
+    def is_satisfied_by(self, item) -> bool:
+        return self.after is None or (item.departure_datetime, item.id) > self.after
+
+    def mask(self, items):
+        if self.after is None:
+            return np.ones(len(items), dtype=bool)
+        after_datetime, after_id = self.after
+        if after_datetime.tzinfo is not None:
+            return super().mask(items)
+        departures = np.array([item.departure_datetime for item in items], dtype='datetime64[us]')
+        ids = np.array([item.id for item in items], dtype=np.int64)
+        after_datetime = np.datetime64(after_datetime, 'us')
+        return (departures > after_datetime) | ((departures == after_datetime) & (ids > after_id))
+
+    def selectivity(self) -> float:
+        return 1.0
+
+    def apply(self, query: Query) -> Query:
+        if self.after is not None:
+            after_datetime, after_id = self.after
+            query = query.filter(or_(
+                Rides.departure_datetime > after_datetime,
+                and_(Rides.departure_datetime == after_datetime, Rides.id > after_id)
+            ))
+        return query.order_by(Rides.departure_datetime, Rides.id).limit(self.limit + 1)
@@ -323,3 +323,45 @@ def test_update_user_details_unauthorized(client):
     response_data = json.loads(response.data)
     assert response_data['msg'] == UNAUTHORIZED_ERROR
 
+
+def test_GivenCachedToken_thenLogoutAndUpdate_cacheIsInvalidated(client):
+    from utils.token_cache import token_cache
+
+    token, user_id = register_and_login(client)
+    headers = {"Authorization": f"{token}"}
+    hits = token_cache.stats()["hits"]
+    for _ in range(3):
+        response = client.get("/api/auth/home", headers=headers)
+        assert response.status_code == 200
+        assert json.loads(response.data)["user"] == {"_id": user_id, "email": VALID_EMAIL}
+    assert token_cache.stats()["hits"] >= hits + 2
+
+    update_user_details(client, token, first_name="Updated")
+    response = client.get("/api/auth/userDetails", headers=headers)
+    assert json.loads(response.data)["first_name"] == "Updated"
+
+    logout_user(client, token)
+    response = client.get("/api/auth/home", headers=headers)
+    assert response.status_code == BAD_REQUEST_CODE
+    assert json.loads(response.data)["msg"] == "Token revoked."
+
+
+def test_set_jwt_auth_active_invalidates_cached_tokens_on_commit(client):
+    from models import Users
+    from utils.token_cache import token_cache
+
+    token, user_id = register_and_login(client)
+    assert client.get("/api/auth/home", headers={"Authorization": f"{token}"}).status_code == 200
+
+    with app.app_context():
+        user = Users.query.get(user_id)
+        user.set_jwt_auth_active(False)
+        db.session.rollback()
+        db.session.commit()
+        assert token_cache.get(token) is not None
+
+        user = Users.query.get(user_id)
+        user.set_jwt_auth_active(False)
+        assert token_cache.get(token) is not None
+        db.session.commit()
+        assert token_cache.get(token) is None
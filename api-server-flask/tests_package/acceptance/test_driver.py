@@ -2,8 +2,12 @@ from datetime import timedelta, datetime
 
 import pytest
 import json
+from sqlalchemy import event, text
+
 from api import app
-from models import db
+from models import db, JoinRideRequests, RideOffers, Rides, SavedSearches, SavedSearchHits
+from services.auth_service import AuthService
+from services.ride_routes import backfill_routes
 from .constants import *
 from .test_authentication import register_user, login_user, register_and_login
 from .test_passenger import passanger_join_ride_request
@@ -596,3 +600,125 @@ def test_unauthorized_user_tries_to_join_ride(client):
     assert join_response.status_code == BAD_REQUEST_CODE  # Unauthorized
 
 
+
+
+def make_ride_offer(client, token, departure_location, pickup_radius, destination, drop_radius, departure_datetime):
+    return client.post(
+        "/api/passengers/make-ride-offer",
+        data=json.dumps({"departure_location": departure_location, "pickup_radius": pickup_radius,
+                         "destination": destination, "drop_radius": drop_radius,
+                         "departure_datetime": departure_datetime}),
+        headers={'Content-Type': 'application/json', 'accept': 'application/json', "Authorization": f"{token}"}
+    )
+
+
+def test_make_ride_offer_accepts_iso_8601_departure_times(client):
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+    departure = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+
+    for departure_datetime in (departure.isoformat() + 'Z', departure.isoformat() + '.000Z',
+                               departure.isoformat() + '+02:00'):
+        response = make_ride_offer(client, passenger_token, "31.2622,34.8013", 5, "32.0853,34.7818", 5,
+                                   departure_datetime)
+        assert response.status_code == SUCCESS_CODE
+    with app.app_context():
+        assert [offer.departure_datetime for offer in RideOffers.query.all()] == [departure] * 3
+
+    response = make_ride_offer(client, passenger_token, "31.2622,34.8013", 5, "32.0853,34.7818", 5, "tomorrow")
+    assert response.status_code == BAD_REQUEST_CODE
+    assert "Invalid departure_datetime" in response.get_json()["msg"]
+
+
+def test_post_future_ride_matches_open_ride_offers(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    departure = datetime.now() + timedelta(days=1)
+    near = make_ride_offer(client, passenger_token, "31.2700,34.8013", 5, "32.0853,34.7818", 5,
+                           (departure + timedelta(hours=1)).isoformat() + 'Z')
+    wrong_destination = make_ride_offer(client, passenger_token, "31.2622,34.8013", 5, "32.7940,34.9896", 5,
+                                        departure.isoformat() + 'Z')
+    too_late = make_ride_offer(client, passenger_token, "31.2622,34.8013", 5, "32.0853,34.7818", 5,
+                               (departure + timedelta(days=2)).isoformat() + 'Z')
+    assert near.status_code == wrong_destination.status_code == too_late.status_code == SUCCESS_CODE
+
+    post_response = driver_post_future_rides(client, driver_token, "31.2622,34.8013", 2, "32.0853,34.7818", 2,
+                                             departure.isoformat() + 'Z', 3, "No notes")
+    assert post_response.status_code == SUCCESS_CODE
+    ride_id = post_response.get_json()["ride_id"]
+
+    response = client.get(f"/api/drivers/{driver_id}/rides/{ride_id}/matches",
+                          headers={'accept': 'application/json', "Authorization": f"{driver_token}"})
+    assert response.status_code == SUCCESS_CODE
+    matches = response.get_json()["matches"]
+    assert len(matches) == 1
+    assert matches[0]["passenger_id"] == passenger_id
+    assert matches[0]["offer"]["_departure_location"] == "31.2700,34.8013"
+
+    other_user = client.get(f"/api/drivers/{passenger_id}/rides/{ride_id}/matches",
+                            headers={'accept': 'application/json', "Authorization": f"{passenger_token}"})
+    assert other_user.status_code == 400
+
+
+def test_clean_database_deletes_departed_rides_with_foreign_keys_enforced(client, monkeypatch):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+    ride_id = driver_post_future_rides(client, driver_token).get_json()["ride_id"]
+    assert passanger_join_ride_request(client, passenger_token, ride_id).status_code == SUCCESS_CODE
+
+    with app.app_context():
+        db.session.execute(text("UPDATE rides SET departure_datetime = :departed WHERE id = :ride_id"),
+                           {"departed": datetime.now() - timedelta(hours=1), "ride_id": ride_id})
+        saved_search = SavedSearches(user_id=passenger_id, departure_datetime=datetime.now() + timedelta(days=1))
+        saved_search.save()
+        db.session.add(SavedSearchHits(saved_search_id=saved_search.id, user_id=passenger_id, ride_id=ride_id))
+        db.session.commit()
+
+    def enforce_foreign_keys(connection, _):
+        connection.execute("PRAGMA foreign_keys=ON")
+
+    monkeypatch.setenv('MAGIC', 'magic')
+    with app.app_context():
+        event.listen(db.engine, "connect", enforce_foreign_keys)
+        try:
+            assert AuthService.cleanDatabase('magic') is None
+        finally:
+            event.remove(db.engine, "connect", enforce_foreign_keys)
+        assert Rides.query.get(ride_id) is None
+        assert JoinRideRequests.query.filter_by(ride_id=ride_id).count() == 0
+        assert SavedSearchHits.query.filter_by(ride_id=ride_id).count() == 0
+
+
+def test_post_future_ride_sees_a_conflicting_ride_missing_from_the_departure_index(client):
+    token, driver_id = register_and_login(client)
+    driver_post_future_rides(client, token, departure_datetime="2030-06-14T15:00:00.000Z")
+    departure_datetime = datetime(2030, 6, 15, 15)
+
+    # A ride written by another process, which the in-process departure index never saw
+    with app.app_context():
+        Rides(driver_id=driver_id, departure_location=DEFAULT_DEPARTURE_LOCATION, pickup_radius=DEFAULT_PICKUP_RADIUS,
+              destination=DEFAULT_DESTINATION, drop_radius=DEFAULT_DROP_RADIUS,
+              departure_datetime=departure_datetime - timedelta(hours=2),
+              available_seats=DEFAULT_AVAILABLE_SEATS).save()
+
+    response = driver_post_future_rides(client, token, departure_datetime=DEFAULT_DEPARTURE_DATETIME)
+    assert response.status_code != SUCCESS_CODE
+    assert "within the next 5 hours" in response.get_json()["msg"]
+
+
+def test_backfill_routes_stores_one_batch_soonest_departure_first(client):
+    token, _ = register_and_login(client)
+    late_id = driver_post_future_rides(client, token, departure_location="31.2622,34.8013",
+                                       destination="32.0853,34.7818").get_json()["ride_id"]
+    soon_id = driver_post_future_rides(client, token, departure_location="31.2622,34.8013",
+                                       destination="32.0853,34.7818",
+                                       departure_datetime="2030-06-14T15:00:00.000Z").get_json()["ride_id"]
+
+    with app.app_context():
+        db.session.execute(text("UPDATE rides SET route_polyline = NULL"))
+        db.session.commit()
+        assert [ride.id for ride in backfill_routes(batch_size=1)] == [soon_id]
+        assert Rides.query.get(soon_id).route_polyline
+        assert Rides.query.get(late_id).route_polyline is None
+        assert [ride.id for ride in backfill_routes(batch_size=1)] == [late_id]
+        assert backfill_routes(batch_size=1) == []
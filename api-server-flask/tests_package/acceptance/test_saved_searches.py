@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+import json
+from api import app
+from models import db
+from tests_package.acceptance.constants import *
+from tests_package.acceptance.test_authentication import register_and_login
+from tests_package.acceptance.test_driver import driver_post_future_rides
+
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def clean_up_database():
+    yield
+    with app.app_context():
+        db.session.remove()
+        meta = db.metadata
+        for table in reversed(meta.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+def create_saved_search(client, token, **search):
+    return client.post(
+        "/api/passengers/saved-searches",
+        data=json.dumps(search),
+        headers={'Content-Type': 'application/json', 'accept': 'application/json', "Authorization": f"{token}"}
+    )
+
+
+def get_hits(client, token, after=None):
+    url = "/api/passengers/saved-searches/hits" + (f"?after={after}" if after is not None else "")
+    return client.get(url, headers={'accept': 'application/json', "Authorization": f"{token}"})
+
+# -----------------------------------------------------------
+#               Passenger - saved searches
+# -----------------------------------------------------------
+
+def test_saved_search_records_hits_for_new_rides(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    departure = datetime.now() + timedelta(days=1)
+    response = create_saved_search(client, passenger_token, departure_location="31.2622,34.8013", pickup_radius=5,
+                                   destination="32.0853,34.7818", drop_radius=5,
+                                   departure_datetime=departure.isoformat() + 'Z', delta_hours=2)
+    assert response.status_code == SUCCESS_CODE
+    saved_search_id = response.get_json()["saved_search"]["id"]
+    assert get_hits(client, passenger_token).get_json()["hits"] == []
+
+    matching = driver_post_future_rides(client, driver_token, "31.2650,34.8013", DEFAULT_RADIUS,
+                                        "32.0853,34.7818", DEFAULT_RADIUS, departure.isoformat() + 'Z',
+                                        DEFAULT_AVAILABLE_SEATS, "No notes")
+    other_destination = driver_post_future_rides(client, driver_token, "31.2622,34.8013", DEFAULT_RADIUS,
+                                                 "32.7940,34.9896", DEFAULT_RADIUS,
+                                                 (departure + timedelta(hours=6)).isoformat() + 'Z',
+                                                 DEFAULT_AVAILABLE_SEATS, "No notes")
+    assert matching.status_code == other_destination.status_code == SUCCESS_CODE
+
+    inbox = get_hits(client, passenger_token).get_json()
+    assert [hit["ride_id"] for hit in inbox["hits"]] == [matching.get_json()["ride_id"]]
+    assert inbox["hits"][0]["saved_search_id"] == saved_search_id
+    assert get_hits(client, passenger_token, inbox["last_hit_id"]).get_json()["hits"] == []
+
+    # The driver has no saved searches, so nothing is in their inbox
+    assert get_hits(client, driver_token).get_json()["hits"] == []
+
+
+def test_saved_search_list_and_delete(client):
+    passenger_token, passenger_id = register_and_login(client)
+    other_token, other_id = register_and_login(client, email="p" + VALID_EMAIL)
+    departure = datetime.now() + timedelta(days=1)
+    saved_search_id = create_saved_search(client, passenger_token, departure_location="31.2622,34.8013",
+                                          pickup_radius=5, departure_datetime=departure.isoformat() + 'Z') \
+        .get_json()["saved_search"]["id"]
+
+    listed = client.get("/api/passengers/saved-searches",
+                        headers={'accept': 'application/json', "Authorization": f"{passenger_token}"})
+    assert [search["id"] for search in listed.get_json()["saved_searches"]] == [saved_search_id]
+
+    other_delete = client.delete(f"/api/passengers/saved-searches/{saved_search_id}",
+                                 headers={'accept': 'application/json', "Authorization": f"{other_token}"})
+    assert other_delete.status_code == 400
+    delete = client.delete(f"/api/passengers/saved-searches/{saved_search_id}",
+                           headers={'accept': 'application/json', "Authorization": f"{passenger_token}"})
+    assert delete.status_code == SUCCESS_CODE
+
+
+def test_saved_search_rejects_invalid_location(client):
+    passenger_token, passenger_id = register_and_login(client)
+    departure = datetime.now() + timedelta(days=1)
+    response = create_saved_search(client, passenger_token, departure_location="Main Street", pickup_radius=5,
+                                   departure_datetime=departure.isoformat() + 'Z')
+    assert response.status_code == 400
+
+
+def test_saved_search_rejects_an_unbounded_window(client):
+    passenger_token, passenger_id = register_and_login(client)
+    departure = datetime.now() + timedelta(days=1)
+    response = create_saved_search(client, passenger_token, departure_datetime=departure.isoformat() + 'Z',
+                                   delta_hours=10 ** 6)
+    assert response.status_code == 400
+    assert "delta_hours" in response.get_json()["msg"]
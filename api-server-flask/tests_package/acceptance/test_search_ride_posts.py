@@ -3,7 +3,11 @@ from datetime import datetime, timedelta
 import pytest
 import json
 from api import app
-from models import db
+from models import db, Rides
+from services import passenger_service, ride_index, search_cache
+from services.passenger_service import PassengerService
+from services.specifications import DestinationLocationSpecification
+from utils.pagination import encode_cursor
 from tests_package.acceptance.constants import *
 from tests_package.acceptance.test_authentication import register_and_login
 from tests_package.acceptance.test_driver import driver_post_future_rides
@@ -25,7 +29,7 @@ def clean_up_database():
         db.session.commit()
 
 
-def search_rides(client, token, departure_location=None, pickup_radius=None, destination=None, drop_radius=None, departure_datetime=None, available_seats=None, delta_hours=5):
+def search_rides(client, token, departure_location=None, pickup_radius=None, destination=None, drop_radius=None, departure_datetime=None, available_seats=None, delta_hours=5, limit=None, cursor=None, ranked=None, corridor=None):
     data = {
         "departure_location": departure_location,
         "pickup_radius": pickup_radius,
@@ -33,7 +37,11 @@ def search_rides(client, token, departure_location=None, pickup_radius=None, des
         "drop_radius": drop_radius,
         "departure_datetime": departure_datetime,
         "available_seats": available_seats,
-        "delta_hours": delta_hours
+        "delta_hours": delta_hours,
+        "limit": limit,
+        "cursor": cursor,
+        "ranked": ranked,
+        "corridor": corridor
     }
 
     # Remove None values from data
@@ -352,3 +360,332 @@ def test_search_rides_multiple_filters(client):
         assert ride["_destination"] == "36.169941,-115.139832"
         assert ride["_available_seats"] >= 3
         assert datetime.fromisoformat(ride["_departure_datetime"].replace('Z', '+00:00')) >= datetime.now()
+
+def test_destination_specification_after_destination_update(client):
+    driver_token, driver_id = register_and_login(client)
+
+    departure_datetime = (datetime.now() + timedelta(days=1)).isoformat() + 'Z'
+    post_response = driver_post_future_rides(
+        client, driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, "36.169941,-115.139832", DEFAULT_RADIUS,
+        departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+    )
+    assert post_response.status_code == SUCCESS_CODE
+    ride_id = post_response.get_json()["ride_id"]
+
+    with app.app_context():
+        # Move the destination to New York
+        assert Rides.get_by_id(ride_id).update_details({"destination": "40.712776,-74.005974"})
+
+        old_destination = DestinationLocationSpecification("36.169941,-115.139832", DEFAULT_RADIUS)
+        new_destination = DestinationLocationSpecification("40.712776,-74.005974", DEFAULT_RADIUS)
+        assert old_destination.apply(Rides.query).all() == []
+        assert [ride.id for ride in new_destination.apply(Rides.query).all()] == [ride_id]
+
+
+def test_search_rides_keyset_pagination(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    # Post three rides a day apart
+    posted_ids = []
+    for days in range(1, 4):
+        departure_datetime = (datetime.now() + timedelta(days=days)).isoformat() + 'Z'
+        post_response = driver_post_future_rides(
+            client, driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, "36.169941,-115.139832", DEFAULT_RADIUS,
+            departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+        )
+        assert post_response.status_code == SUCCESS_CODE
+        posted_ids.append(post_response.get_json()["ride_id"])
+
+    search_datetime = (datetime.now() + timedelta(days=2)).isoformat() + 'Z'
+    first_page = search_rides(
+        client, passenger_token, departure_location="34.052235,-118.243683", pickup_radius=DEFAULT_RADIUS,
+        departure_datetime=search_datetime, delta_hours=72, limit=2
+    ).get_json()
+    assert [ride["ride_id"] for ride in first_page["ride_posts"]] == posted_ids[:2]
+    assert first_page["next_cursor"]
+
+    second_page = search_rides(
+        client, passenger_token, departure_location="34.052235,-118.243683", pickup_radius=DEFAULT_RADIUS,
+        departure_datetime=search_datetime, delta_hours=72, limit=2, cursor=first_page["next_cursor"]
+    ).get_json()
+    assert [ride["ride_id"] for ride in second_page["ride_posts"]] == posted_ids[2:]
+    assert second_page["next_cursor"] is None
+
+
+def test_search_rides_pages_are_full_after_the_exact_radius_check(client, monkeypatch):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    # The first two rides leave from the corner of the pickup bounding box, outside the radius
+    posted_ids = []
+    for days, departure_location in enumerate(["31.3422,34.8913", "31.3422,34.8913", "31.2622,34.8013",
+                                               "31.2622,34.8013", "31.2622,34.8013"], start=1):
+        departure_datetime = (datetime.now() + timedelta(days=days)).isoformat() + 'Z'
+        post_response = driver_post_future_rides(
+            client, driver_token, departure_location, DEFAULT_RADIUS, "32.0853,34.7818", DEFAULT_RADIUS,
+            departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+        )
+        assert post_response.status_code == SUCCESS_CODE
+        posted_ids.append(post_response.get_json()["ride_id"])
+
+    # Page straight from SQL, with the exact radius check after the bounding-box prefilter
+    monkeypatch.setattr(search_cache, 'max_entries', 0)
+    monkeypatch.setattr(ride_index, 'is_warm', False)
+    search = dict(departure_location="31.2622,34.8013", pickup_radius=DEFAULT_RADIUS,
+                  departure_datetime=(datetime.now() + timedelta(days=3)).isoformat() + 'Z', delta_hours=72, limit=2)
+    first_page = search_rides(client, passenger_token, **search).get_json()
+    assert [ride["ride_id"] for ride in first_page["ride_posts"]] == posted_ids[2:4]
+    assert first_page["next_cursor"]
+
+    second_page = search_rides(client, passenger_token, cursor=first_page["next_cursor"], **search).get_json()
+    assert [ride["ride_id"] for ride in second_page["ride_posts"]] == posted_ids[4:]
+    assert second_page["next_cursor"] is None
+
+
+def test_search_rides_invalid_cursor(client):
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    search_response = search_rides(client, passenger_token, limit=2, cursor="not-a-cursor")
+    assert search_response.status_code == BAD_REQUEST_CODE
+    assert "Invalid cursor" in search_response.get_json()["msg"]
+
+
+def test_search_rides_ranked_returns_top_k(client):
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+    departure_datetime = (datetime.now() + timedelta(days=1)).isoformat() + 'Z'
+
+    # One ride straight to the passenger's destination, one ride that ends 8 km further away
+    driver_token, driver_id = register_and_login(client)
+    assert driver_post_future_rides(
+        client, driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, "36.169941,-115.139832", DEFAULT_RADIUS,
+        departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+    ).status_code == SUCCESS_CODE
+    other_driver_token, other_driver_id = register_and_login(client, email="d" + VALID_EMAIL)
+    assert driver_post_future_rides(
+        client, other_driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, "36.169941,-115.050000", DEFAULT_RADIUS,
+        departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+    ).status_code == SUCCESS_CODE
+
+    search_response = search_rides(
+        client, passenger_token, departure_location="34.052235,-118.243683", pickup_radius=DEFAULT_RADIUS,
+        destination="36.169941,-115.139832", drop_radius=DEFAULT_RADIUS, departure_datetime=departure_datetime,
+        limit=1, ranked=True
+    )
+    assert search_response.status_code == SUCCESS_CODE
+    ride_posts = search_response.get_json()["ride_posts"]
+    assert len(ride_posts) == 1
+    assert ride_posts[0]["_destination"] == "36.169941,-115.139832"
+    assert ride_posts[0]["_detour_km"] < 1
+
+
+def test_search_rides_ranked_rejects_a_cursor(client):
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+    cursor = encode_cursor(datetime.now() + timedelta(days=1), 1)
+
+    search_response = search_rides(client, passenger_token, limit=1, cursor=cursor, ranked=True)
+    assert search_response.status_code == BAD_REQUEST_CODE
+    assert "not paginated" in search_response.get_json()["msg"]
+
+
+def test_search_rides_cache_is_shared_and_invalidated(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    departure_datetime = (datetime.now() + timedelta(days=1)).isoformat() + 'Z'
+    post_response = driver_post_future_rides(
+        client, driver_token, "31.2622,34.8013", DEFAULT_RADIUS, "32.0853,34.7818", DEFAULT_RADIUS,
+        departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+    )
+    assert post_response.status_code == SUCCESS_CODE
+    ride_id = post_response.get_json()["ride_id"]
+
+    search = dict(departure_location="31.2622,34.8013", pickup_radius=DEFAULT_RADIUS,
+                  destination="32.0853,34.7818", drop_radius=DEFAULT_RADIUS,
+                  departure_datetime=departure_datetime, delta_hours=2)
+    assert len(search_rides(client, passenger_token, **search).get_json()["ride_posts"]) == 1
+
+    # Same cached entry, but the driver's own ride is filtered out per user
+    assert search_rides(client, driver_token, **search).get_json()["ride_posts"] == []
+
+    delete_response = client.post(
+        f"/api/drivers/{driver_id}/rides/{ride_id}/delete",
+        headers={'Content-Type': 'application/json', 'accept': 'application/json', "Authorization": f"{driver_token}"}
+    )
+    assert delete_response.status_code == SUCCESS_CODE
+    assert search_rides(client, passenger_token, **search).get_json()["ride_posts"] == []
+
+
+def test_search_rides_pages_past_the_cached_candidates(client, monkeypatch):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    posted_ids = []
+    for days in range(1, 6):
+        departure_datetime = (datetime.now() + timedelta(days=days)).isoformat() + 'Z'
+        post_response = driver_post_future_rides(
+            client, driver_token, "31.2622,34.8013", DEFAULT_RADIUS, "32.0853,34.7818", DEFAULT_RADIUS,
+            departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+        )
+        assert post_response.status_code == SUCCESS_CODE
+        posted_ids.append(post_response.get_json()["ride_id"])
+
+    # A miss caches the first two candidates only, the rest of the rides are read from SQL
+    monkeypatch.setattr(search_cache, 'max_candidates', 2)
+    search_cache.clear()
+    search = dict(departure_location="31.2622,34.8013", pickup_radius=DEFAULT_RADIUS,
+                  departure_datetime=(datetime.now() + timedelta(days=3)).isoformat() + 'Z', delta_hours=72, limit=3)
+    first_page = search_rides(client, passenger_token, **search).get_json()
+    assert [ride["ride_id"] for ride in first_page["ride_posts"]] == posted_ids[:3]
+    assert all(len(search_cache.get(key).candidates) <= 2 for key in list(search_cache._entries))
+
+    second_page = search_rides(client, passenger_token, cursor=first_page["next_cursor"], **search).get_json()
+    assert [ride["ride_id"] for ride in second_page["ride_posts"]] == posted_ids[3:]
+    assert second_page["next_cursor"] is None
+
+
+def test_search_rides_along_the_route(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    departure_datetime = (datetime.now() + timedelta(days=1)).isoformat() + 'Z'
+    post_response = driver_post_future_rides(
+        client, driver_token, "31.2622,34.8013", DEFAULT_RADIUS, "32.7940,34.9896", DEFAULT_RADIUS,
+        departure_datetime, DEFAULT_AVAILABLE_SEATS, "No notes"
+    )
+    assert post_response.status_code == SUCCESS_CODE
+    ride_id = post_response.get_json()["ride_id"]
+
+    # Picked up halfway, dropped at the ride's destination
+    search = dict(departure_location="32.03,34.89", pickup_radius=3, destination="32.7940,34.9896", drop_radius=3,
+                  departure_datetime=departure_datetime, delta_hours=2)
+    assert search_rides(client, passenger_token, **search).get_json()["ride_posts"] == []
+    ride_posts = search_rides(client, passenger_token, corridor=True, **search).get_json()["ride_posts"]
+    assert [ride["ride_id"] for ride in ride_posts] == [ride_id]
+
+    # Against the direction of the ride
+    search.update(departure_location="32.7940,34.9896", destination="32.03,34.89")
+    assert search_rides(client, passenger_token, corridor=True, **search).get_json()["ride_posts"] == []
+
+
+def test_search_rides_ndjson_stream(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    departure = datetime.now() + timedelta(days=1)
+    departure_datetime = departure.isoformat() + 'Z'
+    for hours in (-6, 0, 6):
+        post_response = driver_post_future_rides(
+            client, driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, "36.169941,-115.139832", DEFAULT_RADIUS,
+            (departure + timedelta(hours=hours)).isoformat() + 'Z', DEFAULT_AVAILABLE_SEATS, "No notes"
+        )
+        assert post_response.status_code == SUCCESS_CODE
+
+    response = client.post(
+        "/api/passengers/search-rides",
+        data=json.dumps({"departure_location": "34.052235,-118.243683", "pickup_radius": DEFAULT_RADIUS,
+                         "departure_datetime": departure_datetime, "delta_hours": 7, "limit": 2}),
+        headers={'Content-Type': 'application/json', 'accept': 'application/x-ndjson',
+                 "Authorization": f"{passenger_token}"}
+    )
+    assert response.status_code == SUCCESS_CODE
+    assert response.mimetype == "application/x-ndjson"
+    rides = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rides) == 2
+    assert all(ride["_driver_id"] == driver_id for ride in rides)
+    assert response.headers.get("X-Next-Cursor")
+
+    posts_response = client.get(
+        f"/api/drivers/{driver_id}/rides",
+        headers={'accept': 'application/x-ndjson', "Authorization": f"{driver_token}"}
+    )
+    assert posts_response.mimetype == "application/x-ndjson"
+    assert len(posts_response.get_data(as_text=True).splitlines()) == 3
+
+
+def test_search_rides_unbounded_ndjson_stream_reads_the_rides_while_sending(client, monkeypatch):
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+    departure = datetime.now() + timedelta(days=1)
+    # One driver per ride, since a driver cannot post rides five hours apart or less
+    driver_ids = []
+    for minutes in range(5):
+        driver_token, driver_id = register_and_login(client, email=f"d{minutes}" + VALID_EMAIL)
+        driver_ids.append(driver_id)
+        assert driver_post_future_rides(
+            client, driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, "36.169941,-115.139832", DEFAULT_RADIUS,
+            (departure + timedelta(minutes=minutes)).isoformat() + 'Z', DEFAULT_AVAILABLE_SEATS, "No notes"
+        ).status_code == SUCCESS_CODE
+
+    monkeypatch.setattr(search_cache, "max_entries", 0)
+    monkeypatch.setattr(passenger_service, "MAX_FETCH_BATCH_ROWS", 2)
+    monkeypatch.setattr(passenger_service, "STREAM_BATCH_SIZE", 1)
+    batches = []
+    iter_candidate_batches = PassengerService._iter_candidate_batches
+
+    def counting_batches(*args, **kwargs):
+        for batch in iter_candidate_batches(*args, **kwargs):
+            batches.append(batch)
+            yield batch
+
+    monkeypatch.setattr(PassengerService, "_iter_candidate_batches", staticmethod(counting_batches))
+    response = client.post(
+        "/api/passengers/search-rides",
+        data=json.dumps({"departure_location": "34.052235,-118.243683", "pickup_radius": DEFAULT_RADIUS,
+                         "departure_datetime": departure.isoformat() + 'Z', "delta_hours": 2}),
+        headers={'Content-Type': 'application/json', 'accept': 'application/x-ndjson',
+                 "Authorization": f"{passenger_token}"},
+        buffered=False
+    )
+    lines = response.iter_encoded()
+    first = json.loads(next(lines))
+    assert len(batches) == 1
+    assert [ride["_driver_id"] for ride in [first] + [json.loads(line) for line in lines]] == driver_ids
+    assert len(batches) == 3
+    assert response.headers.get("X-Next-Cursor") is None
+
+
+def search_rides_batch(client, token, queries):
+    return client.post(
+        "/api/passengers/search-rides/batch",
+        data=json.dumps({"queries": queries}),
+        headers={'Content-Type': 'application/json', 'accept': 'application/json', "Authorization": f"{token}"}
+    )
+
+
+def test_search_rides_batch(client):
+    driver_token, driver_id = register_and_login(client)
+    passenger_token, passenger_id = register_and_login(client, email="p" + VALID_EMAIL)
+
+    departure = datetime.now() + timedelta(days=1)
+    for hours, destination in ((0, "36.169941,-115.139832"), (8, "32.715736,-117.161087")):
+        post_response = driver_post_future_rides(
+            client, driver_token, "34.052235,-118.243683", DEFAULT_RADIUS, destination, DEFAULT_RADIUS,
+            (departure + timedelta(hours=hours)).isoformat() + 'Z', DEFAULT_AVAILABLE_SEATS, "No notes"
+        )
+        assert post_response.status_code == SUCCESS_CODE
+
+    departure_datetime = departure.isoformat() + 'Z'
+    later_datetime = (departure + timedelta(hours=8)).isoformat() + 'Z'
+    response = search_rides_batch(client, passenger_token, [
+        {"id": "vegas", "departure_location": "34.052235,-118.243683", "destination": "36.169941,-115.139832",
+         "departure_datetime": departure_datetime, "delta_hours": 12},
+        {"id": "later", "departure_location": "34.052235,-118.243683",
+         "departure_datetime": later_datetime, "delta_hours": 1},
+        {"id": "too_many_seats", "departure_datetime": departure_datetime, "available_seats": 100},
+    ])
+    assert response.status_code == SUCCESS_CODE
+    results = response.get_json()["results"]
+    assert [ride["_destination"] for ride in results["vegas"]] == ["36.169941,-115.139832"]
+    assert [ride["_destination"] for ride in results["later"]] == ["32.715736,-117.161087"]
+    assert results["too_many_seats"] == []
+
+    # The driver's own rides are never returned
+    assert search_rides_batch(client, driver_token, [{"id": "own", "departure_datetime": departure_datetime,
+                                                    "delta_hours": 12}]) \
+        .get_json()["results"]["own"] == []
+
+
+def test_search_rides_batch_rejects_duplicate_ids(client):
+    passenger_token, passenger_id = register_and_login(client)
+    response = search_rides_batch(client, passenger_token, [{"id": "a"}, {"id": "a"}])
+    assert response.status_code == 400
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.departure_index import DepartureTimeIndex
+
+NOW = datetime.now()
+
+
+def make_ride(ride_id, hours_ahead, driver_id=1, status='waiting'):
+    return SimpleNamespace(id=ride_id, driver_id=driver_id, status=status,
+                           departure_datetime=NOW + timedelta(hours=hours_ahead))
+
+
+def test_window_returns_waiting_rides_in_departure_order():
+    index = DepartureTimeIndex()
+    index.load([make_ride(1, 3), make_ride(2, 1), make_ride(3, 2, status='InProgress'), make_ride(4, 10)])
+    index.add(make_ride(5, 1.5, driver_id=2))
+
+    assert index.waiting_between(NOW, NOW + timedelta(hours=3)) == [2, 5, 1]
+    assert index.waiting_between(NOW + timedelta(hours=4), NOW + timedelta(hours=5)) == []
+
+
+def test_updates_and_removals_keep_the_arrays_in_sync():
+    index = DepartureTimeIndex()
+    index.add(make_ride(1, 1))
+    index.add(make_ride(2, 1))
+    index.add(make_ride(1, 6))
+    assert index.waiting_between(NOW, NOW + timedelta(hours=2)) == [2]
+
+    index.remove(2)
+    assert index.waiting_between(NOW, NOW + timedelta(hours=8)) == [1]
+    index.add(make_ride(1, 6, status='Completed'))
+    assert 1 in index and len(index) == 1
+    assert index.waiting_between(NOW, NOW + timedelta(hours=8)) == []
+
+
+def test_prune_drops_expired_and_departed_waiting_rides():
+    index = DepartureTimeIndex(retention_hours=5)
+    index.load([make_ride(1, -1, status='InProgress'), make_ride(2, -1), make_ride(3, 1)])
+    index.add(make_ride(4, -4, status='Completed'))
+
+    assert index.prune(now=NOW + timedelta(hours=2)) == 3
+    assert 1 in index and len(index) == 1
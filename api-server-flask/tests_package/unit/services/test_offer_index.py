@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.offer_index import RideOfferIndex
+
+BEER_SHEVA = (31.2622, 34.8013)
+TEL_AVIV = (32.0853, 34.7818)
+HAIFA = (32.7940, 34.9896)
+
+DEPARTURE = datetime.now() + timedelta(days=1)
+
+
+def make_offer(offer_id, departure, destination, hours=0, passenger_id=10, radius=5):
+    return SimpleNamespace(id=offer_id, passenger_id=passenger_id,
+                           departure_lat=departure[0], departure_lng=departure[1],
+                           destination_lat=destination[0], destination_lng=destination[1],
+                           pickup_radius=radius, drop_radius=radius,
+                           departure_datetime=DEPARTURE + timedelta(hours=hours))
+
+
+def make_ride(departure=BEER_SHEVA, destination=TEL_AVIV, driver_id=1, radius=1):
+    return SimpleNamespace(id=1, driver_id=driver_id,
+                           departure_lat=departure[0], departure_lng=departure[1],
+                           destination_lat=destination[0], destination_lng=destination[1],
+                           pickup_radius=radius, drop_radius=radius, departure_datetime=DEPARTURE)
+
+
+def test_match_checks_both_ends_and_the_time_window():
+    index = RideOfferIndex(match_window_hours=2)
+    index.load([make_offer(1, BEER_SHEVA, TEL_AVIV, hours=1),
+                make_offer(2, BEER_SHEVA, HAIFA),
+                make_offer(3, BEER_SHEVA, TEL_AVIV, hours=3),
+                make_offer(4, BEER_SHEVA, TEL_AVIV, passenger_id=1)])
+
+    matches = index.match(make_ride())
+    assert [match[:2] for match in matches] == [(1, 10)]
+    assert matches[0][2] < 0.01
+
+
+def test_radii_of_ride_and_offer_add_up():
+    index = RideOfferIndex()
+    # About 9 km north of Beer Sheva
+    index.add(make_offer(1, (31.3432, 34.8013), TEL_AVIV, radius=5))
+    assert index.match(make_ride(radius=3)) == []
+    assert [match[0] for match in index.match(make_ride(radius=5))] == [1]
+
+
+def test_add_keeps_departure_order_and_remove_departed():
+    index = RideOfferIndex()
+    index.add(make_offer(1, BEER_SHEVA, TEL_AVIV, hours=2))
+    index.add(make_offer(2, BEER_SHEVA, TEL_AVIV, hours=-1))
+    index.add(make_offer(1, BEER_SHEVA, TEL_AVIV, hours=-2))
+    assert len(index) == 2
+    assert index.remove_departed(DEPARTURE - timedelta(hours=1, minutes=30)) == 1
+    assert 2 in index and 1 not in index
+
+
+def test_offers_without_coordinates_are_not_indexed():
+    index = RideOfferIndex()
+    offer = make_offer(1, BEER_SHEVA, TEL_AVIV)
+    offer.departure_lat = None
+    index.add(offer)
+    assert len(index) == 0
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.ride_index import RideGridIndex
+from utils.route_sampling import encode_route, great_circle_route
+
+BEER_SHEVA = (31.2622, 34.8013)
+TEL_AVIV = (32.0853, 34.7818)
+HAIFA = (32.7940, 34.9896)
+
+
+def make_ride(ride_id, departure, destination, status='waiting', hours_ahead=2):
+    return SimpleNamespace(id=ride_id, status=status,
+                           departure_lat=departure[0], departure_lng=departure[1],
+                           destination_lat=destination[0], destination_lng=destination[1],
+                           departure_datetime=datetime.now() + timedelta(hours=hours_ahead))
+
+
+def test_search_matches_both_ends():
+    index = RideGridIndex()
+    index.add(make_ride(1, BEER_SHEVA, TEL_AVIV))
+    index.add(make_ride(2, BEER_SHEVA, HAIFA))
+    index.add(make_ride(3, TEL_AVIV, HAIFA))
+
+    assert index.search(BEER_SHEVA, 5) == {1, 2}
+    assert index.search(BEER_SHEVA, 5, TEL_AVIV, 5) == {1}
+    assert index.search(destination=HAIFA, drop_radius=5) == {2, 3}
+    assert index.search() is None
+
+
+def test_update_and_remove_keep_cells_in_sync():
+    index = RideGridIndex()
+    ride = make_ride(1, BEER_SHEVA, TEL_AVIV)
+    index.add(ride)
+
+    ride.destination_lat, ride.destination_lng = HAIFA
+    index.add(ride)
+    assert index.search(destination=TEL_AVIV, drop_radius=5) == set()
+    assert index.search(destination=HAIFA, drop_radius=5) == {1}
+
+    index.remove(1)
+    assert len(index) == 0
+    assert index.search(BEER_SHEVA, 5) == set()
+
+
+def test_only_waiting_future_rides_are_indexed():
+    index = RideGridIndex()
+    index.add(make_ride(1, BEER_SHEVA, TEL_AVIV, status='InProgress'))
+    index.add(make_ride(2, BEER_SHEVA, TEL_AVIV, hours_ahead=-1))
+    assert len(index) == 0
+
+
+def test_remove_departed():
+    index = RideGridIndex()
+    index.add(make_ride(1, BEER_SHEVA, TEL_AVIV, hours_ahead=1))
+    index.add(make_ride(2, BEER_SHEVA, TEL_AVIV, hours_ahead=5))
+    assert index.remove_departed(datetime.now() + timedelta(hours=2)) == 1
+    assert 1 not in index and 2 in index
+
+
+def test_joint_search_after_bulk_load_and_updates():
+    index = RideGridIndex()
+    index.load([make_ride(1, BEER_SHEVA, TEL_AVIV), make_ride(2, TEL_AVIV, BEER_SHEVA)])
+    index.add(make_ride(3, BEER_SHEVA, TEL_AVIV))
+    index.remove(1)
+    assert index.search(BEER_SHEVA, 5, TEL_AVIV, 5) == {3}
+    assert index.search(TEL_AVIV, 5, BEER_SHEVA, 5) == {2}
+
+
+def test_corridor_search_follows_the_route():
+    index = RideGridIndex()
+    along = make_ride(1, BEER_SHEVA, HAIFA)
+    along.route_polyline = encode_route(*great_circle_route(*BEER_SHEVA, *HAIFA))
+    index.add(along)
+    index.add(make_ride(2, BEER_SHEVA, HAIFA))
+
+    midpoint = (32.03, 34.89)
+    assert index.search_corridor(midpoint, 3, HAIFA, 3) == {1}
+    assert index.search_corridor(HAIFA, 3, midpoint, 3) == set()
+    assert index.search_corridor() is None
+
+    index.remove(1)
+    assert index.search_corridor(midpoint, 3, HAIFA, 3) == set()
+
+
+def test_corridor_search_with_a_radius_smaller_than_the_sample_spacing():
+    index = RideGridIndex()
+    ride = make_ride(1, BEER_SHEVA, HAIFA)
+    lats, lngs = great_circle_route(*BEER_SHEVA, *HAIFA)
+    ride.route_polyline = encode_route(lats, lngs)
+    index.add(ride)
+
+    # 0.1 km off the route, halfway between two samples that are more than 0.2 km away
+    between = ((lats[10] + lats[11]) / 2, (lngs[10] + lngs[11]) / 2 + 0.001)
+    assert index.search_corridor(between, 0.2, HAIFA, 0.2) == {1}
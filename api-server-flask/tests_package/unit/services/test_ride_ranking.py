@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.ride_ranking import detour_km, top_k_rides
+
+BEER_SHEVA = (31.2622, 34.8013)
+KIRYAT_GAT = (31.6100, 34.7642)
+TEL_AVIV = (32.0853, 34.7818)
+JERUSALEM = (31.7683, 35.2137)
+
+
+def make_ride(ride_id, departure, destination, hours_ahead=2):
+    return SimpleNamespace(id=ride_id,
+                           departure_lat=departure[0], departure_lng=departure[1],
+                           destination_lat=destination[0], destination_lng=destination[1],
+                           departure_datetime=datetime(2030, 1, 1, 12) + timedelta(hours=hours_ahead))
+
+
+def test_detour_is_zero_for_stops_on_the_route():
+    rides = [make_ride(1, BEER_SHEVA, TEL_AVIV)]
+    assert abs(detour_km(rides, BEER_SHEVA, TEL_AVIV)[0]) < 1e-9
+
+
+def test_top_k_prefers_small_detour_and_close_departure():
+    rides = [
+        make_ride(1, BEER_SHEVA, JERUSALEM),
+        make_ride(2, BEER_SHEVA, TEL_AVIV, hours_ahead=4),
+        make_ride(3, BEER_SHEVA, TEL_AVIV),
+    ]
+    best = top_k_rides(rides, 2, KIRYAT_GAT, TEL_AVIV, datetime(2030, 1, 1, 14))
+    assert [ride.id for ride, score, detour in best] == [3, 2]
+    assert best[0][1] <= best[1][1]
+
+
+def test_rides_without_coordinates_rank_last():
+    rides = [make_ride(1, BEER_SHEVA, (None, None)), make_ride(2, BEER_SHEVA, TEL_AVIV)]
+    best = top_k_rides(rides, 2, BEER_SHEVA, TEL_AVIV)
+    assert [ride.id for ride, score, detour in best] == [2, 1]
+    assert best[1][1:] == (None, None)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.saved_search_index import SavedSearchIndex
+
+BEER_SHEVA = (31.2622, 34.8013)
+TEL_AVIV = (32.0853, 34.7818)
+HAIFA = (32.7940, 34.9896)
+
+DEPARTURE = datetime(2030, 1, 1, 8, 0)
+
+
+def make_search(search_id, departure=None, destination=None, user_id=10, seats=1, delta_hours=2):
+    return SimpleNamespace(id=search_id, user_id=user_id,
+                           departure_lat=departure[0] if departure else None,
+                           departure_lng=departure[1] if departure else None,
+                           pickup_radius=5 if departure else None,
+                           destination_lat=destination[0] if destination else None,
+                           destination_lng=destination[1] if destination else None,
+                           drop_radius=5 if destination else None,
+                           available_seats=seats,
+                           window_start=DEPARTURE - timedelta(hours=delta_hours),
+                           window_end=DEPARTURE + timedelta(hours=delta_hours))
+
+
+def make_ride(departure=BEER_SHEVA, destination=TEL_AVIV, hours=0, driver_id=1, seats=3):
+    return SimpleNamespace(id=1, driver_id=driver_id, available_seats=seats,
+                           departure_lat=departure[0], departure_lng=departure[1],
+                           destination_lat=destination[0], destination_lng=destination[1],
+                           departure_datetime=DEPARTURE + timedelta(hours=hours))
+
+
+def test_match_checks_cells_time_seats_and_owner():
+    index = SavedSearchIndex()
+    index.load([make_search(1, BEER_SHEVA, TEL_AVIV),
+                make_search(2, BEER_SHEVA, HAIFA),
+                make_search(3, destination=TEL_AVIV),
+                make_search(4, BEER_SHEVA, TEL_AVIV, seats=4),
+                make_search(5, BEER_SHEVA, TEL_AVIV, user_id=1)])
+
+    assert sorted(index.match(make_ride())) == [(1, 10), (3, 10)]
+    assert index.match(make_ride(hours=3)) == []
+
+
+def test_remove_and_expire():
+    index = SavedSearchIndex()
+    index.add(make_search(1, BEER_SHEVA, TEL_AVIV))
+    index.add(make_search(2, BEER_SHEVA, TEL_AVIV, delta_hours=10))
+    index.remove(1)
+    assert index.match(make_ride()) == [(2, 10)]
+
+    assert index.remove_expired(DEPARTURE + timedelta(hours=5)) == 0
+    assert index.remove_expired(DEPARTURE + timedelta(hours=11)) == 1
+    assert len(index) == 0
+
+
+def test_long_windows_are_not_split_into_buckets():
+    index = SavedSearchIndex()
+    index.add(make_search(1, BEER_SHEVA, TEL_AVIV, delta_hours=10 ** 5))
+    assert not index._time_buckets
+    assert index.match(make_ride(hours=500)) == [(1, 10)]
+    index.remove(1)
+    assert index.match(make_ride()) == []
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.search_cache import SearchResultCache
+from utils.batch_distance import haversine_km
+
+BEER_SHEVA = (31.2622, 34.8013)
+TEL_AVIV = (32.0853, 34.7818)
+HAIFA = (32.7940, 34.9896)
+
+DEPARTURE = datetime(2030, 1, 1, 8, 5)
+
+
+def make_ride(departure, destination, departure_datetime=DEPARTURE):
+    return SimpleNamespace(departure_lat=departure[0], departure_lng=departure[1],
+                           destination_lat=destination[0], destination_lng=destination[1],
+                           departure_datetime=departure_datetime)
+
+
+def cached_key(cache, departure=BEER_SHEVA, destination=TEL_AVIV, departure_date=DEPARTURE):
+    key = cache.key_for(departure, 5, destination, 5, departure_date, 2, None)
+    cache.put(key, ["ride"], cache.generation)
+    return key
+
+
+def test_nearby_searches_share_a_key():
+    cache = SearchResultCache()
+    key = cache.key_for(BEER_SHEVA, 5, TEL_AVIV, 5, DEPARTURE, 2, 1)
+    assert cache.key_for((31.2623, 34.8014), 5, TEL_AVIV, 5, DEPARTURE + timedelta(minutes=5), 2, 1) == key
+    assert cache.key_for(BEER_SHEVA, 10, TEL_AVIV, 5, DEPARTURE, 2, 1) != key
+    assert cache.key_for(BEER_SHEVA, 5, TEL_AVIV, 5, DEPARTURE + timedelta(hours=1), 2, 1) != key
+
+
+def test_key_area_and_window_cover_every_search_of_the_key():
+    cache = SearchResultCache()
+    point = (31.2699, 34.8099)
+    key = cache.key_for(point, 5, None, None, DEPARTURE, 2, None)
+
+    lat, lng, radius = cache.area(key.departure_cell, key.pickup_radius)
+    assert haversine_km(lat, lng, point[0], point[1]) + 5 <= radius
+
+    center, delta_hours = cache.window(key)
+    assert center - timedelta(hours=delta_hours) <= DEPARTURE - timedelta(hours=2)
+    assert center + timedelta(hours=delta_hours) >= DEPARTURE + timedelta(hours=2)
+
+
+def test_lru_and_ttl_eviction():
+    cache = SearchResultCache(max_entries=2)
+    first = cached_key(cache)
+    second = cached_key(cache, destination=HAIFA)
+    assert cache.get(first).candidates == ("ride",)
+    cached_key(cache, departure=TEL_AVIV)
+    assert cache.get(second) is None
+    assert cache.get(first).candidates == ("ride",)
+
+    expired = SearchResultCache(ttl_seconds=0)
+    assert expired.get(cached_key(expired)) is None
+
+
+def test_invalidation_only_drops_affected_entries():
+    cache = SearchResultCache()
+    corridor = cached_key(cache)
+    other_destination = cached_key(cache, destination=HAIFA)
+    other_day = cached_key(cache, departure_date=DEPARTURE + timedelta(days=1))
+    anywhere = cache.key_for(None, None, None, None, None, 5, None)
+    cache.put(anywhere, ["ride"], cache.generation)
+
+    assert cache.invalidate_ride(make_ride(BEER_SHEVA, TEL_AVIV)) == 2
+    assert cache.get(corridor) is None
+    assert cache.get(anywhere) is None
+    assert cache.get(other_destination).candidates == ("ride",)
+    assert cache.get(other_day).candidates == ("ride",)
+
+
+def test_put_is_skipped_after_a_concurrent_invalidation():
+    cache = SearchResultCache()
+    key = cache.key_for(BEER_SHEVA, 5, TEL_AVIV, 5, DEPARTURE, 2, None)
+    generation = cache.generation
+    cache.invalidate_ride(make_ride(HAIFA, HAIFA))
+    cache.put(key, ["stale"], generation)
+    assert cache.get(key) is None
+    assert cache.stats()["misses"] == 1
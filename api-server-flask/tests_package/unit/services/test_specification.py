@@ -1,3 +1,135 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from models import Rides
+from models import rides as rides_model
+from services.specifications import AndSpecification, AvailableSeatsSpecification, DepartureDateSpecification, \
+    DepartureLocationSpecification, DepartureWindowsSpecification, DestinationLocationSpecification, \
+    KeysetPageSpecification, NotMyRideSpecification, RideIdsSpecification, RideStatusSpecification, Specification
+
+DEPARTURE = datetime.now() + timedelta(days=1)
+
+
+def make_ride(ride_id, driver_id=1, departure=(31.2622, 34.8013), hours=0.0):
+    return SimpleNamespace(id=ride_id, driver_id=driver_id, departure_lat=departure[0], departure_lng=departure[1],
+                           departure_datetime=DEPARTURE + timedelta(hours=hours))
+
+
+def test_planner_pushes_sql_and_orders_by_selectivity():
+    location = DepartureLocationSpecification("31.2622,34.8013", 5)
+    page = KeysetPageSpecification(10)
+    composite = AndSpecification(page, RideStatusSpecification('waiting'), AvailableSeatsSpecification(1),
+                                 location, DepartureDateSpecification(DEPARTURE, 2), RideIdsSpecification([1, 2]))
+    plan = composite.plan()
+
+    assert plan.sql[0].__class__ is RideIdsSpecification
+    assert plan.sql[-1] is page
+    # Without PostGIS the location filter is only a bounding box in SQL and is re-checked in memory
+    assert location in plan.sql and plan.memory == [location]
+    assert "prefilter" in composite.explain()
+
+
+def test_postgis_location_filters_are_exact_st_dwithin_queries(monkeypatch):
+    monkeypatch.setitem(rides_model._spatial_index, "mode", rides_model.SPATIAL_MODE_POSTGIS)
+    departure = DepartureLocationSpecification("31.2622,34.8013", 5)
+    destination = DestinationLocationSpecification("32.0853,34.7818", 2.5)
+
+    def compiled(spec):
+        statement = spec.apply(Query(Rides.id)).statement
+        return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+    assert "WHERE ST_DWithin(rides.departure_geog, geography(ST_SetSRID(ST_MakePoint(34.8013, 31.2622), 4326)), " \
+           "5000)" in compiled(departure)
+    assert "WHERE ST_DWithin(rides.destination_geog, geography(ST_SetSRID(ST_MakePoint(34.7818, 32.0853), 4326)), " \
+           "2500.0)" in compiled(destination)
+    # Exact in SQL, so nothing is left to check in memory
+    assert AndSpecification(departure, destination, RideStatusSpecification('waiting')).plan().memory == []
+
+
+def test_memory_plan_runs_cheap_selective_checks_first():
+    location = DepartureLocationSpecification("31.2622,34.8013", 5)
+    not_mine = NotMyRideSpecification(1)
+    window = DepartureDateSpecification(DEPARTURE, 2)
+    plan = AndSpecification(not_mine, location, window).plan(sql=False)
+    assert plan.sql == [] and plan.memory == [location, window, not_mine]
+
+
+def test_filter_matches_is_satisfied_by():
+    rides = [make_ride(1), make_ride(2, driver_id=7), make_ride(3, hours=5), make_ride(4, departure=(32.0853, 34.7818))]
+    composite = AndSpecification(NotMyRideSpecification(7), DepartureDateSpecification(DEPARTURE, 2),
+                                 DepartureLocationSpecification("31.2622,34.8013", 5))
+    assert [ride.id for ride in composite.filter_many(rides)] == [1]
+    assert composite.mask(rides).tolist() == [True, False, False, False]
+
+
+def test_filter_many_matches_is_satisfied_by_for_every_specification():
+    rides = [SimpleNamespace(id=i, driver_id=i % 3, status='waiting' if i % 2 else 'started', available_seats=i % 4,
+                             departure_datetime=DEPARTURE + timedelta(minutes=30 * (i % 5)),
+                             destination_lat=32.0853 + 0.01 * i, destination_lng=34.7818, destination=None)
+             for i in range(20)]
+    specifications = [NotMyRideSpecification(1), RideStatusSpecification('waiting'), AvailableSeatsSpecification(2),
+                      RideIdsSpecification([1, 4, 5, 19]), DepartureDateSpecification(DEPARTURE, 1),
+                      DestinationLocationSpecification("32.0853,34.7818", 5),
+                      KeysetPageSpecification(5, (DEPARTURE + timedelta(minutes=30), 6)),
+                      DepartureWindowsSpecification([(DEPARTURE, DEPARTURE), (DEPARTURE + timedelta(minutes=90),
+                                                                             DEPARTURE + timedelta(hours=2))])]
+    for spec in specifications:
+        assert spec.filter_many(rides) == [ride for ride in rides if spec.is_satisfied_by(ride)]
+
+
+def test_departure_windows_are_merged_but_not_bridged():
+    day = timedelta(days=1)
+    spec = DepartureWindowsSpecification([(DEPARTURE + 3 * day, DEPARTURE + 3 * day + timedelta(hours=2)),
+                                          (DEPARTURE, DEPARTURE + timedelta(hours=2)),
+                                          (DEPARTURE + timedelta(hours=1), DEPARTURE + timedelta(hours=3))])
+    assert spec.windows == [(DEPARTURE, DEPARTURE + timedelta(hours=3)),
+                            (DEPARTURE + 3 * day, DEPARTURE + 3 * day + timedelta(hours=2))]
+    rides = [make_ride(1, hours=2.5), make_ride(2, hours=24), make_ride(3, hours=73)]
+    assert [ride.id for ride in spec.filter_many(rides)] == [1, 3]
+
+
+def test_location_filter_many_resolves_each_location_string_once():
+    spec = DepartureLocationSpecification("31.2622,34.8013", 5)
+    resolved = []
+    spec.geocode_location = lambda location: resolved.append(location) or [float(part) for part in location.split(',')]
+
+    near = SimpleNamespace(departure_location="31.27,34.80")
+    far = SimpleNamespace(departure_location="32.0853,34.7818")
+    assert spec.filter_many([near, far, near, far]) == [near, near]
+    assert sorted(resolved) == ["31.27,34.80", "32.0853,34.7818"]
+
+    destination = DestinationLocationSpecification("32.0853,34.7818", 5)
+    assert destination.filter_many([SimpleNamespace(destination="32.09,34.78"), SimpleNamespace(destination="Haifa")]) \
+        == [SimpleNamespace(destination="32.09,34.78")]
+
+
+class CountingSpecification(Specification):
+    def __init__(self, keep, selectivity):
+        self.keep = keep
+        self.estimate = selectivity
+        self.seen = 0
+
+    def is_satisfied_by(self, item) -> bool:
+        return item in self.keep
+
+    def filter_many(self, items):
+        self.seen += len(items)
+        return super().filter_many(items)
+
+    def selectivity(self) -> float:
+        return self.estimate
+
+
+def test_and_filter_many_shrinks_the_candidates():
+    broad = CountingSpecification(set(range(90)), 0.9)
+    narrow = CountingSpecification(set(range(10)), 0.1)
+    assert AndSpecification(broad, narrow).filter_many(range(100)) == list(range(10))
+    assert (narrow.seen, broad.seen) == (100, 10)
+
+
 # import pytest
 # from datetime import datetime, timedelta
 # from sqlalchemy import create_engine
@@ -82,4 +214,4 @@
 #
 #     assert len(rides) == 2
 #     assert rides[0].id == 2
-#     assert rides[1].id == 3
\ No newline at end of file
+#     assert rides[1].id == 3
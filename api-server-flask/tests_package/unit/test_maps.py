@@ -1,7 +1,9 @@
 import pytest
 
-from utils.location_utils import parse_location
-from utils.maps import calculate_distance
+from geopy.distance import geodesic
+
+from utils.location_utils import parse_location, try_parse_location, bounding_box
+from utils.maps import calculate_distance, calculate_distances
 
 
 def test_parse_location_valid():
@@ -23,6 +25,25 @@ def test_parse_location_invalid_values():
         parse_location(location)
 
 
+def test_try_parse_location_invalid_returns_none():
+    assert try_parse_location("Main Street") == (None, None)
+    assert try_parse_location(None) == (None, None)
+
+
+def test_bounding_box_contains_radius():
+    lat, lng = 31.2622, 34.8013  # Beer Sheva
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, 10)
+    assert geodesic((lat, lng), (min_lat, lng)).km >= 10
+    assert geodesic((lat, lng), (max_lat, lng)).km >= 10
+    assert geodesic((lat, lng), (lat, min_lng)).km >= 10
+    assert geodesic((lat, lng), (lat, max_lng)).km >= 10
+
+
+def test_bounding_box_near_antimeridian():
+    min_lat, max_lat, min_lng, max_lng = bounding_box(0.0, 179.99, 50)
+    assert (min_lng, max_lng) == (-180, 180)
+
+
 def test_calculate_distance_with_haversine(monkeypatch):
     class MockMapsService:
         def distance_matrix(self, origins, destinations, mode):
@@ -87,4 +108,13 @@ def test_calculate_distance_api_failure(monkeypatch):
     destination = (34.0522, -118.2437)
 
     with pytest.raises(ValueError, match="Invalid response from Google Maps API"):
-        calculate_distance(origin, destination)
\ No newline at end of file
+        calculate_distance(origin, destination)
+
+
+def test_calculate_distances_returns_the_full_matrix():
+    origins = [(37.7749, -122.4194), (34.0522, -118.2437)]
+    destinations = [(34.0522, -118.2437), (37.7749, -122.4194), (40.7128, -74.0060)]
+    distances = calculate_distances(origins, destinations)
+    assert distances.shape == (2, 3)
+    assert distances[0, 1] == 0 and distances[1, 0] == 0
+    assert abs(distances[0, 0] - distances[1, 1]) < 1e-9
@@ -0,0 +1,33 @@
+import numpy as np
+from geopy.distance import geodesic
+from math import isclose
+
+from utils.batch_distance import haversine_km, within_radius
+
+
+def test_haversine_km_matches_scalar_distance():
+    distances = haversine_km(37.7749, -122.4194, [34.0522, 37.7749], [-118.2437, -122.4194])
+    assert isclose(distances[0], 559, rel_tol=0.01)
+    assert distances[1] == 0
+
+
+def test_within_radius_matches_geodesic():
+    rng = np.random.default_rng(0)
+    lat, lng = 31.2622, 34.8013
+    lats = lat + rng.uniform(-0.2, 0.2, 2000)
+    lngs = lng + rng.uniform(-0.2, 0.2, 2000)
+    mask = within_radius(lat, lng, lats, lngs, 10)
+    expected = [geodesic((lat, lng), (a, b)).km <= 10 for a, b in zip(lats, lngs)]
+    assert mask.tolist() == expected
+
+
+def test_within_radius_excludes_unknown_locations():
+    mask = within_radius(31.2622, 34.8013, [31.2622, np.nan], [34.8013, np.nan], 10, error_band=0.01)
+    assert mask.tolist() == [True, False]
+
+
+def test_within_radius_accepts_one_radius_per_candidate():
+    lat, lng = 31.2622, 34.8013
+    lats, lngs = [31.3522, 31.3522, 31.2622], [34.8013, 34.8013, 34.8013]
+    mask = within_radius(lat, lng, lats, lngs, [5, 15, 1])
+    assert mask.tolist() == [False, True, True]
@@ -0,0 +1,55 @@
+from utils.distance_cache import DistanceCache
+from utils.map_service import MapsService
+
+BEER_SHEVA = (31.2622, 34.8013)
+TEL_AVIV = (32.0853, 34.7818)
+HAIFA = (32.7940, 34.9896)
+
+
+class CountingClient:
+    def __init__(self):
+        self.elements = 0
+
+    def distance_matrix(self, origins, destinations, mode):
+        self.elements += len(origins) * len(destinations)
+        return {'rows': [{'elements': [{'status': 'OK', 'distance': {'value': 100000}} for _ in destinations]}
+                         for _ in origins]}
+
+
+def test_keys_are_quantized():
+    cache = DistanceCache()
+    assert cache.key_for(BEER_SHEVA, TEL_AVIV) == cache.key_for((31.26221, 34.80129), TEL_AVIV)
+    assert cache.key_for(BEER_SHEVA, TEL_AVIV) != cache.key_for(TEL_AVIV, BEER_SHEVA)
+
+
+def test_persistent_level_survives_a_restart(tmp_path):
+    path = str(tmp_path / "distances.sqlite3")
+    key = DistanceCache(path=path).key_for(BEER_SHEVA, TEL_AVIV)
+    DistanceCache(path=path).put_many({key: 112.5})
+
+    restarted = DistanceCache(path=path)
+    assert restarted.get_many([key]) == {key: 112.5}
+    assert restarted.get_many([key]) == {key: 112.5}
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 0)
+
+
+def test_entries_expire(tmp_path):
+    cache = DistanceCache(ttl_seconds=0, path=str(tmp_path / "distances.sqlite3"))
+    key = cache.key_for(BEER_SHEVA, TEL_AVIV)
+    cache.put_many({key: 112.5})
+    assert cache.get_many([key]) == {}
+    assert cache.purge_expired() == 1
+
+
+def test_maps_service_only_requests_missing_pairs():
+    client = CountingClient()
+    service = MapsService(cache=DistanceCache())
+    service.client = client
+
+    service.distance_matrix([BEER_SHEVA], [TEL_AVIV], mode='driving')
+    result = service.distance_matrix([BEER_SHEVA, HAIFA], [TEL_AVIV], mode='driving')
+
+    assert client.elements == 2
+    assert [row['elements'][0]['distance']['value'] for row in result['rows']] == [100000, 100000]
+    assert service.cache.stats()["hit_rate"] == 1 / 3
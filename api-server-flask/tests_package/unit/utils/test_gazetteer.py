@@ -0,0 +1,64 @@
+import pytest
+
+from utils import geocoding
+from utils.gazetteer import Gazetteer, build_gazetteer
+from utils.geocoding import GeocodeCache, geocode_many
+
+PLACES = [("BGU Gate 90", 31.2613, 34.8035),
+          ("BGU Gate 40", 31.2639, 34.8018),
+          ("Be'er Sheva Center Train Station", 31.2431, 34.7982),
+          ("Tel Aviv Savidor Center", 32.0838, 34.7980),
+          ("Beit Hadekel Dorms", 31.2660, 34.8051)]
+
+
+@pytest.fixture
+def places(tmp_path):
+    path = str(tmp_path / "gazetteer.tsv")
+    build_gazetteer(PLACES, path)
+    gazetteer = Gazetteer()
+    gazetteer.load(path)
+    yield gazetteer
+    gazetteer.close()
+
+
+def test_build_gazetteer_writes_sorted_normalized_names(tmp_path):
+    path = str(tmp_path / "gazetteer.tsv")
+    assert build_gazetteer(PLACES + [("  bgu   gate 90 ", 31.2614, 34.8036)], path) == len(PLACES)
+    with open(path, encoding='utf-8') as place_file:
+        names = [line.split('\t')[0] for line in place_file]
+    assert names == sorted(names, key=str.encode)
+    assert "bgu gate 90" in names
+
+
+def test_lookup_exact_and_unique_prefix(places):
+    assert len(places) == len(PLACES)
+    assert places.lookup("BGU  gate 90") == (31.2613, 34.8035)
+    assert places.lookup("tel aviv savidor") == (32.0838, 34.7980)
+    assert places.lookup("BGU Gate") is None  # ambiguous prefix
+    assert places.lookup("Haifa") is None
+    assert places.stats()["hits"] == 2
+
+
+def test_complete_lists_places_sharing_a_prefix(places):
+    assert [name for name, _ in places.complete("bgu")] == ["bgu gate 40", "bgu gate 90"]
+    assert places.complete("be", limit=1) == [("be'er sheva center train station", (31.2431, 34.7982))]
+    assert places.complete("zzz") == []
+
+
+def test_geocoding_tries_the_gazetteer_first(places, monkeypatch):
+    remote = []
+    monkeypatch.setattr(geocoding, 'gazetteer', places)
+    monkeypatch.setattr(geocoding, 'geocode_cache', GeocodeCache())
+    monkeypatch.setattr(geocoding, 'remote_geocode', lambda address: remote.append(address) or (32.0, 34.0))
+
+    resolved = geocode_many(["Beit Hadekel Dorms", "Somewhere Else"])
+    assert resolved == {"Beit Hadekel Dorms": (31.2660, 34.8051), "Somewhere Else": (32.0, 34.0)}
+    assert remote == ["Somewhere Else"]
+
+
+def test_empty_gazetteer(tmp_path):
+    path = str(tmp_path / "gazetteer.tsv")
+    build_gazetteer([], path)
+    gazetteer = Gazetteer()
+    assert gazetteer.load(path) == 0
+    assert gazetteer.lookup("BGU Gate 90") is None
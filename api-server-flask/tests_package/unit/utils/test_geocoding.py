@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from models import RideOffers, Rides, SavedSearches
+from utils import geocoding
+from utils.geocoding import GeocodeCache, geocode, geocode_many, normalize_address
+
+PLACES = {"main street, tel aviv": (32.0853, 34.7818), "central station, haifa": (32.7940, 34.9896)}
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    calls = []
+
+    def fake_remote_geocode(address):
+        calls.append(address)
+        return PLACES.get(normalize_address(address))
+
+    monkeypatch.setattr(geocoding, 'remote_geocode', fake_remote_geocode)
+    monkeypatch.setattr(geocoding, 'geocode_cache', GeocodeCache(negative_ttl_seconds=0.1))
+    return calls
+
+
+def test_normalize_address():
+    assert normalize_address("  Main   Street ,Tel Aviv ") == "main street, tel aviv"
+    assert normalize_address("MAIN STREET, TEL AVIV,") == "main street, tel aviv"
+
+
+def test_geocode_many_resolves_each_normalized_address_once(remote):
+    resolved = geocode_many(["Main Street, Tel Aviv", "main street ,tel aviv", "32.1,34.8", "Nowhere"])
+    assert resolved == {"Main Street, Tel Aviv": (32.0853, 34.7818), "main street ,tel aviv": (32.0853, 34.7818),
+                        "32.1,34.8": (32.1, 34.8), "Nowhere": None}
+    assert remote == ["Main Street, Tel Aviv", "Nowhere"]
+
+    assert geocode("MAIN STREET, TEL AVIV") == (32.0853, 34.7818)
+    assert geocode("Nowhere") is None
+    assert len(remote) == 2
+    assert geocoding.geocode_cache.stats()["negative_hits"] == 1
+
+
+def test_negative_results_expire_sooner(remote):
+    assert geocode("Nowhere") is None
+    time.sleep(0.15)
+    assert geocode("Nowhere") is None
+    assert geocode("Main Street, Tel Aviv") is not None
+    assert remote == ["Nowhere", "Nowhere", "Main Street, Tel Aviv"]
+
+
+def test_failed_requests_are_not_cached(monkeypatch):
+    def failing_remote_geocode(address):
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(geocoding, 'remote_geocode', failing_remote_geocode)
+    monkeypatch.setattr(geocoding, 'geocode_cache', GeocodeCache())
+    assert geocode("Main Street, Tel Aviv") is None
+    assert len(geocoding.geocode_cache) == 0
+
+
+def test_persistent_store_survives_a_new_cache(remote, tmp_path):
+    path = str(tmp_path / "geocodes.sqlite3")
+    geocoding.geocode_cache = GeocodeCache(path=path)
+    geocode_many(["Main Street, Tel Aviv", "Nowhere"])
+
+    geocoding.geocode_cache = GeocodeCache(path=path)
+    assert geocode_many(["main street, tel aviv", "nowhere"], fetch=False) == {
+        "main street, tel aviv": (32.0853, 34.7818), "nowhere": None}
+    assert len(remote) == 2
+
+
+def test_ride_addresses_are_geocoded_together_when_posted(remote):
+    calls = []
+
+    def bulk_geocode(addresses):
+        calls.append(list(addresses))
+        return geocode_many(addresses)
+
+    ride = Rides(departure_location="Main Street, Tel Aviv", destination="Central Station, Haifa")
+    ride.set_coordinates(geocode=bulk_geocode)
+    assert (ride.departure_lat, ride.departure_lng) == (32.0853, 34.7818)
+    assert (ride.destination_lat, ride.destination_lng) == (32.7940, 34.9896)
+    assert calls == [["Main Street, Tel Aviv", "Central Station, Haifa"]]
+
+    unresolved = Rides(departure_location="Nowhere", destination="32.1,34.8")
+    unresolved.set_coordinates(geocode=geocode_many)
+    assert unresolved.departure_lat is None and unresolved.destination_lat == 32.1
+
+
+def test_models_share_the_coordinate_columns():
+    ride = Rides(departure_location="31.2622,34.8013", destination="32.0853,34.7818", route_polyline="stale")
+    assert ride.set_coordinates() and ride.route_polyline is None
+    ride.route_polyline = "sampled"
+    assert not ride.set_coordinates() and ride.route_polyline == "sampled"
+
+    for model in (RideOffers, SavedSearches):
+        row = model(departure_location="Main Street", destination="32.0853,34.7818")
+        assert row.set_coordinates()
+        assert row.departure_lat is None and (row.destination_lat, row.destination_lng) == (32.0853, 34.7818)
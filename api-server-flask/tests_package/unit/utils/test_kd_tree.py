@@ -0,0 +1,45 @@
+import numpy as np
+
+from utils.kd_tree import KDTree, DynamicKDTree
+
+
+def brute_force(ids, points, mins, maxs):
+    inside = np.all((points >= mins) & (points <= maxs), axis=1)
+    return set(np.asarray(ids)[inside].tolist())
+
+
+def test_range_query_matches_brute_force():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(0, 1, (5000, 4))
+    ids = np.arange(5000)
+    tree = KDTree(ids, points, leaf_size=16)
+    for _ in range(20):
+        mins = rng.uniform(0, 0.7, 4)
+        maxs = mins + rng.uniform(0.1, 0.3, 4)
+        assert set(tree.range_query(mins, maxs).tolist()) == brute_force(ids, points, mins, maxs)
+
+
+def test_dynamic_tree_inserts_and_deletes():
+    rng = np.random.default_rng(2)
+    tree = DynamicKDTree(4)
+    points = {i: tuple(p) for i, p in enumerate(rng.uniform(0, 1, (1000, 4)))}
+    tree.bulk_load(list(points), list(points.values()))
+
+    for i in range(0, 1000, 3):
+        tree.delete(i)
+        del points[i]
+    for i in range(1000, 1600):
+        points[i] = tuple(rng.uniform(0, 1, 4))
+        tree.insert(i, points[i])
+    points[1] = (0.5, 0.5, 0.5, 0.5)
+    tree.insert(1, points[1])
+
+    mins, maxs = np.full(4, 0.2), np.full(4, 0.8)
+    ids = list(points)
+    assert set(tree.range_query(mins, maxs)) == brute_force(ids, np.array([points[i] for i in ids]), mins, maxs)
+    assert len(tree) == len(points)
+
+
+def test_empty_tree():
+    tree = DynamicKDTree(4)
+    assert tree.range_query(np.zeros(4), np.ones(4)) == []
@@ -0,0 +1,35 @@
+import pytest
+
+from utils.location_utils import ParsedLocationCache, location_cache, parse_location, try_parse_location
+
+
+def test_parse_location_validates_and_caches():
+    location_cache.clear()
+    before = location_cache.stats()
+
+    assert parse_location("31.2622,34.8013") == (31.2622, 34.8013)
+    assert parse_location("31.2622,34.8013") == (31.2622, 34.8013)
+    stats = location_cache.stats()
+    assert (stats["hits"] - before["hits"], stats["misses"] - before["misses"]) == (1, 1)
+
+    with pytest.raises(ValueError, match="Invalid location format"):
+        parse_location("Beer Sheva")
+    with pytest.raises(ValueError, match="Invalid latitude or longitude values"):
+        parse_location("91.0,34.0")
+    assert try_parse_location(None) == (None, None)
+    assert len(location_cache) == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ParsedLocationCache(max_entries=2)
+    cache.put("a", (1.0, 1.0))
+    cache.put("b", (2.0, 2.0))
+    assert cache.get("a") == (1.0, 1.0)
+    cache.put("c", (3.0, 3.0))
+    assert cache.get("b") is None
+    assert cache.get("a") == (1.0, 1.0)
+    assert cache.stats()["hit_rate"] == 2 / 3
+
+    cache.configure(0)
+    cache.put("d", (4.0, 4.0))
+    assert len(cache) == 0
@@ -41,4 +41,39 @@ def test_distance_matrix_with_google_maps_api(monkeypatch, origins, destinations
     monkeypatch.setattr(service, 'client', MockGoogleMapsClient())
     result = service.distance_matrix(origins, destinations, mode='driving')
     distance = result['rows'][0]['elements'][0]['distance']['value'] / 1000  # convert to kilometers
-    assert distance == 1000  # check if the mock distance is returned correctly
\ No newline at end of file
+    assert distance == 1000  # check if the mock distance is returned correctly
+
+def test_distance_matrix_with_haversine_is_full():
+    service = MapsService()
+    origins = ["37.7749,-122.4194", (40.7128, -74.0060), "Somewhere"]
+    destinations = ["34.0522,-118.2437", "37.7749,-122.4194"]
+    result = service.distance_matrix(origins, destinations, mode='driving')
+
+    assert [len(row['elements']) for row in result['rows']] == [2, 2, 2]
+    assert isclose(result['rows'][0]['elements'][0]['distance']['value'] / 1000, 559, rel_tol=0.01)
+    assert result['rows'][0]['elements'][1]['distance']['value'] == 0
+    assert isclose(result['rows'][1]['elements'][1]['distance']['value'] / 1000, 4130, rel_tol=0.01)
+    assert result['rows'][2]['elements'][0]['status'] == 'NOT_FOUND'
+    assert service.distance_matrix_km(origins, destinations).shape == (3, 2)
+
+
+def test_distance_matrix_with_google_maps_api_is_chunked(monkeypatch):
+    calls = []
+
+    class MockGoogleMapsClient:
+        def distance_matrix(self, origins, destinations, mode):
+            calls.append((len(origins), len(destinations)))
+            return {'rows': [{'elements': [{'status': 'OK', 'distance': {'value': 1000 * (float(o.split(',')[0]) +
+                                                                                          float(d.split(',')[0]))}}
+                                           for d in destinations]} for o in origins]}
+
+    service = MapsService()
+    monkeypatch.setattr(service, 'client', MockGoogleMapsClient())
+    origins = [(float(i), 0.0) for i in range(30)]
+    destinations = [(100.0 * j, 0.0) for j in range(40)]
+    distances = service.distance_matrix_km(origins, destinations)
+
+    assert all(rows * columns <= 100 and rows <= 25 and columns <= 25 for rows, columns in calls)
+    assert sum(rows * columns for rows, columns in calls) == 30 * 40
+    assert distances.shape == (30, 40)
+    assert distances[7, 13] == 7 + 1300
@@ -0,0 +1,131 @@
+import logging
+import time
+from math import isclose
+
+import pytest
+
+from utils.map_service import MapsService
+from utils.maps_client import CircuitBreaker, CircuitOpenError, PooledMapsClient
+from utils.maps_stub_server import MapsStubServer
+
+STUB_API_KEY = 'AIza-stub-key'
+TEL_AVIV = "32.0853,34.7818"
+JERUSALEM = "31.7683,35.2137"
+HAIFA = "32.7940,34.9896"
+
+
+@pytest.fixture
+def stub():
+    with MapsStubServer() as server:
+        yield server
+
+
+def stub_service(stub, **options):
+    options.setdefault('breaker', CircuitBreaker(failure_threshold=2, reset_timeout_seconds=0.5,
+                                                 slow_call_seconds=0.3))
+    return MapsService(api_key=STUB_API_KEY, base_url=stub.url, connect_timeout=0.5, read_timeout=0.5,
+                       **options)
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_seconds=0.1, slow_call_seconds=1)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_success(2)  # slow calls count as failures
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.15)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial call at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.15)
+    assert breaker.allow()
+    breaker.record_success(0.01)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["opened"] == 2
+
+
+def test_circuit_breaker_logs_its_state_changes(caplog):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_seconds=0, name="Maps")
+    with caplog.at_level(logging.INFO, logger="utils.maps_client"):
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success(0)
+        breaker.record_success(0)
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [
+        (logging.WARNING, "Maps circuit opened after 1 failures, retrying in 0s"),
+        (logging.INFO, "Maps circuit closed")]
+
+
+def test_pooled_client_calls_the_stub_server(stub):
+    client = PooledMapsClient(STUB_API_KEY, base_url=stub.url, connect_timeout=0.5, read_timeout=0.5)
+    result = client.distance_matrix(origins=[TEL_AVIV], destinations=[JERUSALEM, "nowhere"])
+
+    elements = result['rows'][0]['elements']
+    assert isclose(elements[0]['distance']['value'] / 1000, 54, rel_tol=0.05)
+    assert elements[1]['status'] == 'NOT_FOUND'
+    assert client.directions(origin=TEL_AVIV, destination=JERUSALEM)[0]['overview_polyline']['points']
+
+
+def test_pooled_client_runs_requests_concurrently(stub):
+    stub.latency_seconds = 0.2
+    client = PooledMapsClient(STUB_API_KEY, base_url=stub.url, read_timeout=2, max_concurrency=8)
+
+    start = time.monotonic()
+    futures = [client.submit('distance_matrix', origins=[TEL_AVIV], destinations=[JERUSALEM]) for _ in range(8)]
+    assert all(future.result()['status'] == 'OK' for future in futures)
+    assert time.monotonic() - start < 8 * 0.2 / 2
+
+
+def test_distance_matrix_falls_back_to_haversine_when_google_is_slow(stub):
+    service = stub_service(stub)
+    stub.latency_seconds = 1  # beyond the read timeout
+
+    for _ in range(2):
+        result = service.distance_matrix([TEL_AVIV], [JERUSALEM], mode='driving')
+        element = result['rows'][0]['elements'][0]
+        assert element['fallback'] == 'haversine'
+        assert isclose(element['distance']['value'] / 1000, 54, rel_tol=0.05)
+    assert service.client.breaker.state == CircuitBreaker.OPEN
+
+    # The open breaker answers at once without calling the server
+    requests = stub.request_count
+    start = time.monotonic()
+    assert service.distance_matrix_km([TEL_AVIV], [JERUSALEM, HAIFA]).shape == (1, 2)
+    assert time.monotonic() - start < 0.2
+    assert stub.request_count == requests
+    with pytest.raises(CircuitOpenError):
+        service.client.distance_matrix(origins=[TEL_AVIV], destinations=[JERUSALEM])
+
+
+def test_breaker_closes_when_google_recovers(stub):
+    service = stub_service(stub)
+    stub.error_status = 502
+    for _ in range(2):
+        service.distance_matrix([TEL_AVIV], [JERUSALEM], mode='driving')
+    assert service.client.breaker.state == CircuitBreaker.OPEN
+
+    stub.error_status = None
+    time.sleep(0.6)
+    result = service.distance_matrix([TEL_AVIV], [JERUSALEM], mode='driving')
+    assert 'fallback' not in result['rows'][0]['elements'][0]
+    assert service.client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_haversine_fallback_is_not_cached(stub, tmp_path):
+    from utils.distance_cache import DistanceCache
+
+    cache = DistanceCache(path=str(tmp_path / "distances.sqlite3"))
+    service = stub_service(stub, cache=cache)
+    stub.error_status = 502
+    service.distance_matrix([TEL_AVIV], [JERUSALEM], mode='driving')
+    assert len(cache) == 0
+
+    stub.error_status = None
+    service.distance_matrix([TEL_AVIV], [JERUSALEM], mode='driving')
+    assert len(cache) == 1
@@ -0,0 +1,86 @@
+import random
+from math import isclose, isnan
+
+import numpy as np
+import pytest
+
+from utils.batch_distance import haversine_km
+from utils.map_service import MapsService
+from utils.road_graph import RoadGraph
+
+# A square block around which the road goes, with a one-way shortcut on its diagonal
+A, B, C, D = (31.250, 34.790), (31.250, 34.800), (31.260, 34.800), (31.260, 34.790)
+
+
+def km(p, q):
+    return float(haversine_km(p[0], p[1], q[0], q[1]))
+
+
+@pytest.fixture
+def block():
+    return RoadGraph.from_edges([(*A, *B, None, False), (*B, *C, None, False), (*C, *D, None, False),
+                                 (*D, *A, None, False), (*A, *C, 2.0, True)])
+
+
+def grid_graph(size=12, seed=7):
+    rng = random.Random(seed)
+    point = lambda row, column: (31.2 + 0.01 * row, 34.7 + 0.01 * column)
+    edges = []
+    for row in range(size):
+        for column in range(size):
+            for neighbour in ((row + 1, column), (row, column + 1)):
+                if neighbour[0] < size and neighbour[1] < size and rng.random() < 0.85:
+                    detour = km(point(row, column), point(*neighbour)) * rng.uniform(1, 2)
+                    edges.append((*point(row, column), *point(*neighbour), detour, rng.random() < 0.2))
+    return RoadGraph.from_edges(edges), [point(row, column) for row in range(size) for column in range(size)]
+
+
+def test_road_distance_follows_the_roads(block):
+    assert len(block) == 4 and block.edge_count == 9
+    assert isclose(block.distance_km(A, B), km(A, B), rel_tol=1e-9)
+    # The one-way diagonal is used in its direction only
+    assert isclose(block.distance_km(A, C), 2.0, rel_tol=1e-9)
+    assert isclose(block.distance_km(C, A), km(C, D) + km(D, A), rel_tol=1e-9)
+    assert block.distance_km(C, A) > km(C, A)
+
+
+def test_points_are_snapped_to_the_nearest_node(block):
+    near_b = (31.2505, 34.8003)
+    assert block.snap(*near_b)[0] == block.snap(*B)[0]
+    assert isclose(block.distance_km(A, near_b), km(A, B) + km(B, near_b), rel_tol=1e-9)
+    assert block.snap(32.0853, 34.7818) == (None, None)
+    assert isnan(block.distance_km(A, (32.0853, 34.7818)))
+
+
+def test_a_star_and_one_to_many_agree_with_dijkstra():
+    graph, points = grid_graph()
+    rng = random.Random(3)
+    for _ in range(20):
+        origin = rng.choice(points)
+        destinations = rng.sample(points, 10)
+        one_to_many = graph.distances_from_km(origin, destinations)
+        for destination, distance in zip(destinations, one_to_many):
+            source, target = graph.snap(*origin)[0], graph.snap(*destination)[0]
+            settled = graph._node_distances(source, set(range(len(graph))))
+            expected = settled.get(target, float('nan'))
+            assert np.allclose(graph.distance_km(origin, destination), expected, equal_nan=True)
+            assert np.allclose(distance, expected, equal_nan=True)
+
+
+def test_save_and_load(block, tmp_path):
+    path = str(tmp_path / "road_graph.npz")
+    block.save(path)
+    loaded = RoadGraph.load(path)
+    assert loaded.edge_count == block.edge_count
+    assert isclose(loaded.distance_km(C, A), block.distance_km(C, A), rel_tol=1e-12)
+
+
+def test_maps_service_uses_the_road_graph_without_google(block):
+    service = MapsService(road_graph=block)
+    far = (32.0853, 34.7818)
+    distances = service.distance_matrix_km([C], [A, far])
+    assert isclose(distances[0, 0], km(C, D) + km(D, A), rel_tol=1e-9)
+    assert isclose(distances[0, 1], km(C, far), rel_tol=1e-9)  # off the network: haversine
+
+    result = service.distance_matrix([f"{C[0]},{C[1]}"], ["Somewhere"], mode='driving')
+    assert result['rows'][0]['elements'][0]['status'] == 'NOT_FOUND'
@@ -0,0 +1,55 @@
+import numpy as np
+from math import isclose
+
+from utils.batch_distance import haversine_km
+from utils.route_sampling import (corridor_match, decode_route, encode_route, great_circle_route, resample_route,
+                                  route_positions_within)
+
+BEER_SHEVA = (31.2622, 34.8013)
+HAIFA = (32.7940, 34.9896)
+
+
+def test_great_circle_route_is_evenly_sampled():
+    lats, lngs = great_circle_route(*BEER_SHEVA, *HAIFA, spacing_km=0.5)
+    assert np.allclose([lats[0], lngs[0]], BEER_SHEVA)
+    assert np.allclose([lats[-1], lngs[-1]], HAIFA)
+    steps = haversine_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+    assert steps.max() <= 0.5
+    assert isclose(steps.sum(), haversine_km(*BEER_SHEVA, *HAIFA), rel_tol=1e-6)
+
+
+def test_resample_route_keeps_the_vertices():
+    lats, lngs = resample_route([31.0, 31.0, 31.1], [34.0, 34.1, 34.1], spacing_km=1)
+    assert haversine_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:]).max() <= 1
+    for vertex in ((31.0, 34.0), (31.0, 34.1), (31.1, 34.1)):
+        assert (np.isclose(lats, vertex[0]) & np.isclose(lngs, vertex[1])).any()
+
+
+def test_encoded_route_round_trip():
+    lats, lngs = great_circle_route(*BEER_SHEVA, *HAIFA)
+    decoded_lats, decoded_lngs = decode_route(encode_route(lats, lngs))
+    assert np.allclose(decoded_lats, lats, atol=1e-5)
+    assert np.allclose(decoded_lngs, lngs, atol=1e-5)
+
+
+def test_corridor_match_requires_pickup_before_drop():
+    lats, lngs = great_circle_route(*BEER_SHEVA, *HAIFA)
+    early = (lats[len(lats) // 3] + 0.01, lngs[len(lats) // 3])
+    late = (lats[2 * len(lats) // 3], lngs[2 * len(lats) // 3] - 0.01)
+
+    assert corridor_match(lats, lngs, early, 3, late, 3)
+    assert not corridor_match(lats, lngs, late, 3, early, 3)
+    assert corridor_match(lats, lngs, None, None, late, 3)
+    assert not corridor_match(lats, lngs, (31.0, 35.5), 3, None, None)
+
+
+def test_small_radius_matches_between_samples():
+    lats, lngs = great_circle_route(31.2, 34.80, 31.2, 34.81, spacing_km=0.5)
+    middle = (lats[0] + lats[1]) / 2, (lngs[0] + lngs[1]) / 2
+    pickup = (middle[0] + 0.001, middle[1])
+    assert haversine_km(*pickup, lats, lngs).min() > 0.2
+
+    assert np.allclose(route_positions_within(*pickup, lats, lngs, 0.2), [0.5], atol=0.01)
+    assert corridor_match(lats, lngs, pickup, 0.2, (lats[-1], lngs[-1]), 0.2)
+    assert not corridor_match(lats, lngs, (lats[-1], lngs[-1]), 0.2, pickup, 0.2)
+    assert not corridor_match(lats, lngs, (middle[0] + 0.003, middle[1]), 0.2, None, None)
@@ -0,0 +1,81 @@
+import time
+from types import SimpleNamespace
+
+from utils.token_cache import TokenCache, UserSnapshot
+
+ALICE = SimpleNamespace(id=1, email="alice@example.com", jwt_auth_active=True)
+BOB = SimpleNamespace(id=2, email="bob@example.com", jwt_auth_active=True)
+
+
+def test_get_returns_the_stored_check():
+    cache = TokenCache()
+    assert cache.get("token-a", "home") is None
+    cache.put("token-a", {"email": ALICE.email}, ALICE, revoked=False, generation=cache.generation)
+
+    entry = cache.get("token-a", "home")
+    assert (entry.user_id, entry.email, entry.jwt_auth_active, entry.revoked) == (1, ALICE.email, True, False)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["queries_saved"]) == (1, 1, 2)
+    assert stats["endpoints"]["home"]["hit_rate"] == 0.5
+
+
+def test_entries_expire_with_the_ttl_or_the_token():
+    cache = TokenCache(ttl_seconds=60)
+    cache.put("token-a", {"exp": time.time() - 1}, ALICE, revoked=False, generation=cache.generation)
+    assert cache.get("token-a") is None
+
+    cache = TokenCache(ttl_seconds=0.05)
+    cache.put("token-a", {}, ALICE, revoked=False, generation=cache.generation)
+    time.sleep(0.1)
+    assert cache.get("token-a") is None
+
+
+def test_invalidation_by_token_and_by_user():
+    cache = TokenCache()
+    cache.put("token-a1", {}, ALICE, revoked=False, generation=cache.generation)
+    cache.put("token-a2", {}, ALICE, revoked=False, generation=cache.generation)
+    cache.put("token-b", {}, BOB, revoked=False, generation=cache.generation)
+
+    cache.invalidate_token("token-a1")
+    assert cache.get("token-a1") is None and cache.get("token-a2") is not None
+    cache.invalidate_user(ALICE.id)
+    assert cache.get("token-a2") is None
+    assert cache.get("token-b") is not None
+    assert len(cache) == 1
+    cache.invalidate_email(BOB.email)
+    assert len(cache) == 0
+
+
+def test_check_read_before_an_invalidation_is_not_stored():
+    cache = TokenCache()
+    # A request reads the generation and the still active user, then a logout commits
+    generation = cache.generation
+    cache.invalidate_user(ALICE.id)
+    cache.put("token-a", {}, ALICE, revoked=False, generation=generation)
+    assert cache.get("token-a") is None
+
+    generation = cache.generation
+    cache.invalidate_token("token-a")
+    cache.put("token-a", {}, ALICE, revoked=False, generation=generation)
+    assert cache.get("token-a") is None
+
+    cache.put("token-a", {}, ALICE, revoked=False, generation=cache.generation)
+    assert cache.get("token-a") is not None
+
+
+def test_size_is_bounded_and_zero_disables_it():
+    cache = TokenCache(max_entries=2)
+    for i in range(3):
+        cache.put(f"token-{i}", {}, ALICE, revoked=False, generation=cache.generation)
+    assert len(cache) == 2 and cache.get("token-0") is None
+
+    cache.configure(0, 60)
+    cache.put("token-3", {}, ALICE, revoked=False, generation=cache.generation)
+    assert len(cache) == 0
+
+
+def test_user_snapshot_answers_identity_without_loading_the_user():
+    snapshot = UserSnapshot(1, ALICE.email)
+    snapshot._user = SimpleNamespace(first_name="Alice")
+    assert snapshot.toJSON() == {"_id": 1, "email": ALICE.email}
+    assert snapshot.first_name == "Alice"
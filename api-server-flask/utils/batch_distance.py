@@ -0,0 +1,59 @@
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """
+    Calculates great-circle distances from one point to many points in a single NumPy pass.
+
+    Parameters:
+    - lat: float, latitude of the origin
+    - lng: float, longitude of the origin
+    - lats: array-like, latitudes of the candidates
+    - lngs: array-like, longitudes of the candidates
+
+    Returns:
+    - numpy.ndarray: distances in kilometers, with the broadcast shape of the inputs
+    """
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def within_radius(lat, lng, lats, lngs, radius_km, error_band=None):
+    """
+    Checks which candidates lie within radius_km (geodesic) of a point.
+
+    The haversine pass decides every candidate that is clearly inside or outside the radius.
+    Only candidates whose haversine distance is within error_band * radius_km of the radius
+    are re-checked with the exact geodesic.
+
+    Parameters:
+    - lat: float, latitude of the origin
+    - lng: float, longitude of the origin
+    - lats: array-like, latitudes of the candidates, NaN for unknown locations
+    - lngs: array-like, longitudes of the candidates, NaN for unknown locations
+    - radius_km: float or array-like, the radius in kilometers, or one radius per candidate
+    - error_band: float (optional), relative band around the radius that needs the exact check
+
+    Returns:
+    - numpy.ndarray: boolean mask of the candidates within the radius
+    """
+    if error_band is None:
+        from api.config import BaseConfig
+        error_band = BaseConfig.DISTANCE_ERROR_BAND
+
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    distances = haversine_km(lat, lng, lats, lngs)
+    radii = np.broadcast_to(np.asarray(radius_km, dtype=float), distances.shape)
+
+    band = radii * error_band
+    mask = distances <= radii - band
+    borderline = np.flatnonzero(np.abs(distances - radii) < band)
+    for i in borderline:
+        mask[i] = geodesic((lat, lng), (lats[i], lngs[i])).km <= radii[i]
+    return mask
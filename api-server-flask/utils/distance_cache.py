@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+# 4 decimals are about 11 meters, well below the precision of a driving distance
+DEFAULT_PRECISION = 4
+
+
+class DistanceCache:
+    """
+    Two-level cache of driving distances: an in-process LRU in front of a persistent SQLite
+    file shared by the workers and kept across restarts.
+
+    Keys are the origin and destination coordinates rounded to `precision` decimals and the
+    travel mode, so requests for nearby points share an entry. Entries expire after
+    ttl_seconds on both levels. Only found distances are cached.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, path=None,
+                 precision=DEFAULT_PRECISION):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.precision = precision
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS distances '
+                                     '(key TEXT PRIMARY KEY, distance_km REAL NOT NULL, expires_at REAL NOT NULL)')
+            self._connection.commit()
+
+    def key_for(self, origin, destination, mode='driving'):
+        """
+        Builds the cache key of a pair of (lat, lng) points.
+        """
+        return (f"{origin[0]:.{self.precision}f},{origin[1]:.{self.precision}f}|"
+                f"{destination[0]:.{self.precision}f},{destination[1]:.{self.precision}f}|{mode}")
+
+    def get_many(self, keys):
+        """
+        Looks keys up in memory first and then, for the remaining ones, in the persistent store.
+        Entries found on disk are promoted to memory.
+
+        Returns:
+        - dict: key -> distance in kilometers, for the keys that were found
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+            self.memory_hits += len(found)
+
+            remaining = [key for key in dict.fromkeys(keys) if key not in found]
+            if remaining and self._connection is not None:
+                for start in range(0, len(remaining), 500):
+                    batch = remaining[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT key, distance_km, expires_at FROM distances "
+                        f"WHERE key IN ({','.join('?' * len(batch))}) AND expires_at > ?", batch + [now]).fetchall()
+                    for key, distance_km, expires_at in rows:
+                        found[key] = distance_km
+                        self._remember(key, distance_km, expires_at)
+                        self.disk_hits += 1
+            self.misses += sum(1 for key in remaining if key not in found)
+        return found
+
+    def put_many(self, distances):
+        """
+        Stores distances on both levels.
+
+        Parameters:
+        - distances: dict, key -> distance in kilometers
+        """
+        if not distances:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            for key, distance_km in distances.items():
+                self._remember(key, distance_km, expires_at)
+            if self._connection is not None:
+                self._connection.executemany('INSERT OR REPLACE INTO distances (key, distance_km, expires_at) '
+                                             'VALUES (?, ?, ?)',
+                                             [(key, distance_km, expires_at) for key, distance_km in distances.items()])
+                self._connection.commit()
+
+    def _remember(self, key, distance_km, expires_at):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (distance_km, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def purge_expired(self):
+        """
+        Deletes the expired entries of the persistent store.
+
+        Returns:
+        - int: the number of deleted entries
+        """
+        if self._connection is None:
+            return 0
+        with self._lock:
+            deleted = self._connection.execute('DELETE FROM distances WHERE expires_at <= ?', (time.time(),)).rowcount
+            self._connection.commit()
+            return deleted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM distances')
+                self._connection.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: memory entry count, hits per level, misses and hit rates
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {"entries": len(self._entries), "memory_hits": self.memory_hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses,
+                    "memory_hit_rate": self.memory_hits / lookups if lookups else 0.0,
+                    "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0}
@@ -0,0 +1,159 @@
+import mmap
+import os
+import threading
+from array import array
+
+from utils.location_utils import normalize_address
+
+
+class Gazetteer:
+    """
+    Offline geocoder of known place names: campus gates, dorms, stations, city centers.
+
+    The place file holds one "name<TAB>lat<TAB>lng" line per place, names normalized with
+    normalize_address and sorted by their UTF-8 bytes, see build_gazetteer. It is memory-mapped,
+    so workers share its pages, and only an array of line offsets is built at load time. A lookup
+    is a binary search over the offsets; the names sharing a prefix are a contiguous run of lines,
+    which gives the prefix queries of a trie without building one.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.hits = 0
+        self.misses = 0
+        self._file = None
+        self._mmap = None
+        self._offsets = array('Q')
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """
+        Maps a place file, replacing the current one.
+
+        Returns:
+        - int: the number of places
+        """
+        with self._lock:
+            self.close()
+            self.path = path
+            if os.path.getsize(path) == 0:
+                return 0
+            self._file = open(path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            offsets = array('Q')
+            position = 0
+            size = len(self._mmap)
+            while position < size:
+                offsets.append(position)
+                end = self._mmap.find(b'\n', position)
+                position = size if end < 0 else end + 1
+            self._offsets = offsets
+            return len(offsets)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+        self._mmap = None
+        self._file = None
+        self._offsets = array('Q')
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _line(self, i):
+        start = self._offsets[i]
+        end = self._offsets[i + 1] - 1 if i + 1 < len(self._offsets) else len(self._mmap)
+        return self._mmap[start:end].rstrip(b'\n')
+
+    def _name(self, i):
+        start = self._offsets[i]
+        return self._mmap[start:self._mmap.find(b'\t', start)]
+
+    def _place(self, i):
+        name, lat, lng = self._line(i).split(b'\t')
+        return name.decode(), (float(lat), float(lng))
+
+    def _lower_bound(self, key):
+        low, high = 0, len(self._offsets)
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def complete(self, prefix, limit=10):
+        """
+        Lists the places whose normalized name starts with a prefix.
+
+        Returns:
+        - list: (name, (lat, lng)) tuples in name order, at most limit of them
+        """
+        key = normalize_address(prefix).encode()
+        places = []
+        if self._mmap is None:
+            return places
+        i = self._lower_bound(key)
+        while i < len(self._offsets) and len(places) < limit and self._name(i).startswith(key):
+            places.append(self._place(i))
+            i += 1
+        return places
+
+    def lookup(self, name):
+        """
+        Resolves a place name: its exact normalized name, or else a prefix of exactly one place,
+        e.g. "central station, hai" for "central station, haifa".
+
+        Returns:
+        - tuple: (lat, lng), or None when the name is unknown or ambiguous
+        """
+        candidates = self.complete(name, limit=2)
+        key = normalize_address(name)
+        location = None
+        if candidates and (candidates[0][0] == key or len(candidates) == 1):
+            location = candidates[0][1]
+        if location is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return location
+
+    def stats(self):
+        """
+        Returns:
+        - dict: place count, hits, misses and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {"places": len(self), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def build_gazetteer(places, path):
+    """
+    Writes a place file for Gazetteer.load. Names are normalized; when a name repeats, the
+    last place wins.
+
+    Parameters:
+    - places: iterable, (name, lat, lng) tuples
+    - path: str, the file to write, replaced atomically
+
+    Returns:
+    - int: the number of places written
+    """
+    entries = {}
+    for name, lat, lng in places:
+        key = normalize_address(name)
+        if key:
+            entries[key.encode()] = (float(lat), float(lng))
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as place_file:
+        for key in sorted(entries):
+            lat, lng = entries[key]
+            place_file.write(key + f"\t{lat:.6f}\t{lng:.6f}\n".encode())
+    os.replace(temporary_path, path)
+    return len(entries)
+
+
+gazetteer = Gazetteer()
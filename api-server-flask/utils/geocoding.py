@@ -0,0 +1,214 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import geocoder
+
+from utils.gazetteer import gazetteer
+from utils.location_utils import normalize_address, try_parse_location
+
+DEFAULT_GEOCODE_CACHE_SIZE = 2048
+DEFAULT_GEOCODE_TTL_SECONDS = 90 * 24 * 3600
+# Addresses Google could not resolve are asked again after a short while
+DEFAULT_NEGATIVE_TTL_SECONDS = 10 * 60
+
+
+class GeocodeCache:
+    """
+    Cache of geocoded addresses: an in-process LRU, optionally in front of a SQLite file kept
+    across restarts.
+
+    Keys are normalized addresses. Found coordinates expire after ttl_seconds; addresses that
+    could not be geocoded are stored as None and expire after negative_ttl_seconds.
+    """
+
+    def __init__(self, max_entries=DEFAULT_GEOCODE_CACHE_SIZE, ttl_seconds=DEFAULT_GEOCODE_TTL_SECONDS,
+                 negative_ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS, path=None):
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._connection = None
+        self.configure(max_entries, ttl_seconds, negative_ttl_seconds, path)
+
+    def configure(self, max_entries, ttl_seconds=DEFAULT_GEOCODE_TTL_SECONDS,
+                  negative_ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS, path=None):
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl_seconds = ttl_seconds
+            self.negative_ttl_seconds = negative_ttl_seconds
+            while len(self._entries) > max(max_entries, 0):
+                self._entries.popitem(last=False)
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self.path = path
+            if path:
+                self._connection = sqlite3.connect(path, check_same_thread=False)
+                self._connection.execute('CREATE TABLE IF NOT EXISTS geocodes '
+                                         '(key TEXT PRIMARY KEY, lat REAL, lng REAL, expires_at REAL NOT NULL)')
+                self._connection.commit()
+
+    def get_many(self, keys):
+        """
+        Looks normalized addresses up in memory first and then in the persistent store.
+
+        Returns:
+        - dict: key -> (lat, lng), or None for a cached negative result, for the keys that were found
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+
+            remaining = [key for key in dict.fromkeys(keys) if key not in found]
+            if remaining and self._connection is not None:
+                for start in range(0, len(remaining), 500):
+                    batch = remaining[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT key, lat, lng, expires_at FROM geocodes "
+                        f"WHERE key IN ({','.join('?' * len(batch))}) AND expires_at > ?", batch + [now]).fetchall()
+                    for key, lat, lng, expires_at in rows:
+                        found[key] = None if lat is None else (lat, lng)
+                        self._remember(key, found[key], expires_at)
+
+            self.hits += sum(1 for location in found.values() if location is not None)
+            self.negative_hits += sum(1 for location in found.values() if location is None)
+            self.misses += len(remaining) - sum(1 for key in remaining if key in found)
+        return found
+
+    def put_many(self, locations):
+        """
+        Stores geocoding results on both levels.
+
+        Parameters:
+        - locations: dict, key -> (lat, lng), or None when the address could not be geocoded
+        """
+        if not locations:
+            return
+        now = time.time()
+        rows = [(key, *(location if location is not None else (None, None)),
+                 now + (self.ttl_seconds if location is not None else self.negative_ttl_seconds))
+                for key, location in locations.items()]
+        with self._lock:
+            for key, lat, lng, expires_at in rows:
+                self._remember(key, None if lat is None else (lat, lng), expires_at)
+            if self._connection is not None:
+                self._connection.executemany('INSERT OR REPLACE INTO geocodes (key, lat, lng, expires_at) '
+                                             'VALUES (?, ?, ?, ?)', rows)
+                self._connection.commit()
+
+    def _remember(self, key, location, expires_at):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (location, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM geocodes')
+                self._connection.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: memory entry count, hits, negative hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "negative_hits": self.negative_hits,
+                    "misses": self.misses,
+                    "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0}
+
+
+geocode_cache = GeocodeCache()
+
+
+def remote_geocode(address):
+    """
+    Geocodes an address with Google.
+
+    Returns:
+    - tuple: (lat, lng), or None when Google did not find the address
+    """
+    g = geocoder.google(address)
+    return tuple(g.latlng) if g.ok else None
+
+
+def geocode_many(addresses, fetch=True):
+    """
+    Resolves address strings to coordinates, each distinct normalized address at most once.
+    "lat,lng" strings are parsed and known place names are read from the offline gazetteer.
+    The others are looked up in the geocode cache and, when fetch is set, the misses are
+    geocoded remotely and cached.
+
+    Parameters:
+    - addresses: iterable, the location strings
+    - fetch: bool (optional), geocode the cache misses remotely
+
+    Returns:
+    - dict: address -> (lat, lng), or None when it could not be resolved
+    """
+    results = {}
+    keys = {}
+    for address in addresses:
+        if not address or address in results or address in keys:
+            continue
+        lat, lng = try_parse_location(address)
+        if lat is not None:
+            results[address] = (lat, lng)
+            continue
+        place = gazetteer.lookup(address) if len(gazetteer) else None
+        if place is not None:
+            results[address] = place
+        else:
+            keys[address] = normalize_address(address)
+
+    cached = geocode_cache.get_many(list(keys.values())) if keys else {}
+    fetched = {}
+    for address, key in keys.items():
+        if key not in cached and key not in fetched and fetch:
+            try:
+                fetched[key] = remote_geocode(address)
+            except Exception as e:
+                # A failed request is not a negative result, it is retried next time
+                print(f"Error geocoding location {address}: {str(e)}")
+        results[address] = cached.get(key, fetched.get(key))
+    geocode_cache.put_many(fetched)
+    return results
+
+
+def geocode(address):
+    """
+    Resolves one address string, see geocode_many.
+
+    Returns:
+    - tuple: (lat, lng), or None when it could not be resolved
+    """
+    return geocode_many([address]).get(address)
+
+
+def post_geocoder():
+    """
+    The geocoder used when a ride is posted or updated: geocode_many when GEOCODE_ON_POST is
+    set, so the address strings of rides get coordinates once, or None.
+    """
+    from api.config import BaseConfig
+    return geocode_many if BaseConfig.GEOCODE_ON_POST else None
@@ -0,0 +1,164 @@
+import numpy as np
+
+DEFAULT_LEAF_SIZE = 32
+DEFAULT_REBUILD_RATIO = 0.1
+MIN_REBUILD_THRESHOLD = 256
+
+
+class KDTree:
+    """
+    Array-backed, bulk-loaded k-d tree for axis-aligned range queries.
+
+    Nodes are kept in flat NumPy arrays, and every node stores the bounding box of its points,
+    so a query skips whole subtrees that are outside the range and takes whole subtrees that are
+    inside it. Leaves are checked with one vectorized comparison.
+    """
+
+    def __init__(self, ids, points, leaf_size=DEFAULT_LEAF_SIZE):
+        self.ids = np.asarray(ids)
+        self.points = np.asarray(points, dtype=float)
+        self.leaf_size = leaf_size
+
+        node_start, node_end, node_left, node_right = [], [], [], []
+        order = np.arange(len(self.ids))
+        stack = [(0, len(self.ids), None, None)]
+        while stack:
+            start, end, parent, is_left = stack.pop()
+            node = len(node_start)
+            node_start.append(start)
+            node_end.append(end)
+            node_left.append(-1)
+            node_right.append(-1)
+            if parent is not None:
+                if is_left:
+                    node_left[parent] = node
+                else:
+                    node_right[parent] = node
+
+            if end - start <= leaf_size:
+                continue
+            segment = self.points[order[start:end]]
+            dim = int(np.argmax(segment.max(axis=0) - segment.min(axis=0)))
+            mid = (end - start) // 2
+            order[start:end] = order[start:end][np.argpartition(segment[:, dim], mid)]
+            stack.append((start + mid, end, node, False))
+            stack.append((start, start + mid, node, True))
+
+        self.ids = self.ids[order]
+        self.points = self.points[order]
+        self.node_start = np.array(node_start, dtype=np.int64)
+        self.node_end = np.array(node_end, dtype=np.int64)
+        self.node_left = np.array(node_left, dtype=np.int64)
+        self.node_right = np.array(node_right, dtype=np.int64)
+
+        dims = self.points.shape[1]
+        self.node_min = np.empty((len(node_start), dims))
+        self.node_max = np.empty((len(node_start), dims))
+        for node in range(len(node_start) - 1, -1, -1):
+            if self.node_left[node] == -1:
+                segment = self.points[self.node_start[node]:self.node_end[node]]
+                if len(segment):
+                    self.node_min[node] = segment.min(axis=0)
+                    self.node_max[node] = segment.max(axis=0)
+            else:
+                left, right = self.node_left[node], self.node_right[node]
+                self.node_min[node] = np.minimum(self.node_min[left], self.node_min[right])
+                self.node_max[node] = np.maximum(self.node_max[left], self.node_max[right])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def range_query(self, mins, maxs):
+        """
+        Returns the IDs of all points p with mins <= p <= maxs in every dimension.
+        """
+        if not len(self.ids):
+            return self.ids[:0]
+        mins = np.asarray(mins, dtype=float)
+        maxs = np.asarray(maxs, dtype=float)
+        results = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if np.any(self.node_max[node] < mins) or np.any(self.node_min[node] > maxs):
+                continue
+            start, end = self.node_start[node], self.node_end[node]
+            if np.all(self.node_min[node] >= mins) and np.all(self.node_max[node] <= maxs):
+                results.append(self.ids[start:end])
+            elif self.node_left[node] == -1:
+                segment = self.points[start:end]
+                results.append(self.ids[start:end][np.all((segment >= mins) & (segment <= maxs), axis=1)])
+            else:
+                stack.append(self.node_right[node])
+                stack.append(self.node_left[node])
+        return np.concatenate(results) if results else self.ids[:0]
+
+
+class DynamicKDTree:
+    """
+    KDTree that supports incremental inserts and deletes.
+
+    Inserts go to a small pending buffer and deletes leave tombstones in the static tree. Both are
+    folded into a fresh bulk-loaded tree once they exceed rebuild_ratio of the tree size.
+    """
+
+    def __init__(self, dims, leaf_size=DEFAULT_LEAF_SIZE, rebuild_ratio=DEFAULT_REBUILD_RATIO):
+        self.dims = dims
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self._points = {}
+        self._tree = KDTree([], np.empty((0, dims)), leaf_size)
+        self._tree_ids = set()
+        self._pending = {}
+        self._deleted = set()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, item_id):
+        return item_id in self._points
+
+    def bulk_load(self, ids, points):
+        """
+        Replaces the content of the tree with the given points.
+        """
+        self._points = {item_id: tuple(point) for item_id, point in zip(ids, points)}
+        self.rebuild()
+
+    def rebuild(self):
+        ids = list(self._points)
+        points = np.array([self._points[item_id] for item_id in ids], dtype=float).reshape(len(ids), self.dims)
+        self._tree = KDTree(np.array(ids, dtype=object), points, self.leaf_size)
+        self._tree_ids = set(ids)
+        self._pending.clear()
+        self._deleted.clear()
+
+    def insert(self, item_id, point):
+        self.delete(item_id)
+        self._points[item_id] = tuple(point)
+        self._pending[item_id] = tuple(point)
+        self._maybe_rebuild()
+
+    def delete(self, item_id):
+        if self._points.pop(item_id, None) is None:
+            return
+        if self._pending.pop(item_id, None) is None or item_id in self._tree_ids:
+            self._deleted.add(item_id)
+        self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        threshold = max(MIN_REBUILD_THRESHOLD, self.rebuild_ratio * len(self._tree))
+        if len(self._pending) + len(self._deleted) > threshold:
+            self.rebuild()
+
+    def range_query(self, mins, maxs):
+        """
+        Returns the IDs of all live points inside the box [mins, maxs].
+        """
+        found = [item_id for item_id in self._tree.range_query(mins, maxs) if item_id not in self._deleted]
+        if self._pending:
+            pending_ids = list(self._pending)
+            pending_points = np.array([self._pending[item_id] for item_id in pending_ids], dtype=float)
+            inside = np.all((pending_points >= mins) & (pending_points <= maxs), axis=1)
+            found.extend(item_id for item_id, keep in zip(pending_ids, inside) if keep)
+        return found
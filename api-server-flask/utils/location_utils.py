@@ -1,4 +1,85 @@
 import re
+import threading
+from collections import OrderedDict
+from math import radians, degrees, cos
+
+EARTH_RADIUS_KM = 6371
+
+# Pads the bounding box so that the ellipsoidal geodesic never falls outside the spherical box
+BOUNDING_BOX_PADDING = 1.01
+
+DEFAULT_LOCATION_CACHE_SIZE = 4096
+
+# "latitude,longitude" with decimal coordinates, compiled once
+LOCATION_PATTERN = re.compile(r"^(-?\d+\.\d+),(-?\d+\.\d+)$")
+
+_SEPARATOR_PATTERN = re.compile(r"\s*,\s*")
+
+
+class ParsedLocationCache:
+    """
+    Bounded LRU cache of parsed (lat, lng) tuples keyed by location string.
+
+    The same ride and search locations are parsed over and over, so parse_location looks them
+    up here first. Only valid locations are cached; invalid strings are rejected by the
+    compiled pattern on every call.
+    """
+
+    def __init__(self, max_entries=DEFAULT_LOCATION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_entries):
+        with self._lock:
+            self.max_entries = max_entries
+            while len(self._entries) > max(max_entries, 0):
+                self._entries.popitem(last=False)
+
+    def get(self, location_str):
+        """
+        Returns the cached (lat, lng) of a location string, or None on a miss.
+        """
+        with self._lock:
+            location = self._entries.get(location_str)
+            if location is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(location_str)
+            self.hits += 1
+            return location
+
+    def put(self, location_str, location):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[location_str] = location
+            self._entries.move_to_end(location_str)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: entry count, hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+location_cache = ParsedLocationCache()
+
 
 def parse_location(location_str):
     """
@@ -10,14 +91,68 @@ def parse_location(location_str):
     Returns:
     - tuple: (lat, lng) if valid, else raises ValueError
     """
-    pattern = r"^-?\d+\.\d+,-?\d+\.\d+$"
-    if not re.match(pattern, location_str):
+    location = location_cache.get(location_str)
+    if location is None:
+        location = _parse_location(location_str)
+        location_cache.put(location_str, location)
+    return location
+
+
+def _parse_location(location_str):
+    match = LOCATION_PATTERN.match(location_str)
+    if not match:
         raise ValueError("Invalid location format. Expected format: 'latitude,longitude'")
 
+    lat, lng = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        raise ValueError("Error parsing location: Invalid latitude or longitude values")
+    return lat, lng
+
+
+def try_parse_location(location_str):
+    """
+    Parses a location string like parse_location, but does not raise.
+
+    Parameters:
+    - location_str: str, the location string to parse
+
+    Returns:
+    - tuple: (lat, lng) if valid, else (None, None)
+    """
     try:
-        lat, lng = map(float, location_str.split(','))
-        if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
-            raise ValueError("Invalid latitude or longitude values")
-        return lat, lng
-    except Exception as e:
-        raise ValueError(f"Error parsing location: {str(e)}")
\ No newline at end of file
+        return parse_location(location_str)
+    except (ValueError, TypeError):
+        return None, None
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Calculates a latitude/longitude box that contains every point within radius_km of (lat, lng).
+
+    Parameters:
+    - lat: float, latitude of the center point
+    - lng: float, longitude of the center point
+    - radius_km: float, the radius in kilometers
+
+    Returns:
+    - tuple: (min_lat, max_lat, min_lng, max_lng). The longitude range is (-180, 180) when the
+      box reaches a pole or crosses the antimeridian.
+    """
+    delta_lat = degrees(radius_km * BOUNDING_BOX_PADDING / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+
+    delta_lng = degrees(radius_km * BOUNDING_BOX_PADDING / (EARTH_RADIUS_KM * cos(radians(max(abs(min_lat), abs(max_lat))))))
+    min_lng, max_lng = lng - delta_lng, lng + delta_lng
+    if min_lng < -180 or max_lng > 180:
+        return min_lat, max_lat, -180, 180
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def normalize_address(address):
+    """
+    Lookup key of an address or place name: case-folded, with single spaces and ", " between
+    its parts, so "Main St ,Tel Aviv" and "main st, tel aviv" are the same key.
+    """
+    return _SEPARATOR_PATTERN.sub(", ", " ".join(address.split())).strip(" ,").casefold()
@@ -1,44 +1,238 @@
-from math import radians, sin, cos, sqrt, atan2
+from concurrent.futures import wait
+
+import numpy as np
+
+from utils.batch_distance import haversine_km
+from utils.location_utils import try_parse_location
+from utils.route_sampling import great_circle_route, resample_route, decode_route, ROUTE_SAMPLE_SPACING_KM
+
+# Limits of one Google distance matrix request
+GOOGLE_MATRIX_MAX_DIMENSION = 25
+GOOGLE_MATRIX_MAX_ELEMENTS = 100
 
 class MapsService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None, road_graph=None, **client_options):
+        """
+        Parameters:
+        - api_key: str (optional), the Google Maps API key; without it distances are computed locally
+        - cache: DistanceCache (optional), in front of the Google distance matrix
+        - road_graph: RoadGraph (optional), the offline road network of the local distances
+        - client_options: the options of PooledMapsClient, e.g. timeouts and the circuit breaker
+        """
         self.api_key = api_key
+        # Local distances are driving distances on the road graph where it routes, haversine elsewhere
+        self.road_graph = road_graph
+        # DistanceCache in front of the Google distance matrix, unused by the local distances
+        self.cache = cache
         if self.api_key:
-            import googlemaps
-            self.client = googlemaps.Client(key=self.api_key)
+            from utils.maps_client import PooledMapsClient
+            self.client = PooledMapsClient(self.api_key, **client_options)
         else:
             self.client = None
 
     def distance_matrix(self, origins, destinations, mode):
+        """
+        Distances between every origin and every destination, in the Google distance matrix
+        response format. With a Google client the matrix is requested in chunks within the API
+        limits; otherwise it is computed locally, see local_matrix.
+
+        Parameters:
+        - origins: list, "lat,lng" strings or (lat, lng) tuples; addresses need the Google client
+        - destinations: list, "lat,lng" strings or (lat, lng) tuples
+        - mode: str, the travel mode passed to Google
+
+        Returns:
+        - dict: {'rows': [{'elements': [...]}, ...]}, one row per origin and one element per destination
+        """
         if self.client:
-            # Use the actual Google Maps API client
-            return self.client.distance_matrix(origins=origins, destinations=destinations, mode=mode)
+            return self._google_distance_matrix(origins, destinations, mode)
+
+        return {'status': 'OK', 'rows': [{'elements': row} for row in self._local_elements(origins, destinations)]}
+
+    def _local_elements(self, origins, destinations, fallback=False):
+        distances, routed = self.local_matrix(origins, destinations)
+        rows = []
+        for row, routed_row in zip(distances.tolist(), routed.tolist()):
+            elements = []
+            for distance, is_routed in zip(row, routed_row):
+                if distance != distance:
+                    elements.append({'status': 'NOT_FOUND'})
+                    continue
+                element = {'status': 'OK', 'distance': {'value': distance * 1000}}  # convert to meters
+                if fallback:
+                    # Marks a distance that replaces a failed Google request, so it is not cached
+                    element['fallback'] = 'road_graph' if is_routed else 'haversine'
+                elements.append(element)
+            rows.append(elements)
+        return rows
+
+    def local_matrix(self, origins, destinations):
+        """
+        Distances computed without Google: shortest driving distances on the offline road graph,
+        one search per origin, and haversine distances for the pairs it cannot route or when no
+        road graph is loaded.
+
+        Returns:
+        - tuple: (distances, routed), a len(origins) x len(destinations) array of kilometers, NaN
+          for points that are not coordinates, and a boolean array of the pairs the road graph routed
+        """
+        distances = self.haversine_matrix(origins, destinations)
+        if self.road_graph is None:
+            return distances, np.zeros(distances.shape, dtype=bool)
+        origin_lats, origin_lngs = self._coordinates(origins)
+        destination_lats, destination_lngs = self._coordinates(destinations)
+        road = self.road_graph.distance_matrix_km(list(zip(origin_lats, origin_lngs)),
+                                                  list(zip(destination_lats, destination_lngs)))
+        routed = ~np.isnan(road)
+        distances[routed] = road[routed]
+        return distances, routed
+
+    def distance_matrix_km(self, origins, destinations, mode='driving'):
+        """
+        Distances between every origin and every destination as an array, without building the
+        response dictionaries when no Google client is configured.
+
+        Returns:
+        - numpy.ndarray: len(origins) x len(destinations) distances in kilometers, NaN where no
+          distance was found
+        """
+        if not self.client:
+            return self.local_matrix(origins, destinations)[0]
+        result = self._google_distance_matrix(origins, destinations, mode)
+        return np.array([[element['distance']['value'] / 1000 if element.get('status') == 'OK' else np.nan
+                          for element in row['elements']] for row in result['rows']], dtype=float).reshape(
+            len(origins), len(destinations))
+
+    def _google_distance_matrix(self, origins, destinations, mode):
+        origins = [self._as_location(origin) for origin in origins]
+        destinations = [self._as_location(destination) for destination in destinations]
+        elements = [[None] * len(destinations) for _ in origins]
+
+        # Pairs of coordinates are served from the distance cache when possible
+        keys = {}
+        if self.cache is not None:
+            origin_points = [try_parse_location(origin) for origin in origins]
+            destination_points = [try_parse_location(destination) for destination in destinations]
+            keys = {(i, j): self.cache.key_for(origin_point, destination_point, mode)
+                    for i, origin_point in enumerate(origin_points) if origin_point[0] is not None
+                    for j, destination_point in enumerate(destination_points) if destination_point[0] is not None}
+            cached = self.cache.get_many(list(keys.values()))
+            for (i, j), key in keys.items():
+                if key in cached:
+                    elements[i][j] = {'status': 'OK', 'distance': {'value': cached[key] * 1000}}
+
+        # Only the rows and columns with missing pairs are requested
+        missing_rows = [i for i, row in enumerate(elements) if None in row]
+        missing_columns = [j for j in range(len(destinations)) if any(elements[i][j] is None for i in missing_rows)]
+        fetched = self._request_matrix([origins[i] for i in missing_rows],
+                                       [destinations[j] for j in missing_columns], mode)
+        new_distances = {}
+        for i, fetched_row in zip(missing_rows, fetched):
+            for j, element in zip(missing_columns, fetched_row):
+                if elements[i][j] is None:
+                    elements[i][j] = element
+                    if (i, j) in keys and element.get('status') == 'OK' and 'fallback' not in element:
+                        new_distances[keys[(i, j)]] = element['distance']['value'] / 1000
+        if self.cache is not None:
+            self.cache.put_many(new_distances)
+        return {'status': 'OK', 'rows': [{'elements': row} for row in elements]}
+
+    def _request_matrix(self, origins, destinations, mode):
+        """
+        Requests a distance matrix from Google in chunks within the API limits. With the pooled
+        client the chunks are requested concurrently, and a chunk whose request fails or is
+        rejected by the open circuit breaker is filled with local distances.
+
+        Returns:
+        - list: one list of response elements per origin
+        """
+        columns = min(len(destinations), GOOGLE_MATRIX_MAX_DIMENSION) or 1
+        rows_per_chunk = max(min(GOOGLE_MATRIX_MAX_DIMENSION, GOOGLE_MATRIX_MAX_ELEMENTS // columns), 1)
+        chunks = [(row_start, column_start)
+                  for row_start in range(0, len(origins), rows_per_chunk)
+                  for column_start in range(0, len(destinations), columns)]
+
+        def arguments(row_start, column_start):
+            return {'origins': origins[row_start:row_start + rows_per_chunk],
+                    'destinations': destinations[column_start:column_start + columns], 'mode': mode}
+
+        submit = getattr(self.client, 'submit', None)
+        if submit is not None:
+            futures = [submit('distance_matrix', **arguments(*chunk)) for chunk in chunks]
+            wait(futures)
         else:
-            # Use the Haversine formula for distance calculation
-            origin = origins[0].split(',')
-            destination = destinations[0].split(',')
+            futures = [None] * len(chunks)
+
+        rows = [[] for _ in origins]
+        for (row_start, column_start), future in zip(chunks, futures):
+            chunk_arguments = arguments(row_start, column_start)
+            try:
+                chunk = future.result() if future is not None else self.client.distance_matrix(**chunk_arguments)
+                chunk_rows = [row['elements'] for row in chunk['rows']]
+            except Exception as e:
+                if submit is None:
+                    raise
+                print(f"Error fetching distances, using local distances: {str(e)}")
+                chunk_rows = self._local_elements(chunk_arguments['origins'], chunk_arguments['destinations'],
+                                                  fallback=True)
+            for offset, elements in enumerate(chunk_rows):
+                rows[row_start + offset].extend(elements)
+        return rows
 
-            lat1, lon1 = float(origin[0]), float(origin[1])
-            lat2, lon2 = float(destination[0]), float(destination[1])
+    @staticmethod
+    def _as_location(point):
+        return point if isinstance(point, str) else f"{point[0]},{point[1]}"
+
+    @staticmethod
+    def _coordinates(points):
+        lats = np.full(len(points), np.nan)
+        lngs = np.full(len(points), np.nan)
+        for i, point in enumerate(points):
+            lat, lng = try_parse_location(point) if isinstance(point, str) else point
+            if lat is not None:
+                lats[i], lngs[i] = lat, lng
+        return lats, lngs
 
-            # Calculate the distance using the Haversine formula
-            distance_km = self.haversine(lat1, lon1, lat2, lon2)
+    def haversine_matrix(self, origins, destinations):
+        """
+        Great-circle distances in kilometers between every origin and every destination, NaN
+        for points that are not coordinates.
+        """
+        origin_lats, origin_lngs = self._coordinates(origins)
+        destination_lats, destination_lngs = self._coordinates(destinations)
+        return haversine_km(origin_lats[:, None], origin_lngs[:, None], destination_lats[None, :],
+                            destination_lngs[None, :])
 
-            return {
-                'rows': [{
-                    'elements': [{
-                        'status': 'OK',
-                        'distance': {'value': distance_km * 1000}  # convert to meters
-                    }]
-                }]
-            }
+    def route(self, origin, destination, spacing_km=ROUTE_SAMPLE_SPACING_KM):
+        """
+        Samples the driving route between two points every spacing_km kilometers. Uses Google
+        directions when a client is configured, and the great-circle arc otherwise or when
+        directions are not available.
+
+        Parameters:
+        - origin: tuple, (lat, lng) of the start
+        - destination: tuple, (lat, lng) of the end
+        - spacing_km: float (optional), the maximal distance between consecutive samples
+
+        Returns:
+        - tuple: (lats, lngs) numpy arrays in driving order
+        """
+        if self.client:
+            try:
+                routes = self.client.directions(origin=f"{origin[0]},{origin[1]}",
+                                                destination=f"{destination[0]},{destination[1]}", mode='driving')
+                if routes:
+                    lats, lngs = decode_route(routes[0]['overview_polyline']['points'])
+                    return resample_route(lats, lngs, spacing_km)
+            except Exception as e:
+                print(f"Error fetching directions, using the great-circle route: {str(e)}")
+        return great_circle_route(origin[0], origin[1], destination[0], destination[1], spacing_km)
 
     @staticmethod
     def haversine(lat1, lon1, lat2, lon2):
-        R = 6371  # Radius of the Earth in kilometers
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        distance = R * c
-        return distance
+        """
+        Great-circle distance in kilometers. lat2 and lon2 may also be arrays, in which case
+        an array of distances is returned.
+        """
+        distance = haversine_km(lat1, lon1, lat2, lon2)
+        return float(distance) if distance.ndim == 0 else distance
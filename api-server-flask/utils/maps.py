@@ -1,12 +1,40 @@
+import os
+
 from api.config import BaseConfig
+from utils.distance_cache import DistanceCache
 from utils.map_service import MapsService
+from utils.maps_client import CircuitBreaker
+from utils.road_graph import RoadGraph
+
+# Driving distances from Google are cached in memory and on disk
+distance_cache = DistanceCache(max_entries=BaseConfig.DISTANCE_CACHE_SIZE,
+                               ttl_seconds=BaseConfig.DISTANCE_CACHE_TTL_SECONDS,
+                               path=BaseConfig.DISTANCE_CACHE_PATH or None) \
+    if BaseConfig.GOOGLE_MAPS_API_KEY else None
+
+# Driving distances without Google are routed on the offline road network when there is one
+road_graph = RoadGraph.load(BaseConfig.ROAD_GRAPH_PATH, BaseConfig.ROAD_GRAPH_MAX_SNAP_KM) \
+    if BaseConfig.ROAD_GRAPH_PATH and os.path.exists(BaseConfig.ROAD_GRAPH_PATH) else None
+
+# Google calls that fail or are slow open the breaker, and distances fall back to haversine
+maps_breaker = CircuitBreaker(failure_threshold=BaseConfig.MAPS_BREAKER_FAILURES,
+                              reset_timeout_seconds=BaseConfig.MAPS_BREAKER_RESET_SECONDS,
+                              slow_call_seconds=BaseConfig.MAPS_SLOW_CALL_SECONDS)
 
 # Initialize the MapsService with or without the API key
-gmaps = MapsService(api_key=BaseConfig.GOOGLE_MAPS_API_KEY)
+gmaps = MapsService(api_key=BaseConfig.GOOGLE_MAPS_API_KEY, cache=distance_cache, road_graph=road_graph,
+                    base_url=BaseConfig.MAPS_BASE_URL,
+                    connect_timeout=BaseConfig.MAPS_CONNECT_TIMEOUT_SECONDS,
+                    read_timeout=BaseConfig.MAPS_READ_TIMEOUT_SECONDS,
+                    pool_size=BaseConfig.MAPS_POOL_SIZE,
+                    max_concurrency=BaseConfig.MAPS_MAX_CONCURRENCY,
+                    breaker=maps_breaker)
 
 def calculate_distance(origin, destination):
     """
-    Calculates the driving distance between two locations using Google Maps API.
+    Calculates the driving distance between two locations using Google Maps API. Without an
+    API key, while the Maps circuit breaker is open or when the request fails, it is computed
+    locally: on the offline road graph when one is loaded, else with the haversine formula.
 
     Parameters:
     - origin: tuple, (lat, lng) of the origin
@@ -26,3 +54,73 @@ def calculate_distance(origin, destination):
             raise ValueError("Invalid response from Google Maps API")
     except Exception as e:
         raise ValueError(f"Error calculating distance: {str(e)}")
+
+
+def calculate_distances(origins, destinations):
+    """
+    Calculates the driving distances between every origin and every destination with as few
+    Google Maps API calls as its limits allow, or locally without an API key: one road graph
+    search per origin, or one haversine pass.
+
+    Parameters:
+    - origins: list, (lat, lng) tuples or "lat,lng" strings of the origins
+    - destinations: list, (lat, lng) tuples or "lat,lng" strings of the destinations
+
+    Returns:
+    - numpy.ndarray: len(origins) x len(destinations) distances in kilometers, NaN for the pairs
+      without a route; raises ValueError when the request fails
+    """
+    try:
+        return gmaps.distance_matrix_km(origins, destinations, mode='driving')
+    except Exception as e:
+        raise ValueError(f"Error calculating distances: {str(e)}")
+
+
+def calculate_route(origin, destination):
+    """
+    Samples the driving route between two locations.
+
+    Parameters:
+    - origin: tuple, (lat, lng) of the origin
+    - destination: tuple, (lat, lng) of the destination
+
+    Returns:
+    - tuple: (lats, lngs) numpy arrays of the route points in driving order
+    """
+    return gmaps.route(origin, destination)
+
+
+def warm_distance_cache(pairs):
+    """
+    Fetches the distances of origin-destination pairs that are not cached yet, grouped by
+    origin so each origin costs one chunked matrix request.
+
+    Parameters:
+    - pairs: iterable, ((lat, lng), (lat, lng)) origin-destination pairs
+
+    Returns:
+    - dict: the number of requested pairs and the cache statistics
+    """
+    by_origin = {}
+    for origin, destination in pairs:
+        by_origin.setdefault(tuple(origin), []).append(tuple(destination))
+    if distance_cache is not None:
+        for origin, destinations in by_origin.items():
+            gmaps.distance_matrix([origin], destinations, mode='driving')
+    return {"pairs": sum(len(destinations) for destinations in by_origin.values()),
+            "stats": distance_cache.stats() if distance_cache is not None else None}
+
+
+def report_distance_cache():
+    """
+    Scheduled report of the distance cache hit rates and of the Maps circuit breaker.
+    """
+    if gmaps.client is not None:
+        stats = maps_breaker.stats()
+        print(f"> Google Maps circuit {stats['state']}: {stats['calls']} calls, {stats['rejected']} rejected, "
+              f"opened {stats['opened']} times")
+    if distance_cache is not None:
+        stats = distance_cache.stats()
+        print(f"> Distance cache: hit rate {stats['hit_rate']:.1%} (memory {stats['memory_hit_rate']:.1%}), "
+              f"{stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} misses")
+        distance_cache.purge_expired()
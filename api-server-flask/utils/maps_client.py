@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 2
+DEFAULT_READ_TIMEOUT_SECONDS = 5
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT_SECONDS = 30
+DEFAULT_SLOW_CALL_SECONDS = 3
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling Google while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for a while.
+
+    The breaker is closed while calls succeed. After failure_threshold consecutive failures,
+    counting the calls slower than slow_call_seconds as failures, it opens and rejects calls for
+    reset_timeout_seconds. Then it is half-open: one trial call is let through, which closes the
+    breaker when it succeeds and opens it again when it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout_seconds=DEFAULT_RESET_TIMEOUT_SECONDS, slow_call_seconds=DEFAULT_SLOW_CALL_SECONDS,
+                 name='Google Maps'):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.failures = 0
+        self.calls = 0
+        self.rejected = 0
+        self.opened_count = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        Checks whether a call may go through, reserving the trial call when half-open.
+
+        Returns:
+        - bool: False while the breaker is open
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout_seconds:
+                    self.rejected += 1
+                    return False
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN:
+                if self._trial_running:
+                    self.rejected += 1
+                    return False
+                self._trial_running = True
+            self.calls += 1
+            return True
+
+    def record_success(self, duration):
+        """
+        Records a call that returned, as a failure when it took longer than slow_call_seconds.
+        """
+        if self.slow_call_seconds and duration > self.slow_call_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("%s circuit closed", self.name)
+            self.failures = 0
+            self._trial_running = False
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened_count += 1
+                    logger.warning("%s circuit opened after %d failures, retrying in %ss", self.name, self.failures,
+                                   self.reset_timeout_seconds)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            self._state = self.CLOSED
+
+    def stats(self):
+        """
+        Returns:
+        - dict: state, consecutive failures, calls let through, rejected calls and times opened
+        """
+        state = self.state
+        with self._lock:
+            return {"state": state, "failures": self.failures, "calls": self.calls, "rejected": self.rejected,
+                    "opened": self.opened_count}
+
+
+class PooledMapsClient:
+    """
+    googlemaps.Client behind a keep-alive connection pool, per-call timeouts, a bounded pool of
+    worker threads and a circuit breaker.
+
+    Every call goes through the breaker: while it is open the call raises CircuitOpenError
+    without touching the network, so callers can fall back to haversine distances at once.
+    submit() runs calls on the worker threads, so many requests can be in flight together
+    without blocking the request thread for each of them in turn.
+
+    Parameters:
+    - api_key: str, the Google Maps API key
+    - base_url: str (optional), the Maps server, e.g. a local stub server in tests
+    - connect_timeout, read_timeout: float (optional), the per-call timeouts in seconds
+    - pool_size: int (optional), the number of kept-alive connections
+    - max_concurrency: int (optional), the number of calls in flight at once
+    - breaker: CircuitBreaker (optional)
+    """
+
+    def __init__(self, api_key, base_url=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout=DEFAULT_READ_TIMEOUT_SECONDS, pool_size=DEFAULT_POOL_SIZE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, breaker=None):
+        import googlemaps
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        options = {}
+        if base_url:
+            options['base_url'] = base_url.rstrip('/')
+        # Server errors are retried for at most read_timeout in total and over-query-limit replies
+        # not at all, the breaker decides when to try again
+        self.client = googlemaps.Client(key=api_key, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                        retry_timeout=read_timeout, retry_over_query_limit=False,
+                                        requests_session=self.session, **options)
+        self.breaker = breaker or CircuitBreaker()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='maps')
+
+    def call(self, method, **kwargs):
+        """
+        Calls a googlemaps.Client method through the circuit breaker.
+
+        Parameters:
+        - method: str, the name of the method, e.g. 'distance_matrix'
+        - kwargs: the arguments of the method
+
+        Returns:
+        - the response of the method; raises CircuitOpenError while the breaker is open, or the
+          googlemaps error of a failed call
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Google Maps circuit is open, {method} was not called")
+        start = time.monotonic()
+        try:
+            result = getattr(self.client, method)(**kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success(time.monotonic() - start)
+        return result
+
+    def submit(self, method, **kwargs):
+        """
+        Runs call() on the worker threads.
+
+        Returns:
+        - concurrent.futures.Future: resolves to the response of the call
+        """
+        return self.executor.submit(self.call, method, **kwargs)
+
+    def distance_matrix(self, origins, destinations, mode='driving'):
+        return self.call('distance_matrix', origins=origins, destinations=destinations, mode=mode)
+
+    def directions(self, origin, destination, mode='driving'):
+        return self.call('directions', origin=origin, destination=destination, mode=mode)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
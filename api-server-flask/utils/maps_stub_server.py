@@ -0,0 +1,133 @@
+"""
+Local stand-in for the Google Maps distance matrix and directions endpoints, to exercise the
+Maps client offline. Distances are great-circle distances; latency and HTTP errors can be
+injected to trip the circuit breaker.
+
+Usage:
+    python -m utils.maps_stub_server --port 8765 --latency 4
+    GOOGLE_MAPS_API_KEY=AIza-stub MAPS_BASE_URL=http://127.0.0.1:8765 flask run
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.batch_distance import haversine_km
+from utils.location_utils import try_parse_location
+from utils.route_sampling import encode_route, great_circle_route
+
+
+class _MapsStubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.request_count += 1
+        if stub.latency_seconds:
+            time.sleep(stub.latency_seconds)
+        if stub.error_status:
+            self._reply(stub.error_status, {"status": "UNKNOWN_ERROR"})
+            return
+
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == '/maps/api/distancematrix/json':
+            self._reply(200, self._distance_matrix(params))
+        elif url.path == '/maps/api/directions/json':
+            self._reply(200, self._directions(params))
+        else:
+            self._reply(404, {"status": "NOT_FOUND"})
+
+    @staticmethod
+    def _distance_matrix(params):
+        origins = [try_parse_location(origin) for origin in params.get('origins', '').split('|')]
+        destinations = [try_parse_location(destination) for destination in params.get('destinations', '').split('|')]
+        rows = []
+        for origin_lat, origin_lng in origins:
+            elements = []
+            for destination_lat, destination_lng in destinations:
+                if origin_lat is None or destination_lat is None:
+                    elements.append({"status": "NOT_FOUND"})
+                    continue
+                meters = round(float(haversine_km(origin_lat, origin_lng, destination_lat, destination_lng)) * 1000)
+                elements.append({"status": "OK", "distance": {"text": f"{meters / 1000:.1f} km", "value": meters}})
+            rows.append({"elements": elements})
+        return {"status": "OK", "rows": rows}
+
+    @staticmethod
+    def _directions(params):
+        origin_lat, origin_lng = try_parse_location(params.get('origin', ''))
+        destination_lat, destination_lng = try_parse_location(params.get('destination', ''))
+        if origin_lat is None or destination_lat is None:
+            return {"status": "ZERO_RESULTS", "routes": []}
+        lats, lngs = great_circle_route(origin_lat, origin_lng, destination_lat, destination_lng, spacing_km=5)
+        return {"status": "OK", "routes": [{"overview_polyline": {"points": encode_route(lats, lngs)}}]}
+
+    def _reply(self, status_code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MapsStubServer:
+    """
+    Threaded stub server. latency_seconds and error_status may be changed while it runs.
+
+    Parameters:
+    - host: str (optional), the interface to bind
+    - port: int (optional), 0 picks a free port
+    - latency_seconds: float (optional), the delay before every reply
+    - error_status: int (optional), an HTTP status to answer every request with
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_seconds=0, error_status=None):
+        self.latency_seconds = latency_seconds
+        self.error_status = error_status
+        self.request_count = 0
+        self._server = ThreadingHTTPServer((host, port), _MapsStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Google Maps stub server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='seconds to wait before every reply')
+    parser.add_argument('--error-status', type=int, default=None, help='HTTP status to answer every request with')
+    args = parser.parse_args()
+
+    stub = MapsStubServer(args.host, args.port, args.latency, args.error_status)
+    print(f"> Maps stub server listening on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
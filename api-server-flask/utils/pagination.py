@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import jwt
+
+CURSOR_ALGORITHM = "HS256"
+
+
+def encode_cursor(departure_datetime, ride_id):
+    """
+    Creates an opaque, signed cursor pointing after the given (departure_datetime, id) position.
+
+    Parameters:
+    - departure_datetime: datetime, departure time of the last ride on the page
+    - ride_id: int, ID of the last ride on the page
+
+    Returns:
+    - str: the cursor
+    """
+    from api.config import BaseConfig
+    return jwt.encode({"d": departure_datetime.isoformat(), "id": ride_id}, BaseConfig.SECRET_KEY,
+                      algorithm=CURSOR_ALGORITHM)
+
+
+def decode_cursor(cursor):
+    """
+    Reads a cursor created by encode_cursor.
+
+    Parameters:
+    - cursor: str, the cursor sent by the client
+
+    Returns:
+    - tuple: (departure_datetime, ride_id), else raises ValueError
+    """
+    from api.config import BaseConfig
+    try:
+        data = jwt.decode(cursor, BaseConfig.SECRET_KEY, algorithms=[CURSOR_ALGORITHM])
+        return datetime.fromisoformat(data["d"]), int(data["id"])
+    except Exception:
+        raise ValueError("Invalid cursor")
@@ -1,3 +1,12 @@
+import json
+
+from flask import Response as FlaskResponse, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Rows fetched from the database per round trip while streaming
+STREAM_BATCH_SIZE = 100
+
+
 class Response:
     def __init__(self, success, message, status_code, data=None):
         self.success = success
@@ -16,3 +25,30 @@ class Response:
 
     def to_tuple(self):
         return self.to_dict(), self.status_code
+
+
+class StreamingResponse:
+    """
+    Newline-delimited JSON response that serializes rows while they are sent, so a large
+    result set is never held in memory as a whole.
+    """
+
+    def __init__(self, rows, status_code=200, headers=None):
+        self.rows = rows
+        self.status_code = status_code
+        self.headers = headers
+
+    def generate(self):
+        for row in self.rows:
+            yield json.dumps(row) + "\n"
+
+    def to_response(self):
+        return FlaskResponse(stream_with_context(self.generate()), status=self.status_code,
+                             mimetype=NDJSON_MIMETYPE, headers=self.headers)
+
+
+def wants_ndjson():
+    """
+    Returns True when the client prefers application/x-ndjson over application/json.
+    """
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
@@ -0,0 +1,216 @@
+import heapq
+from array import array
+from math import asin, cos, sin, sqrt
+
+import numpy as np
+
+from utils.batch_distance import EARTH_RADIUS_KM, haversine_km
+from utils.kd_tree import KDTree
+from utils.location_utils import bounding_box
+
+# Points further than this from every road node are not routed
+DEFAULT_MAX_SNAP_KM = 1.0
+# Road nodes closer than 6 decimals (about 0.1 m) are the same junction
+NODE_PRECISION = 6
+
+
+class RoadGraph:
+    """
+    Offline road network for driving distances, in compressed sparse row form.
+
+    Node coordinates and the edges leaving every node are kept in flat arrays: the edges of node
+    n are indices[indptr[n]:indptr[n + 1]] with their lengths in weights, in kilometers. Every
+    edge is at least as long as the great-circle distance between its ends, so the great-circle
+    distance to the target is an admissible A* heuristic.
+
+    Query points are snapped to the nearest node within max_snap_km, found with a k-d tree over
+    the node coordinates, and the snap offsets are added to the road distance.
+    """
+
+    def __init__(self, lats, lngs, indptr, indices, weights, max_snap_km=DEFAULT_MAX_SNAP_KM):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lngs = np.asarray(lngs, dtype=float)
+        self.max_snap_km = max_snap_km
+        # array.array indexing is much faster than NumPy scalars in the search loops
+        self.indptr = array('q', np.asarray(indptr, dtype=np.int64).tolist())
+        self.indices = array('q', np.asarray(indices, dtype=np.int64).tolist())
+        self.weights = array('d', np.asarray(weights, dtype=float).tolist())
+        self._radian_lats = array('d', np.radians(self.lats).tolist())
+        self._radian_lngs = array('d', np.radians(self.lngs).tolist())
+        self._tree = KDTree(np.arange(len(self.lats)), np.column_stack([self.lats, self.lngs]))
+
+    def __len__(self):
+        return len(self.lats)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, edges, max_snap_km=DEFAULT_MAX_SNAP_KM):
+        """
+        Builds a graph from road segments.
+
+        Parameters:
+        - edges: iterable, (from_lat, from_lng, to_lat, to_lng, length_km, oneway) tuples; a None
+          length is the great-circle length, and shorter lengths are raised to it
+        - max_snap_km: float (optional), see RoadGraph
+
+        Returns:
+        - RoadGraph
+        """
+        nodes = {}
+        sources, targets, lengths = [], [], []
+        for from_lat, from_lng, to_lat, to_lng, length_km, oneway in edges:
+            from_lat, from_lng, to_lat, to_lng = float(from_lat), float(from_lng), float(to_lat), float(to_lng)
+            ends = []
+            for lat, lng in ((from_lat, from_lng), (to_lat, to_lng)):
+                key = (round(lat, NODE_PRECISION), round(lng, NODE_PRECISION))
+                ends.append(nodes.setdefault(key, len(nodes)))
+            straight = float(haversine_km(from_lat, from_lng, to_lat, to_lng))
+            length_km = straight if length_km is None else max(float(length_km), straight)
+            sources.append(ends[0])
+            targets.append(ends[1])
+            lengths.append(length_km)
+            if not oneway:
+                sources.append(ends[1])
+                targets.append(ends[0])
+                lengths.append(length_km)
+
+        coordinates = np.array(list(nodes), dtype=float).reshape(-1, 2)
+        sources = np.array(sources, dtype=np.int64)
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(nodes)), out=indptr[1:])
+        return cls(coordinates[:, 0], coordinates[:, 1], indptr, np.array(targets, dtype=np.int64)[order],
+                   np.array(lengths, dtype=float)[order], max_snap_km)
+
+    @classmethod
+    def load(cls, path, max_snap_km=DEFAULT_MAX_SNAP_KM):
+        """
+        Loads a graph written by save().
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['lats'], data['lngs'], data['indptr'], data['indices'], data['weights'], max_snap_km)
+
+    def save(self, path):
+        with open(path, 'wb') as graph_file:
+            np.savez_compressed(graph_file, lats=self.lats, lngs=self.lngs,
+                                indptr=np.frombuffer(self.indptr, dtype=np.int64),
+                                indices=np.array(self.indices, dtype=np.int64),
+                                weights=np.frombuffer(self.weights, dtype=float))
+
+    def snap(self, lat, lng):
+        """
+        Finds the road node nearest to a point.
+
+        Returns:
+        - tuple: (node, distance in kilometers), or (None, None) beyond max_snap_km
+        """
+        if lat != lat or lng != lng:
+            return None, None
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, self.max_snap_km)
+        candidates = self._tree.range_query((min_lat, min_lng), (max_lat, max_lng))
+        if not len(candidates):
+            return None, None
+        distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > self.max_snap_km:
+            return None, None
+        return int(candidates[nearest]), float(distances[nearest])
+
+    def _straight_km(self, a, b):
+        lat1, lat2 = self._radian_lats[a], self._radian_lats[b]
+        delta_lng = self._radian_lngs[b] - self._radian_lngs[a]
+        h = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin(delta_lng / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * asin(sqrt(min(h, 1.0)))
+
+    def _node_distance(self, source, target):
+        # A* with the great-circle heuristic
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        best = {source: 0.0}
+        queue = [(self._straight_km(source, target), 0.0, source)]
+        while queue:
+            _, distance, node = heapq.heappop(queue)
+            if node == target:
+                return distance
+            if distance > best[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[edge]
+                candidate = distance + weights[edge]
+                if candidate < best.get(neighbour, float('inf')):
+                    best[neighbour] = candidate
+                    heapq.heappush(queue, (candidate + self._straight_km(neighbour, target), candidate, neighbour))
+        return float('nan')
+
+    def _node_distances(self, source, targets):
+        # Dijkstra from one source, stopped once every target is settled
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        remaining = set(targets)
+        settled = {}
+        best = {source: 0.0}
+        queue = [(0.0, source)]
+        while queue and remaining:
+            distance, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            settled[node] = distance
+            remaining.discard(node)
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[edge]
+                candidate = distance + weights[edge]
+                if candidate < best.get(neighbour, float('inf')):
+                    best[neighbour] = candidate
+                    heapq.heappush(queue, (candidate, neighbour))
+        return settled
+
+    def distance_km(self, origin, destination):
+        """
+        Driving distance between two (lat, lng) points, NaN when a point is off the network or
+        the destination cannot be reached.
+        """
+        source, source_offset = self.snap(*origin)
+        target, target_offset = self.snap(*destination)
+        if source is None or target is None:
+            return float('nan')
+        return source_offset + self._node_distance(source, target) + target_offset
+
+    def distances_from_km(self, origin, destinations):
+        """
+        One-to-many driving distances: a single search from the origin answers every destination,
+        e.g. all the candidates of a ride search.
+
+        Parameters:
+        - origin: tuple, (lat, lng)
+        - destinations: list, (lat, lng) tuples
+
+        Returns:
+        - numpy.ndarray: distances in kilometers, NaN for the destinations that cannot be routed
+        """
+        return self._distances_from(origin, [self.snap(*destination) for destination in destinations])
+
+    def _distances_from(self, origin, snapped):
+        distances = np.full(len(snapped), np.nan)
+        source, source_offset = self.snap(*origin)
+        if source is None:
+            return distances
+        settled = self._node_distances(source, {node for node, _ in snapped if node is not None})
+        for i, (node, offset) in enumerate(snapped):
+            if node in settled:
+                distances[i] = source_offset + settled[node] + offset
+        return distances
+
+    def distance_matrix_km(self, origins, destinations):
+        """
+        Driving distances between every origin and every destination, one search per origin.
+
+        Returns:
+        - numpy.ndarray: len(origins) x len(destinations) distances in kilometers, NaN where there
+          is no route
+        """
+        snapped = [self.snap(*destination) for destination in destinations]
+        matrix = np.full((len(origins), len(destinations)), np.nan)
+        for i, origin in enumerate(origins):
+            matrix[i] = self._distances_from(origin, snapped)
+        return matrix
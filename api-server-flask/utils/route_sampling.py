@@ -0,0 +1,140 @@
+import numpy as np
+from googlemaps.convert import decode_polyline, encode_polyline
+
+from utils.batch_distance import EARTH_RADIUS_KM, haversine_km, within_radius
+
+ROUTE_SAMPLE_SPACING_KM = 0.5
+
+
+def great_circle_route(lat1, lng1, lat2, lng2, spacing_km=ROUTE_SAMPLE_SPACING_KM):
+    """
+    Samples the great-circle arc between two points every spacing_km kilometers.
+
+    Parameters:
+    - lat1, lng1: float, the start of the route
+    - lat2, lng2: float, the end of the route
+    - spacing_km: float (optional), the maximal distance between consecutive samples
+
+    Returns:
+    - tuple: (lats, lngs) numpy arrays, both ends included
+    """
+    phi1, lam1, phi2, lam2 = np.radians([lat1, lng1, lat2, lng2])
+    start = np.array([np.cos(phi1) * np.cos(lam1), np.cos(phi1) * np.sin(lam1), np.sin(phi1)])
+    end = np.array([np.cos(phi2) * np.cos(lam2), np.cos(phi2) * np.sin(lam2), np.sin(phi2)])
+    angle = np.arccos(np.clip(start @ end, -1, 1))
+    count = max(int(np.ceil(haversine_km(lat1, lng1, lat2, lng2) / spacing_km)), 1) + 1
+    if angle < 1e-12:
+        return np.full(count, float(lat1)), np.full(count, float(lng1))
+
+    # Spherical linear interpolation between the two unit vectors
+    t = np.linspace(0, 1, count)[:, None]
+    points = (np.sin((1 - t) * angle) * start + np.sin(t * angle) * end) / np.sin(angle)
+    lats = np.degrees(np.arcsin(np.clip(points[:, 2], -1, 1)))
+    lngs = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return lats, lngs
+
+
+def resample_route(lats, lngs, spacing_km=ROUTE_SAMPLE_SPACING_KM):
+    """
+    Densifies a polyline so that consecutive points are at most spacing_km apart, by linear
+    interpolation inside every longer segment.
+
+    Returns:
+    - tuple: (lats, lngs) numpy arrays
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    if len(lats) < 2:
+        return lats, lngs
+    segments = haversine_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+    steps = np.maximum(np.ceil(segments / spacing_km).astype(int), 1)
+    offsets = np.concatenate([np.arange(step) / step for step in steps] + [[0.0]])
+    starts = np.concatenate([np.full(step, i) for i, step in enumerate(steps)] + [[len(lats) - 2]])
+    offsets[-1] = 1.0
+    return (lats[starts] + offsets * (lats[starts + 1] - lats[starts]),
+            lngs[starts] + offsets * (lngs[starts + 1] - lngs[starts]))
+
+
+def encode_route(lats, lngs):
+    """
+    Encodes sampled route points in the Google encoded polyline format.
+    """
+    return encode_polyline(list(zip(np.round(lats, 5).tolist(), np.round(lngs, 5).tolist())))
+
+
+def decode_route(polyline):
+    """
+    Decodes an encoded polyline into (lats, lngs) numpy arrays.
+    """
+    points = decode_polyline(polyline)
+    return (np.array([point['lat'] for point in points], dtype=float),
+            np.array([point['lng'] for point in points], dtype=float))
+
+
+def route_of(polyline, departure_lat, departure_lng, destination_lat, destination_lng):
+    """
+    Returns the sampled route of a ride as (lats, lngs): its stored polyline, or the great-circle
+    route when none is stored, or None when the ride has no coordinates.
+    """
+    if polyline:
+        return decode_route(polyline)
+    if departure_lat is None or destination_lat is None:
+        return None
+    return great_circle_route(departure_lat, departure_lng, destination_lat, destination_lng)
+
+
+def route_positions_within(lat, lng, lats, lngs, radius_km):
+    """
+    Finds where a route passes within radius_km of a point. The segments between the samples are
+    checked as well, so a radius smaller than the sample spacing still matches a route that
+    passes between two samples.
+
+    Segment distances are measured in a local equirectangular projection around the point, which
+    is accurate at the scale of a search radius; the samples themselves are checked with
+    within_radius.
+
+    Returns:
+    - numpy.ndarray: sorted positions along the route, as a sample index plus the fraction of the
+      following segment, of the samples and of the closest point of every segment within the radius
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    positions = np.flatnonzero(within_radius(lat, lng, lats, lngs, radius_km)).astype(float)
+    if len(lats) < 2:
+        return positions
+    km_per_degree = np.radians(EARTH_RADIUS_KM)
+    x = (lngs - lng) * km_per_degree * np.cos(np.radians(lat))
+    y = (lats - lat) * km_per_degree
+    dx, dy = np.diff(x), np.diff(y)
+    lengths = dx * dx + dy * dy
+    fractions = np.clip(-(x[:-1] * dx + y[:-1] * dy) / np.where(lengths > 0, lengths, 1), 0, 1)
+    near = np.flatnonzero(np.hypot(x[:-1] + fractions * dx, y[:-1] + fractions * dy) <= radius_km)
+    return np.union1d(positions, near + fractions[near])
+
+
+def corridor_match(lats, lngs, pickup, pickup_radius, drop, drop_radius):
+    """
+    Checks whether a route passes within pickup_radius of the pickup point and later within
+    drop_radius of the drop point.
+
+    Parameters:
+    - lats, lngs: array-like, the sampled route points in driving order
+    - pickup: tuple (optional), (lat, lng) of the pickup point
+    - pickup_radius: float (optional), the pickup radius in kilometers
+    - drop: tuple (optional), (lat, lng) of the drop point
+    - drop_radius: float (optional), the drop radius in kilometers
+
+    Returns:
+    - bool: True when the route serves the pickup before the drop
+    """
+    first_pickup = 0
+    if pickup and pickup_radius:
+        near_pickup = route_positions_within(pickup[0], pickup[1], lats, lngs, pickup_radius)
+        if not len(near_pickup):
+            return False
+        first_pickup = near_pickup[0]
+    if drop and drop_radius:
+        near_drop = route_positions_within(drop[0], drop[1], lats, lngs, drop_radius)
+        if not len(near_drop) or near_drop[-1] < first_pickup:
+            return False
+    return True
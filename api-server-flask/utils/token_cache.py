@@ -0,0 +1,207 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+DEFAULT_TOKEN_CACHE_SIZE = 2048
+DEFAULT_TOKEN_CACHE_TTL_SECONDS = 60
+
+# The queries token_required runs on a miss: the user lookup and the blocklist lookup
+QUERIES_PER_MISS = 2
+
+TokenEntry = namedtuple('TokenEntry', ['claims', 'user_id', 'email', 'jwt_auth_active', 'revoked', 'expires_at'])
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class UserSnapshot:
+    """
+    The current user of a request authorized from the token cache.
+
+    id and email come from the cache; any other attribute or method loads the Users row once,
+    on first use, and is delegated to it.
+    """
+
+    def __init__(self, user_id, email):
+        self.id = user_id
+        self.email = email
+        self._user = None
+
+    def __repr__(self):
+        return f"User {self.email}"
+
+    def toDICT(self):
+        return {'_id': self.id, 'email': self.email}
+
+    def toJSON(self):
+        return self.toDICT()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self._user is None:
+            from models import Users
+            self._user = Users.query.get(self.id)
+            if self._user is None:
+                raise AttributeError(f"User {self.id} does not exist anymore")
+        return getattr(self._user, name)
+
+
+class TokenCache:
+    """
+    Per-worker cache of checked JWT tokens, so a protected request skips the user and blocklist
+    queries of token_required.
+
+    Entries are keyed by the SHA-256 of the token and hold its decoded claims, a snapshot of the
+    user and whether the token is revoked. They expire after ttl_seconds, or earlier when the
+    token does; logging out, updating the user or changing its jwt_auth_active flag invalidates
+    them in this worker, and other workers see the change within ttl_seconds. Every invalidation
+    moves generation on, so a check that read the database before it is not stored afterwards.
+    """
+
+    def __init__(self, max_entries=DEFAULT_TOKEN_CACHE_SIZE, ttl_seconds=DEFAULT_TOKEN_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._by_user = defaultdict(set)
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def configure(self, max_entries, ttl_seconds):
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl_seconds = ttl_seconds
+            while len(self._entries) > max(max_entries, 0):
+                self._evict_oldest()
+
+    def get(self, token, endpoint=None):
+        """
+        Looks a token up and counts the hit or miss for the endpoint.
+
+        Returns:
+        - TokenEntry, or None on a miss
+        """
+        key = token_hash(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self._misses[endpoint] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits[endpoint] += 1
+            return entry
+
+    def put(self, token, claims, user, revoked, generation):
+        """
+        Stores the result of a full check of a token.
+
+        Parameters:
+        - token: str, the JWT token
+        - claims: dict, its decoded claims
+        - user: Users, the user it belongs to
+        - revoked: bool, whether the token is in the blocklist
+        - generation: int, the value of self.generation before the user and blocklist were read;
+          the entry is not stored when an invalidation happened in between, since it may be stale
+        """
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if isinstance(claims.get('exp'), (int, float)):
+            expires_at = min(expires_at, claims['exp'])
+        key = token_hash(token)
+        entry = TokenEntry(claims, user.id, user.email, user.jwt_auth_active, revoked, expires_at)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._discard(key)
+            self._entries[key] = entry
+            self._by_user[user.id].add(key)
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def invalidate_token(self, token):
+        with self._lock:
+            self.generation += 1
+            self._discard(token_hash(token))
+
+    def invalidate_user(self, user_id):
+        """
+        Drops the entries of every token of a user, e.g. after its details changed.
+        """
+        with self._lock:
+            self.generation += 1
+            for key in list(self._by_user.get(user_id, ())):
+                self._discard(key)
+
+    def invalidate_email(self, email):
+        """
+        Drops the entries of the tokens issued for an email, e.g. when an account is registered
+        with the email of a deleted one.
+        """
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, entry in self._entries.items() if entry.email == email]:
+                self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_keys = self._by_user.get(entry.user_id)
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._by_user[entry.user_id]
+
+    def _evict_oldest(self):
+        self._discard(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: entry count, hits, misses, hit rate, the queries saved and the same figures per
+          endpoint
+        """
+        with self._lock:
+            endpoints = {}
+            for endpoint in set(self._hits) | set(self._misses):
+                hits, misses = self._hits[endpoint], self._misses[endpoint]
+                endpoints[endpoint] = {"hits": hits, "misses": misses,
+                                       "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            return {"entries": len(self._entries), "hits": hits, "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                    "queries_saved": hits * QUERIES_PER_MISS, "endpoints": endpoints}
+
+
+token_cache = TokenCache()
+
+
+def report_token_cache():
+    """
+    Scheduled report of the token cache hit rates, chattiest endpoints first.
+    """
+    stats = token_cache.stats()
+    print(f"> Token cache: hit rate {stats['hit_rate']:.1%}, {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['queries_saved']} queries saved")
+    endpoints = sorted(stats["endpoints"].items(), key=lambda item: item[1]["hits"] + item[1]["misses"],
+                       reverse=True)
+    for endpoint, endpoint_stats in endpoints[:5]:
+        print(f">   {endpoint}: hit rate {endpoint_stats['hit_rate']:.1%} "
+              f"({endpoint_stats['hits']} hits, {endpoint_stats['misses']} misses)")